@@ -0,0 +1,215 @@
+"""
+This module contains functions for packing a directory of LRG XML files into
+a single archive file, and the LRGArchive class for reading it. The archive
+ends with an index of LRG ID -> byte range, so a record is found without a
+directory walk and read from a memory map without opening a file per LRG.
+
+Layout of an archive:
+	magic (4 bytes) and format version (1 byte)
+	records: each LRG XML file as a gzip member
+	index: for each LRG, its ID, record offset and record length
+	trailer: index offset, record count and the magic again
+"""
+
+
+import gzip
+import io
+import mmap
+import os
+import struct
+
+import compression
+import xml.etree.ElementTree as ET
+
+
+DEFAULT_ARCHIVE_FILE = os.path.join(os.path.expanduser("~"), ".lrg_parser",
+									"lrg_corpus.lrga")
+
+ARCHIVE_MAGIC = b'LRGA'
+ARCHIVE_VERSION = 1
+_TRAILER = struct.Struct('<QI4s')
+_INDEX_ENTRY = struct.Struct('<QQ')
+
+# Archives that have already been opened, keyed by path
+_open_archives = {}
+
+
+class LRGArchive:
+	"""Read-only view of a packed archive. The archive file is memory mapped
+	and only the index is read when it is opened.
+
+	Attributes:
+		path (str): Path to the archive
+		offsets (dict): LRG ID -> (record offset, record length)
+	"""
+	def __init__(self, path):
+		self.path = path
+		with open(path, 'rb') as f:
+			try:
+				self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError:
+				raise ValueError("Not an LRG archive: " + path)
+		try:
+			self.offsets = self._read_index()
+		except (ValueError, struct.error, UnicodeDecodeError):
+			self._map.close()
+			raise ValueError("Not an LRG archive: " + path)
+
+	def _read_index(self):
+		"""Reads the index at the end of the archive"""
+		if (len(self._map) < 5 + _TRAILER.size or
+				self._map[:4] != ARCHIVE_MAGIC or
+				self._map[4] != ARCHIVE_VERSION):
+			raise ValueError
+		index_offset, count, magic = _TRAILER.unpack_from(
+							self._map, len(self._map) - _TRAILER.size)
+		if magic != ARCHIVE_MAGIC:
+			raise ValueError
+		offsets = {}
+		position = index_offset
+		for _ in range(count):
+			length, = struct.unpack_from('<H', self._map, position)
+			position += 2
+			lrg_id = self._map[position:position + length].decode('utf-8')
+			position += length
+			offsets[lrg_id] = _INDEX_ENTRY.unpack_from(self._map, position)
+			position += _INDEX_ENTRY.size
+		return offsets
+
+	def __contains__(self, lrg_id):
+		return lrg_id in self.offsets
+
+	def __len__(self):
+		return len(self.offsets)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def close(self):
+		"""Closes the memory map of the archive"""
+		self._map.close()
+
+	def open(self, lrg_id):
+		"""Returns a stream of the decompressed XML of one LRG. Only the
+		record of that LRG is read from the archive.
+
+		Args:
+			lrg_id (str): LRG ID in the format 'LRG_123'
+		Returns:
+			xml_stream (file): Binary file object of the LRG XML
+		Raises:
+			KeyError: If the LRG is not in the archive
+		"""
+
+		offset, length = self.offsets[lrg_id]
+		return gzip.GzipFile(fileobj=io.BytesIO(
+										self._map[offset:offset + length]))
+
+	def read(self, lrg_id):
+		"""Returns the decompressed XML of one LRG as bytes"""
+		with self.open(lrg_id) as xml_stream:
+			return xml_stream.read()
+
+
+def read_lrg_id(xml_data):
+	"""Returns the LRG ID from the start of an LRG XML document, or None"""
+	try:
+		for event, element in ET.iterparse(io.BytesIO(xml_data)):
+			if element.tag == 'id':
+				return element.text
+	except ET.ParseError:
+		pass
+	return None
+
+
+def pack_archive(directory, archive_file=DEFAULT_ARCHIVE_FILE):
+	"""Packs every LRG XML file in a directory, which may be compressed,
+	into one archive. Files that are not valid LRG XML are skipped.
+
+	Args:
+		directory (str): Path to a directory of LRG XML files
+		archive_file (str): Path the archive is written to
+	Returns:
+		count (int): Number of LRGs written to the archive
+	Raises:
+		SystemExit: If the directory could not be read or the archive written
+	"""
+
+	try:
+		filenames = sorted(os.listdir(directory))
+	except OSError:
+		print("    Could not read the directory: " + str(directory))
+		raise SystemExit
+
+	offsets = {}
+	temporary_file = archive_file + "." + str(os.getpid()) + ".tmp"
+	try:
+		os.makedirs(os.path.dirname(os.path.abspath(archive_file)),
+					exist_ok=True)
+		with open(temporary_file, 'wb') as f:
+			f.write(ARCHIVE_MAGIC + struct.pack('<B', ARCHIVE_VERSION))
+			for filename in filenames:
+				if not compression.is_xml_file(filename):
+					continue
+				try:
+					with compression.open_xml_file(
+								os.path.join(directory, filename)) as xml_stream:
+						xml_data = xml_stream.read()
+				except (OSError, EOFError):
+					xml_data = b''
+				lrg_id = read_lrg_id(xml_data)
+				if lrg_id is None or lrg_id in offsets:
+					print("    Skipping invalid or duplicate LRG XML file: " +
+							filename)
+					continue
+				record = gzip.compress(xml_data, mtime=0)
+				offsets[lrg_id] = (f.tell(), len(record))
+				f.write(record)
+
+			index_offset = f.tell()
+			for lrg_id in sorted(offsets):
+				encoded = lrg_id.encode('utf-8')
+				f.write(struct.pack('<H', len(encoded)) + encoded)
+				f.write(_INDEX_ENTRY.pack(*offsets[lrg_id]))
+			f.write(_TRAILER.pack(index_offset, len(offsets), ARCHIVE_MAGIC))
+		os.replace(temporary_file, archive_file)
+	except OSError:
+		if os.path.exists(temporary_file):
+			os.remove(temporary_file)
+		print("    Could not write the archive: " + str(archive_file))
+		raise SystemExit
+	print("")
+	print("    Archive of " + str(len(offsets)) + " LRGs written to " +
+			archive_file)
+	print("")
+	return len(offsets)
+
+
+def open_archive(archive_file=DEFAULT_ARCHIVE_FILE):
+	"""Opens an archive. An opened archive is kept and only opened again if
+	the file changes.
+
+	Args:
+		archive_file (str): Path to the archive
+	Returns:
+		lrg_archive (LRGArchive): The archive
+	Raises:
+		SystemExit: If the file is missing or is not an LRG archive
+	"""
+
+	try:
+		modified = os.stat(archive_file).st_mtime
+		opened = _open_archives.get(archive_file)
+		if opened is None or opened[0] != modified:
+			if opened is not None:
+				del _open_archives[archive_file]
+				opened[1].close()
+			opened = (modified, LRGArchive(archive_file))
+			_open_archives[archive_file] = opened
+	except (OSError, ValueError):
+		print("Error: Could not read the LRG archive: " + str(archive_file))
+		raise SystemExit
+	return opened[1]
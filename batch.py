@@ -0,0 +1,631 @@
+"""
+This module contains the batch mode functions. A manifest lists many genes,
+LRG IDs or LRG XML files, and every row is turned into BED rows within a
+single run of the program. A directory of LRG XML files can also be
+processed, optionally spread across a pool of worker processes.
+"""
+
+
+import concurrent.futures
+import contextlib
+import csv
+import datetime
+import io
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+import bedgen
+import compression
+import indexcache
+import lrgparser
+import profiling
+import xmlbackend
+
+
+# Manifest columns, in order. Only the first three are required.
+MANIFEST_COLUMNS = ['id', 'referencegenome', 'transcript', 'flank', 'introns']
+
+# Manifest rows whose genes are downloaded together
+PREFETCH_ROWS = 64
+
+
+class BatchRowError(Exception):
+	"""Raised when a manifest row cannot be turned into BED rows"""
+
+
+def read_manifest(manifest_file):
+	"""Reads a tab separated manifest. Blank lines and lines starting with
+	'#' are ignored, so the manifest can carry a commented header line.
+
+	Args:
+		manifest_file (str): Path to the manifest file
+	Returns:
+		rows (list): List of dicts with the keys in MANIFEST_COLUMNS
+	Raises:
+		SystemExit: If the manifest could not be read
+	"""
+
+	rows = []
+	try:
+		with open(manifest_file, newline='') as tsv_file:
+			for fields in csv.reader(tsv_file, delimiter="\t"):
+				if not fields or not fields[0].strip():
+					continue
+				if fields[0].startswith('#'):
+					continue
+				fields = [field.strip() for field in fields]
+				fields += [''] * (len(MANIFEST_COLUMNS) - len(fields))
+				rows.append(dict(zip(MANIFEST_COLUMNS, fields)))
+	except OSError:
+		print("    Could not read the batch manifest: " + str(manifest_file))
+		raise SystemExit
+	return rows
+
+
+def parse_introns(value):
+	"""Converts the manifest introns column to True or False"""
+	return value.lower() in ('y', 'yes', 'true', '1')
+
+
+def get_row_root(row_id, prefetched=None):
+	"""Returns the XML root for a manifest ID, which can be a path to an LRG
+	XML file, an LRG ID or a HGNC gene name.
+
+	Args:
+		row_id (str): The first column of a manifest row
+		prefetched (dict): Roots already downloaded by resolve_genes()
+	Returns:
+		root (xml.etree.ElementTree or LRGIndex): XML root, or the LRGIndex
+										of a file when read from a file
+	"""
+
+	if prefetched != None and row_id in prefetched:
+		if prefetched[row_id] is None:
+			raise SystemExit
+		return prefetched[row_id]
+	if os.path.isfile(row_id):
+		return indexcache.load_lrg_index(row_id)
+	# The network modules are only loaded by rows that need them
+	import webservices
+	if row_id.upper().startswith('LRG_'):
+		lrg_id = row_id
+	else:
+		lrg_id = webservices.search_by_hgnc(row_id)
+	lrg_xml = webservices.search_by_lrg(lrg_id)
+	return lrgparser.get_tree_and_root_stream(io.BytesIO(lrg_xml))
+
+
+def process_row(row, prefetched=None):
+	"""Creates the LRG_Object and BED contents for one manifest row. The
+	flank is stored back in the row as an int and, in incremental mode, the
+	LRG version is stored as row['version'].
+
+	Args:
+		row (dict): A manifest row as returned by read_manifest()
+		prefetched (dict): Roots already downloaded by resolve_genes()
+	Returns:
+		lrg_object (LRG_Object): LRG_Object class object
+		bedcontents (list): Nested list of rows [chromosome, start, end, label]
+	Raises:
+		BatchRowError: If the row is invalid or the LRG could not be found
+	"""
+
+	try:
+		root = get_row_root(row['id'], prefetched)
+	except SystemExit:
+		raise BatchRowError("LRG could not be found or read")
+	except Exception as error:
+		# e.g a network error or a search response that is not valid XML
+		raise BatchRowError("LRG could not be found or read: " + repr(error))
+
+	if row['referencegenome'] not in lrgparser.get_genome_builds(root):
+		raise BatchRowError("Genome build not in LRG: " +
+							row['referencegenome'])
+	if row['transcript'] not in lrgparser.get_transcript_ids(root):
+		raise BatchRowError("Transcript not in LRG: " + row['transcript'])
+	try:
+		flank = int(row['flank'] or 0)
+	except ValueError:
+		raise BatchRowError("Invalid flank: " + row['flank'])
+	if flank < 0:
+		raise BatchRowError("Invalid flank: " + row['flank'])
+	row['flank'] = flank
+	if bedgen.INCREMENTAL:
+		row['version'] = lrgparser.get_lrg_version(root)
+
+	lrg_object = lrgparser.lrg_object_creator(root,
+											row['referencegenome'],
+											row['transcript'],
+											flank)
+	bedcontents = bedgen.create_bed_contents(lrg_object,
+											parse_introns(row['introns']))
+	return lrg_object, bedcontents
+
+
+def label_bed_contents(lrg_object, transcript, bedcontents):
+	"""Prefixes the label of each BED row with the gene name and transcript,
+	so rows from different genes can be told apart in a combined BED file.
+
+	Args:
+		lrg_object (LRG_Object): LRG_Object class object
+		transcript (str): The transcript used
+		bedcontents (list): Nested list of rows [chromosome, start, end, label]
+	Returns:
+		bedcontents (list): Nested list of labelled rows
+	"""
+
+	return bedgen.prefix_bed_labels(bedcontents,
+									lrg_object.hgnc_name + "_" + transcript)
+
+
+def write_row_bed_file(lrg_object, row, bedcontents, merge, bed_filename,
+						timestamp):
+	"""Writes the BED file of one manifest row.
+
+	Args:
+		lrg_object (LRG_Object): LRG_Object class object
+		row (dict): The manifest row
+		bedcontents (list): Nested list of rows [chromosome, start, end, label]
+		merge (bool): Sort and merge overlapping rows True or False
+		bed_filename (str): The filename to write to
+		timestamp (str): Formatted date and time, or LRG version, for the
+							header
+	"""
+
+	if merge:
+		bedcontents = bedgen.merge_bed_contents(bedcontents)
+	bedheader = bedgen.create_bed_header(lrg_object,
+										row['transcript'],
+										row['referencegenome'],
+										timestamp)
+	bedgen.write_bed_file(bed_filename, bedheader, bedcontents)
+
+
+def iter_prefetched_rows(rows, concurrency=None):
+	"""Yields the manifest rows with the downloaded roots they need. Genes
+	and LRG IDs are downloaded concurrently a window of rows at a time, so
+	only the roots of one window are held in memory however long the
+	manifest is.
+
+	Args:
+		rows (list): Manifest rows from read_manifest()
+		concurrency (int): Maximum number of downloads running at once, or
+							None for webservices.DEFAULT_CONCURRENCY
+	Yields:
+		(row_number, row, prefetched): 1-based row number, the row and the
+										downloaded roots of its window
+	"""
+
+	for window_start in range(0, len(rows), PREFETCH_ROWS):
+		window = rows[window_start:window_start + PREFETCH_ROWS]
+		searchterms = [row['id'] for row in window
+						if not os.path.isfile(row['id'])]
+		if searchterms:
+			import webservices
+			prefetched = webservices.resolve_genes(
+							searchterms,
+							concurrency or webservices.DEFAULT_CONCURRENCY)
+		else:
+			prefetched = None
+		for row_number, row in enumerate(window, start=window_start + 1):
+			yield row_number, row, prefetched
+
+
+def run_batch(manifest_file, output=None,
+			concurrency=None, merge=False):
+	"""Processes every row of a manifest. Each row is written to its own BED
+	file, or all rows are written to one combined BED file when an output
+	filename is given. Genes and LRG IDs are downloaded concurrently, a
+	window of rows at a time. A failing row does not stop the run; a summary
+	of every row is printed at the end. When merging, the rows of the
+	combined BED file are merged across genes, separately for each genome
+	build.
+
+	Rows of a combined BED file are written as each manifest row is
+	processed, so memory use does not grow with the number of genes. Only
+	merged or BGZF output, which must be sorted, is collected first. An
+	output filename of '-' writes the combined BED file to stdout, and the
+	summary to stderr.
+
+	Args:
+		manifest_file (str): Path to the manifest file
+		output (str): Combined BED filename, or None for one file per row
+		concurrency (int): Maximum number of downloads running at once, or
+							None for webservices.DEFAULT_CONCURRENCY
+		merge (bool): Sort and merge overlapping rows True or False
+	Returns:
+		True if every row was processed successfully, otherwise False
+	"""
+
+	rows = read_manifest(manifest_file)
+	current_datetime = datetime.datetime.utcnow()
+	current_datetime_formatted = current_datetime.strftime("%Y%m%d-%H%M%S")
+	combined_header = ["track name=LRG_Parser_Custom_Track",
+						"description=LRG_Parser_Batch_" +
+						os.path.basename(manifest_file) + "_" +
+						current_datetime_formatted]
+	combined_contents = {}
+	summary = []
+
+	bed_writer = None
+	if output != None and not merge and not output.endswith(".gz"):
+		try:
+			bed_writer = bedgen.BedWriter(output, combined_header)
+		except OSError:
+			print("    Could not write BED file. Check write permissions")
+			raise SystemExit
+
+	try:
+		for row_number, row, prefetched in iter_prefetched_rows(rows,
+																concurrency):
+			try:
+				lrg_object, bedcontents = process_row(row, prefetched)
+				if output != None:
+					labelled_contents = label_bed_contents(lrg_object,
+															row['transcript'],
+															bedcontents)
+					if bed_writer != None:
+						bed_writer.write_rows(labelled_contents)
+					else:
+						combined_contents.setdefault(
+							row['referencegenome'], []).extend(
+													labelled_contents)
+					destination = output
+				elif bedgen.INCREMENTAL:
+					destination = bedgen.create_incremental_filename(
+													lrg_object,
+													row['transcript'],
+													row['referencegenome'],
+													row['flank'],
+													parse_introns(row['introns']),
+													merge,
+													row['version'])
+					if bedgen.is_up_to_date(destination):
+						summary.append((row_number, row['id'], True,
+										"up to date -> " + destination))
+						continue
+					write_row_bed_file(lrg_object, row, bedcontents, merge,
+										destination, row['version'])
+				else:
+					destination = bedgen.create_bed_filename(
+													lrg_object,
+													row['transcript'],
+													row['referencegenome'],
+													row['flank'],
+													current_datetime_formatted)
+					write_row_bed_file(lrg_object, row, bedcontents, merge,
+										destination, current_datetime_formatted)
+				summary.append((row_number, row['id'], True,
+								str(len(bedcontents)) + " rows -> " +
+								destination))
+			except BatchRowError as error:
+				summary.append((row_number, row['id'], False, str(error)))
+			except SystemExit:
+				summary.append((row_number, row['id'], False,
+								"BED file could not be written"))
+			except Exception as error:
+				# A failing row must not stop the rest of the manifest
+				summary.append((row_number, row['id'], False,
+								"Row failed: " + repr(error)))
+	finally:
+		if bed_writer != None:
+			bed_writer.close()
+
+	if bed_writer != None and output != "-":
+		print("")
+		print("    BED file successfully written to " + output)
+		print("")
+	elif output != None and combined_contents:
+		bedcontents = []
+		for build_contents in combined_contents.values():
+			if merge:
+				build_contents = bedgen.merge_bed_contents(build_contents)
+			bedcontents.extend(build_contents)
+		bedgen.write_bed_file(output, combined_header, bedcontents)
+
+	print_summary(summary, sys.stderr if output == "-" else sys.stdout)
+	return all(succeeded for _, _, succeeded, _ in summary)
+
+
+def find_xml_files(directory):
+	"""Returns the LRG XML files in a directory, sorted by filename so that
+	the output order does not depend on the filesystem. Gzip, bz2 and xz
+	compressed XML files are included.
+
+	Args:
+		directory (str): Path to a directory of LRG XML files
+	Returns:
+		xml_files (list): Sorted list of XML file paths
+	Raises:
+		SystemExit: If the directory could not be read
+	"""
+
+	try:
+		filenames = sorted(os.listdir(directory))
+	except OSError:
+		print("    Could not read the directory: " + str(directory))
+		raise SystemExit
+	return [os.path.join(directory, filename) for filename in filenames
+			if compression.is_xml_file(filename)]
+
+
+def read_lrg_id(xml_file):
+	"""Returns the LRG ID of an LRG XML file. Only the start of the file is
+	read, as the ID is the first element of the fixed annotation.
+
+	Args:
+		xml_file (str): Path to a plain or compressed LRG XML file
+	Returns:
+		lrg_id (str): LRG ID e.g LRG_384, or None if it could not be read
+	"""
+
+	try:
+		with compression.open_xml_file(xml_file) as xml_stream:
+			for event, element in ET.iterparse(xml_stream):
+				if element.tag == 'id':
+					return element.text
+				element.clear()
+	except Exception:
+		pass
+	return None
+
+
+def process_xml_file(xml_file, referencegenome, transcript, flank, introns,
+					output_directory, timestamp, index_cache_dir=None,
+					merge=False):
+	"""Creates and writes the BED files for one LRG XML file. Runs inside a
+	worker process, so only a small summary is returned to the parent. If a
+	genome build or transcript is not given, a BED file is written for every
+	build or transcript in the LRG. Any error fails just this file, and the
+	messages printed while it was processed are returned rather than
+	printed, so the output of different workers does not interleave. While
+	profiling, the timers and counters of the file are also returned, as
+	those of a worker process are not otherwise seen by the parent.
+
+	Args:
+		xml_file (str): Path to the LRG XML file
+		referencegenome (str): Genome build to use, or None for all
+		transcript (str): Transcript to use, or None for all
+		flank (int): The flank size to use
+		introns (bool): Include introns True or False
+		output_directory (str): Directory the BED files are written to
+		timestamp (str): Formatted date and time of generation
+		index_cache_dir (str): Directory of the index cache, or None
+		merge (bool): Sort and merge overlapping rows True or False
+	Returns:
+		result (tuple): (xml_file, succeeded, message, printed, profile),
+						where printed is the text printed while processing
+						and profile a profiling snapshot, or None
+	"""
+
+	printed = io.StringIO()
+	profile = None
+	with contextlib.ExitStack() as stack:
+		stack.enter_context(contextlib.redirect_stdout(printed))
+		if profiling.ENABLED:
+			profile = stack.enter_context(profiling.collect())
+		try:
+			succeeded, message = write_xml_file_beds(xml_file,
+													referencegenome,
+													transcript, flank,
+													introns,
+													output_directory,
+													timestamp,
+													index_cache_dir, merge)
+		except SystemExit:
+			succeeded = False
+			message = "LRG could not be read or BED not written"
+		except Exception as error:
+			succeeded = False
+			message = "File failed: " + repr(error)
+	return (xml_file, succeeded, message, printed.getvalue(), profile)
+
+
+def write_xml_file_beds(xml_file, referencegenome, transcript, flank, introns,
+						output_directory, timestamp, index_cache_dir=None,
+						merge=False):
+	"""Writes the BED files of one LRG XML file for process_xml_file().
+
+	Returns:
+		(succeeded, message): Whether the file succeeded, and its summary
+	Raises:
+		SystemExit: If the LRG could not be read or a BED file not written
+	"""
+
+	root = indexcache.load_lrg_index(xml_file, index_cache_dir)
+	genomebuilds = lrgparser.get_genome_builds(root)
+	transcript_ids = lrgparser.get_transcript_ids(root)
+	if not genomebuilds or not transcript_ids:
+		return (False, "Not an LRG XML file, no genome builds or transcripts")
+	if referencegenome != None:
+		if referencegenome not in genomebuilds:
+			return (False, "Genome build not in LRG: " + referencegenome)
+		genomebuilds = [referencegenome]
+	if transcript != None:
+		if transcript not in transcript_ids:
+			return (False, "Transcript not in LRG: " + transcript)
+		transcript_ids = [transcript]
+
+	if bedgen.INCREMENTAL:
+		timestamp = lrgparser.get_lrg_version(root)
+	bed_files = 0
+	up_to_date = 0
+	for genome_choice in genomebuilds:
+		for transcript_choice in transcript_ids:
+			lrg_object = lrgparser.lrg_object_creator(root,
+													genome_choice,
+													transcript_choice,
+													flank)
+			if bedgen.INCREMENTAL:
+				bed_filename = os.path.join(output_directory,
+							bedgen.create_incremental_filename(
+													lrg_object,
+													transcript_choice,
+													genome_choice,
+													flank,
+													introns,
+													merge,
+													timestamp))
+				if bedgen.is_up_to_date(bed_filename):
+					up_to_date += 1
+					continue
+			else:
+				bed_filename = os.path.join(output_directory,
+							bedgen.create_bed_filename(lrg_object,
+													transcript_choice,
+													genome_choice,
+													flank,
+													timestamp))
+			bedheader = bedgen.create_bed_header(lrg_object,
+												transcript_choice,
+												genome_choice,
+												timestamp)
+			bedcontents = bedgen.create_bed_contents(lrg_object, introns)
+			if merge:
+				bedcontents = bedgen.merge_bed_contents(bedcontents)
+			bedgen.write_bed_file(bed_filename, bedheader, bedcontents)
+			bed_files += 1
+	message = str(bed_files) + " BED files written"
+	if up_to_date:
+		message += ", " + str(up_to_date) + " up to date"
+	return (True, message)
+
+
+def configure_worker(bgzip, incremental, xml_backend=None, profile=False):
+	"""Copies output settings into a worker process, which does not share
+	the module state of the parent when processes are spawned.
+
+	Args:
+		bgzip (bool): Write BED files block gzip compressed True or False
+		incremental (bool): Skip BED files that are up to date True or False
+		xml_backend (str): XML parser to use, or None for the default
+		profile (bool): Record timers and counters True or False
+	"""
+
+	bedgen.BGZIP = bgzip
+	bedgen.INCREMENTAL = incremental
+	xmlbackend.BACKEND = xml_backend
+	if profile:
+		profiling.enable()
+
+
+def run_directory(directory, referencegenome=None, transcript=None, flank=0,
+				introns=False, output_directory=None, workers=1,
+				index_cache_dir=None, merge=False):
+	"""Processes every LRG XML file in a directory. With more than one
+	worker the files are spread across a process pool. Results are reported
+	in filename order whatever order the workers finish in. A file holding
+	the same LRG as an earlier file fails, rather than overwrite its BED
+	files, unless incremental filenames are used.
+
+	Args:
+		directory (str): Path to a directory of LRG XML files
+		referencegenome (str): Genome build to use, or None for all
+		transcript (str): Transcript to use, or None for all
+		flank (int): The flank size to use
+		introns (bool): Include introns True or False
+		output_directory (str): Directory the BED files are written to
+		workers (int): Number of worker processes
+		index_cache_dir (str): Directory of the index cache, or None
+		merge (bool): Sort and merge overlapping rows True or False
+	Returns:
+		True if every file was processed successfully, otherwise False
+	Raises:
+		SystemExit: If the output directory is '-' or the directory could
+					not be read
+	"""
+
+	if output_directory == "-":
+		print("    Directory mode writes a BED file for each LRG, so -o " +
+				"must be a directory rather than -")
+		raise SystemExit
+	all_xml_files = find_xml_files(directory)
+	# Files holding the same LRG, e.g LRG_155.xml and LRG_155.xml.gz, would
+	# write BED files of the same name, so only the first is processed.
+	# Incremental filenames include the annotation version, so only files
+	# of the same version share a name, and those write the same rows.
+	first_files = {}
+	duplicates = {}
+	if not bedgen.INCREMENTAL:
+		for xml_file in all_xml_files:
+			lrg_id = read_lrg_id(xml_file)
+			if lrg_id == None:
+				continue
+			if lrg_id in first_files:
+				duplicates[xml_file] = first_files[lrg_id]
+			else:
+				first_files[lrg_id] = xml_file
+	xml_files = [xml_file for xml_file in all_xml_files
+				if xml_file not in duplicates]
+	if output_directory == None:
+		output_directory = os.getcwd()
+	os.makedirs(output_directory, exist_ok=True)
+	current_datetime = datetime.datetime.utcnow()
+	current_datetime_formatted = current_datetime.strftime("%Y%m%d-%H%M%S")
+	arguments = (xml_files,
+				[referencegenome] * len(xml_files),
+				[transcript] * len(xml_files),
+				[flank] * len(xml_files),
+				[introns] * len(xml_files),
+				[output_directory] * len(xml_files),
+				[current_datetime_formatted] * len(xml_files),
+				[index_cache_dir] * len(xml_files),
+				[merge] * len(xml_files))
+
+	if workers > 1 and len(xml_files) > 1:
+		# Executor.map returns results in submission order, which keeps the
+		# summary deterministic. Chunking reduces the per-file IPC overhead.
+		chunksize = max(1, len(xml_files) // (workers * 4))
+		with concurrent.futures.ProcessPoolExecutor(
+							workers, initializer=configure_worker,
+							initargs=(bedgen.BGZIP,
+										bedgen.INCREMENTAL,
+										xmlbackend.BACKEND,
+										profiling.ENABLED)) as executor:
+			results = list(executor.map(process_xml_file, *arguments,
+										chunksize=chunksize))
+	else:
+		results = list(map(process_xml_file, *arguments))
+	results = {result[0]: result for result in results}
+	for xml_file, first_file in duplicates.items():
+		results[xml_file] = (xml_file, False, "Same LRG as " +
+								os.path.basename(first_file) +
+								", whose BED files it would overwrite",
+							"", None)
+	results = [results[xml_file] for xml_file in all_xml_files]
+
+	# Messages printed by the workers are printed here in filename order,
+	# and their timers and counters added to the profile
+	for xml_file, succeeded, message, printed, profile in results:
+		sys.stdout.write(printed)
+		if profile != None:
+			profiling.merge(profile)
+	summary = [(number, os.path.basename(xml_file), succeeded, message)
+				for number, (xml_file, succeeded, message, printed, profile)
+				in enumerate(results, start=1)]
+	print_summary(summary)
+	return all(succeeded for _, _, succeeded, _ in summary)
+
+
+def print_summary(summary, file=None):
+	"""Prints one line per manifest row showing whether it succeeded.
+
+	Args:
+		summary (list): List of (row number, ID, succeeded, message) tuples
+		file (file): Stream the summary is printed to, or None for the
+					current sys.stdout
+	"""
+
+	if file == None:
+		file = sys.stdout
+	print("", file=file)
+	print("    Batch summary", file=file)
+	for row_number, row_id, succeeded, message in summary:
+		status = "OK    " if succeeded else "FAILED"
+		print("    " + status + " " + str(row_number) + " " +
+				row_id + ": " + message, file=file)
+	failures = sum(1 for _, _, succeeded, _ in summary if not succeeded)
+	print("    " + str(len(summary) - failures) + " succeeded, " +
+			str(failures) + " failed", file=file)
+	print("", file=file)
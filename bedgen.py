@@ -7,6 +7,27 @@ writing it to disk
 
 
 import csv
+import os
+import sys
+
+import bgzf
+import profiling
+
+
+# When True, generated BED filenames end in .gz, so the BED files are
+# written block gzip compressed with a tabix index
+BGZIP = False
+
+# When True, BED filenames are derived from the inputs and the LRG version
+# instead of the time, and BED files that already exist are not rewritten
+INCREMENTAL = False
+
+# Size of the write buffer of BED files, so rows are written in bulk
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Stream a filename of '-' writes to, or None for sys.stdout. Set while
+# messages are redirected to stderr, so BED rows still reach stdout.
+STDOUT = None
 
 
 def create_bed_contents(lrg_object, introns_choice):
@@ -20,59 +41,302 @@ def create_bed_contents(lrg_object, introns_choice):
 		bedcontents (list): Nested list of rows [chromosome, start, end, label]
 	"""
 
-	bedcontents = []
-	
+	return list(iter_bed_rows(lrg_object, introns_choice))
+
+
+def iter_bed_rows(lrg_object, introns_choice):
+	"""Yields the rows of the BED file one at a time, in the same order as
+	create_bed_contents(), so they can be written without building a list.
+
+	Args:
+		lrg_object (LRG_Object): An LRG_Object containing LRG ID, HGNC name etc
+		introns_choice (bool): Include introns True or False
+	Yields:
+		row (list): [chromosome, start, end, label]
+	"""
+
+	# A genome build that is not in the LRG gives an object without a
+	# chromosome or any exons, so there are no rows
+	if lrg_object.chromosome == None:
+		return
+	chromosome = "chr" + lrg_object.chromosome
+
 	# Adds exon rows
-	for item in lrg_object.mapped_flanked_exon_coords:
-		chromosome = "chr"+lrg_object.chromosome
-		start = lrg_object.mapped_flanked_exon_coords[item][0]
-		end = lrg_object.mapped_flanked_exon_coords[item][1]
-		label = "Exon_"+str(item)
+	for item, (start, end) in lrg_object.mapped_flanked_exon_coords.items():
 		if start > end:
 			start, end = end, start
-		else:
-			pass
-		bedcontents.append([chromosome, start, end, label])
-	
+		yield [chromosome, start, end, "Exon_" + str(item)]
+	profiling.count('exons', len(lrg_object.mapped_flanked_exon_coords))
+
 	# Adds intron rows if specified on the command line or in the UI
 	if introns_choice == True:
-		for item in lrg_object.mapped_intron_coords:
-			chromosome = "chr"+lrg_object.chromosome
-			start = lrg_object.mapped_intron_coords[item][0]
-			end = lrg_object.mapped_intron_coords[item][1]
+		for item, (start, end) in lrg_object.mapped_intron_coords.items():
 			if start > end:
 				start, end = end, start
+			yield [chromosome, start, end, "Intron_" + str(item)]
+		profiling.count('introns', len(lrg_object.mapped_intron_coords))
+
+
+def prefix_bed_labels(bedcontents, prefix):
+	"""Prefixes the label of each BED row, so that rows from different genes,
+	transcripts or genome builds can be told apart in a combined BED file.
+
+	Args:
+		bedcontents (list): Nested list of rows [chromosome, start, end, label]
+		prefix (str): Text added before each label, joined with "_"
+	Returns:
+		bedcontents (list): Nested list of labelled rows
+	"""
+
+	prefix = prefix + "_"
+	return [[chromosome, start, end, prefix + label]
+			for chromosome, start, end, label in bedcontents]
+
+
+def merge_bed_contents(bedcontents):
+	"""Sorts BED rows by chromosome and start, and merges rows that overlap
+	or touch in one sweep. The label of a merged row lists the labels it
+	was made from, with consecutive numbers written as a range, e.g
+	Exon_3 and Exon_4 become Exon_3-4, and Exon_3, Exon_4 and Intron_3
+	become Exon_3-4,Intron_3.
+
+	Args:
+		bedcontents (list): Nested list of rows [chromosome, start, end, label]
+	Returns:
+		bedcontents (list): Sorted nested list of merged rows
+	"""
+
+	merged = []
+	labels = []
+	for chromosome, start, end, label in sorted(bedcontents,
+											key=lambda row: row[:3]):
+		if merged and merged[-1][0] == chromosome and start <= merged[-1][2]:
+			if end > merged[-1][2]:
+				merged[-1][2] = end
+			labels[-1].append(label)
+		else:
+			merged.append([chromosome, start, end, None])
+			labels.append([label])
+	for row, row_labels in zip(merged, labels):
+		row[3] = merge_labels(row_labels)
+	return merged
+
+
+def merge_labels(labels):
+	"""Combines the labels of merged BED rows. Labels ending in a number
+	are grouped by the text before it, e.g ['Exon_4', 'Exon_3', 'Exon_6']
+	becomes 'Exon_3-4,6'. Groups are joined with commas in the order they
+	first appear.
+
+	Args:
+		labels (list): Labels of the rows that were merged
+	Returns:
+		label (str): The merged label
+	"""
+
+	if len(labels) == 1:
+		return labels[0]
+	groups = {}
+	for label in labels:
+		prefix, separator, number = label.rpartition("_")
+		if separator and number.isdigit():
+			groups.setdefault(prefix, set()).add(int(number))
+		else:
+			groups.setdefault(label, None)
+
+	merged_labels = []
+	for prefix, numbers in groups.items():
+		if numbers is None:
+			merged_labels.append(prefix)
+			continue
+		ranges = []
+		for number in sorted(numbers):
+			if ranges and number == ranges[-1][1] + 1:
+				ranges[-1][1] = number
 			else:
-				pass
-			label = "Intron_"+str(item)
-			bedcontents.append([chromosome, start, end, label])
+				ranges.append([number, number])
+		merged_labels.append(prefix + "_" + ",".join(
+				str(first) if first == last else str(first) + "-" + str(last)
+				for first, last in ranges))
+	return ",".join(merged_labels)
+
+
+def create_bed_filename(lrg_object, transcript, referencegenome, flank,
+						timestamp):
+	"""Creates the BED filename, which records the gene, LRG, transcript,
+	genome build, flank and time of generation for audit purposes.
+
+	Args:
+		lrg_object (LRG_Object): An LRG_Object containing LRG ID, HGNC name etc
+		transcript (str): The transcript used
+		referencegenome (str): The genome build used
+		flank (int): The flank size used
+		timestamp (str): Formatted date and time of generation
+	Returns:
+		bed_filename (str): The BED filename
+	"""
+
+	bed_filename = "_".join([lrg_object.hgnc_name,
+							lrg_object.lrg_id,
+							transcript,
+							referencegenome,
+							"flank"+str(flank),
+							timestamp,
+							]) + ".tsv"
+	if BGZIP:
+		bed_filename += ".gz"
+	return bed_filename
+
+
+def create_incremental_filename(lrg_object, transcript, referencegenome,
+								flank, introns, merge, version):
+	"""Creates a BED filename derived only from the inputs that decide its
+	contents, so the same inputs always give the same name and an existing
+	file with that name is already up to date.
+
+	Args:
+		lrg_object (LRG_Object): An LRG_Object containing LRG ID, HGNC name etc
+		transcript (str): The transcript used
+		referencegenome (str): The genome build used
+		flank (int): The flank size used
+		introns (bool): Whether introns are included
+		merge (bool): Whether overlapping rows are merged
+		version (str): Version of the LRG annotation, see
+						lrgparser.get_lrg_version()
+	Returns:
+		bed_filename (str): The BED filename
+	"""
+
+	parts = [lrg_object.hgnc_name,
+			lrg_object.lrg_id,
+			transcript,
+			referencegenome,
+			"flank"+str(flank),
+			"introns" if introns else "exons"]
+	if merge:
+		parts.append("merged")
+	parts.append(version)
+	bed_filename = "_".join(parts) + ".tsv"
+	if BGZIP:
+		bed_filename += ".gz"
+	return bed_filename
+
+
+def is_up_to_date(bed_filename):
+	"""Returns True if an incremental BED file, and its index if it is
+	block gzip compressed, already exist
+	"""
+	if not os.path.isfile(bed_filename):
+		return False
+	return not bed_filename.endswith(".gz") or \
+		os.path.isfile(bed_filename + ".tbi")
+
+
+def create_bed_header(lrg_object, transcript, referencegenome, timestamp):
+	"""Creates the BED track header for a single LRG.
+
+	Args:
+		lrg_object (LRG_Object): An LRG_Object containing LRG ID, HGNC name etc
+		transcript (str): The transcript used
+		referencegenome (str): The genome build used
+		timestamp (str): Formatted date and time of generation
+	Returns:
+		bedheader (list): The header to write. List of strings
+	"""
+
+	bedheader_name = "LRG_Parser_Custom_Track"
+	bedheader_desc = "_".join([lrg_object.hgnc_name,
+								lrg_object.lrg_id,
+								transcript,
+								referencegenome,
+								timestamp
+								])
+	bedheader = ["track name=" + bedheader_name,
+				"description=" + bedheader_desc]
+	return bedheader
+
 
-	return bedcontents
+class BedWriter:
+	"""Writes a BED file row by row, so rows can be written as they are
+	produced without holding the whole file in memory. Output is buffered
+	and written in bulk. A filename of '-' writes to standard output.
+
+	Attributes:
+		filetowrite (str): The filename written to, or '-' for stdout
+	"""
+	def __init__(self, filetowrite, bedheader):
+		self.filetowrite = filetowrite
+		if filetowrite == "-":
+			self._file = STDOUT or sys.stdout
+		else:
+			self._file = open(filetowrite, 'w', newline='',
+							buffering=WRITE_BUFFER_SIZE)
+		self._writer = csv.writer(self._file, delimiter="\t")
+		self._writer.writerow(bedheader)
+
+	def write_rows(self, rows):
+		"""Writes an iterable of rows [chromosome, start, end, label]"""
+		self._writer.writerows(rows)
+
+	def close(self):
+		"""Flushes the output, closing it unless it is stdout"""
+		if self.filetowrite == "-":
+			self._file.flush()
+		else:
+			self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
 
 
 def write_bed_file(filetowrite, bedheader, bedcontents):
-	"""Writes the BED header and contents to file.
+	"""Writes the BED header and contents to file. The rows may be any
+	iterable, including the generator from iter_bed_rows(), and a filename
+	of '-' writes to standard output with the messages sent to stderr. A
+	filename ending in .gz is written block gzip compressed and sorted by
+	chromosome and start, with a tabix index alongside it (see
+	bgzf.write_indexed_bed). Files are written under a temporary name and
+	renamed once complete, so a BED file that exists is never partial.
 
 	Args:
-		filetowrite (str): The filename to write to
+		filetowrite (str): The filename to write to, or '-' for stdout
 		bedheader (list): The header to write. List of strings
-		bedcontents (list): Nested list of rows [chromosome, start, end, label]
+		bedcontents (iterable): Rows [chromosome, start, end, label]
 	Returns:
 		True if BED file written successfully
 	Raises:
 		SystemExit: If the file could not be written
 	"""
 	
+	temporary_file = None
 	try:
-		with open(filetowrite, 'w', newline='') as csv_file:
-			writer = csv.writer(csv_file, delimiter="\t")
-			writer.writerow(bedheader)
-			for line in bedcontents:
-				writer.writerow(line)
+		if filetowrite == "-":
+			with BedWriter(filetowrite, bedheader) as bed_writer:
+				bed_writer.write_rows(bedcontents)
+			return True
+		temporary_file = filetowrite + "." + str(os.getpid()) + ".tmp"
+		if filetowrite.endswith(".gz"):
+			bgzf.write_indexed_bed(temporary_file, bedheader, bedcontents)
+			# The index is moved first, so the BED file is only present
+			# once its index is
+			os.replace(temporary_file + ".tbi", filetowrite + ".tbi")
+		else:
+			with BedWriter(temporary_file, bedheader) as bed_writer:
+				bed_writer.write_rows(bedcontents)
+		os.replace(temporary_file, filetowrite)
+		profiling.count('bed_files_written')
 		print("")
 		print("    BED file successfully written to " +  filetowrite)
 		print("")
 		return True
 	except:
-		print("    Could not write BED file. Check write permissions")
-		raise SystemExit
\ No newline at end of file
+		if temporary_file != None:
+			for leftover in (temporary_file, temporary_file + ".tbi"):
+				if os.path.exists(leftover):
+					os.remove(leftover)
+		print("    Could not write BED file. Check write permissions",
+				file=sys.stderr if filetowrite == "-" else sys.stdout)
+		raise SystemExit
@@ -0,0 +1,430 @@
+"""
+Benchmarks each stage of BED generation on synthetic LRG XML files, so that
+performance changes can be compared against a baseline. The synthetic files
+follow the structure of real LRG XML files and are scaled by the number of
+exons, transcripts, genome builds and the length of the LRG sequence.
+
+Results are printed, or written with -o, as JSON: one record per
+configuration, giving the best and mean time, throughput and peak memory of
+each stage. With --startup, the start-up time of short lrgparser.py runs is
+measured instead, in new interpreter processes, and with --xml-backends
+the installed XML parsers are compared on LRG_155 and synthetic files.
+
+Usage:
+	python benchmark.py --exons 10 100 1000 --transcripts 3 -o results.json
+	python benchmark.py --startup --repeat 20
+	python benchmark.py --xml-backends --exons 50 2000 --sequence-length 2000000
+"""
+
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import bedgen
+import functions
+import lrgparser
+import xmlbackend
+
+# XML Related Imports
+import xml.etree.ElementTree as ET
+
+
+# Stages timed for each configuration, in the order they run
+STAGES = ['parse', 'index', 'lrg_object_creator', 'create_bed_contents',
+		'write_bed_file']
+
+# Length of the LRG sequence outside the exons, as in real LRGs
+UPSTREAM_FLANK = 5000
+DOWNSTREAM_FLANK = 2000
+
+
+def generate_lrg_xml(exons=40, transcripts=3, builds=2,
+					sequence_length=30000, lrg_id="LRG_90001", seed=0):
+	"""Generates a synthetic LRG XML file. The exons of every transcript are
+	spread evenly over the LRG sequence, and each genome build maps the LRG
+	to a different chromosome position, alternating strands.
+
+	Args:
+		exons (int): Number of exons in each transcript
+		transcripts (int): Number of transcripts, split between the NCBI and
+							Ensembl annotation sets
+		builds (int): Number of genome builds the LRG is mapped to
+		sequence_length (int): Length of the LRG genomic sequence
+		lrg_id (str): LRG ID of the synthetic LRG
+		seed (int): Seed for the random sequence and exon lengths
+	Returns:
+		xml_file (bytes): The LRG XML file
+	"""
+
+	generator = random.Random(seed)
+	sequence_length = max(sequence_length,
+						UPSTREAM_FLANK + DOWNSTREAM_FLANK + exons * 4)
+	gene_name = "SYN" + lrg_id.split("_")[-1]
+
+	root = ET.Element('lrg', schema_version="1.9")
+	fixed_annotation = ET.SubElement(root, 'fixed_annotation')
+	ET.SubElement(fixed_annotation, 'id').text = lrg_id
+	ET.SubElement(fixed_annotation, 'hgnc_id').text = str(90000 + seed)
+	ET.SubElement(fixed_annotation, 'sequence_source').text = "NG_900001.1"
+	ET.SubElement(fixed_annotation, 'organism', taxon="9606").text = \
+		"Homo sapiens"
+	ET.SubElement(fixed_annotation, 'mol_type').text = "dna"
+	ET.SubElement(fixed_annotation, 'creation_date').text = "2019-01-01"
+	ET.SubElement(fixed_annotation, 'sequence').text = "".join(
+					generator.choice("ACGT") for _ in range(sequence_length))
+
+	# Exon spans in LRG coordinates, one slot per exon
+	slot = (sequence_length - UPSTREAM_FLANK - DOWNSTREAM_FLANK) // exons
+	transcript_spans = []
+	for transcript_number in range(transcripts):
+		spans = []
+		for exon_number in range(exons):
+			start = UPSTREAM_FLANK + 1 + exon_number * slot
+			length = generator.randint(max(1, slot // 4), max(1, slot // 2))
+			spans.append((start, start + length - 1))
+		transcript_spans.append(spans)
+
+		transcript = ET.SubElement(fixed_annotation, 'transcript',
+									name="t" + str(transcript_number + 1))
+		ET.SubElement(transcript, 'coordinates', coord_system=lrg_id,
+					start=str(spans[0][0]), end=str(spans[-1][1]),
+					strand="1")
+		for exon_number, (start, end) in enumerate(spans, start=1):
+			exon = ET.SubElement(transcript, 'exon', label=str(exon_number))
+			ET.SubElement(exon, 'coordinates', coord_system=lrg_id,
+						start=str(start), end=str(end), strand="1")
+
+	updatable_annotation = ET.SubElement(root, 'updatable_annotation')
+	lrg_set = ET.SubElement(updatable_annotation, 'annotation_set',
+							type="lrg")
+	ET.SubElement(lrg_set, 'modification_date').text = "2019-01-14"
+	for build_number in range(builds):
+		other_start = 1000000 + build_number * 250000
+		other_end = other_start + sequence_length - 1
+		mapping = ET.SubElement(lrg_set, 'mapping',
+								coord_system="GRCh" + str(37 + build_number),
+								other_name=str(build_number % 22 + 1),
+								other_start=str(other_start),
+								other_end=str(other_end))
+		ET.SubElement(mapping, 'mapping_span', lrg_start="1",
+					lrg_end=str(sequence_length),
+					other_start=str(other_start), other_end=str(other_end),
+					strand="1" if build_number % 2 == 0 else "-1")
+	ET.SubElement(lrg_set, 'lrg_locus', source="HGNC").text = gene_name
+
+	annotation_sets = {}
+	for transcript_number, spans in enumerate(transcript_spans):
+		source = "ncbi" if transcript_number % 2 == 0 else "ensembl"
+		if source not in annotation_sets:
+			annotation_sets[source] = ET.SubElement(updatable_annotation,
+													'annotation_set',
+													type=source)
+			ET.SubElement(annotation_sets[source],
+						'modification_date').text = "2019-01-14"
+		if source == "ncbi":
+			transcript_id = "NM_9" + str(transcript_number).zfill(5) + ".1"
+		else:
+			transcript_id = "ENST9" + str(transcript_number).zfill(10) + ".1"
+		mapping = ET.SubElement(annotation_sets[source], 'mapping',
+								coord_system=transcript_id,
+								other_name=transcript_id,
+								type="transcript")
+		other_start = 1
+		for start, end in spans:
+			other_end = other_start + end - start
+			ET.SubElement(mapping, 'mapping_span', lrg_start=str(start),
+						lrg_end=str(end), other_start=str(other_start),
+						other_end=str(other_end), strand="1")
+			other_start = other_end + 1
+
+	return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
+
+def measure(stage, setup=None, repeat=5):
+	"""Times a stage and measures its peak memory. The stage is timed
+	'repeat' times without memory tracing, then run once more while
+	tracing, as tracing slows Python code down.
+
+	Args:
+		stage (function): The stage, called with the result of setup()
+		setup (function): Returns a fresh argument for each run, untimed
+		repeat (int): Number of timed runs
+	Returns:
+		result (dict): best_seconds, mean_seconds and peak_memory_bytes
+	"""
+
+	timings = []
+	for _ in range(repeat):
+		argument = setup() if setup != None else None
+		start = time.perf_counter()
+		stage(argument)
+		timings.append(time.perf_counter() - start)
+
+	argument = setup() if setup != None else None
+	tracemalloc.start()
+	try:
+		stage(argument)
+		peak_memory = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	return {'best_seconds': min(timings),
+			'mean_seconds': sum(timings) / len(timings),
+			'peak_memory_bytes': peak_memory}
+
+
+def run_benchmark(exons=40, transcripts=3, builds=2, sequence_length=30000,
+				repeat=5, work_directory=None):
+	"""Benchmarks every stage of BED generation on one synthetic LRG.
+
+	Args:
+		exons (int): Number of exons in each transcript
+		transcripts (int): Number of transcripts
+		builds (int): Number of genome builds
+		sequence_length (int): Length of the LRG genomic sequence
+		repeat (int): Number of timed runs of each stage
+		work_directory (str): Directory for the XML and BED files, or None
+								for a temporary directory
+	Returns:
+		record (dict): Parameters and the results of each stage
+	"""
+
+	with tempfile.TemporaryDirectory(dir=work_directory) as directory:
+		xml_path = os.path.join(directory, "synthetic.xml")
+		xml_file = generate_lrg_xml(exons, transcripts, builds,
+									sequence_length)
+		with open(xml_path, 'wb') as f:
+			f.write(xml_file)
+
+		root = lrgparser.get_tree_and_root_file(xml_path)
+		genomebuilds = lrgparser.get_genome_builds(root)
+		transcript_ids = lrgparser.get_transcript_ids(root)
+		combinations = list(itertools.product(genomebuilds, transcript_ids))
+		lrg_objects = [lrgparser.lrg_object_creator(root, genome_choice,
+													transcript_choice, 50)
+						for genome_choice, transcript_choice in combinations]
+		bedcontents = [bedgen.create_bed_contents(lrg_object, True)
+						for lrg_object in lrg_objects]
+		bed_path = os.path.join(directory, "synthetic.tsv")
+
+		def parse(argument):
+			lrgparser.get_tree_and_root_file(xml_path)
+
+		def index(fresh_root):
+			lrgparser.get_genome_builds(fresh_root)
+			lrgparser.get_transcript_ids(fresh_root)
+
+		def create_objects(argument):
+			for genome_choice, transcript_choice in combinations:
+				lrgparser.lrg_object_creator(root, genome_choice,
+											transcript_choice, 50)
+
+		def create_contents(argument):
+			for lrg_object in lrg_objects:
+				bedgen.create_bed_contents(lrg_object, True)
+
+		def write_files(argument):
+			with contextlib.redirect_stdout(io.StringIO()):
+				for contents in bedcontents:
+					bedgen.write_bed_file(bed_path, ["track name=benchmark"],
+										contents)
+
+		# Items processed by each stage, for the throughput
+		exon_count = exons * len(combinations)
+		row_count = sum(len(contents) for contents in bedcontents)
+		stages = {
+			'parse': (parse, None, len(xml_file), 'bytes'),
+			'index': (index,
+					lambda: lrgparser.get_tree_and_root_file(xml_path),
+					exons * transcripts, 'exons'),
+			'lrg_object_creator': (create_objects, None, exon_count, 'exons'),
+			'create_bed_contents': (create_contents, None, row_count, 'rows'),
+			'write_bed_file': (write_files, None, row_count, 'rows'),
+		}
+
+		results = {}
+		for name in STAGES:
+			stage, setup, items, unit = stages[name]
+			result = measure(stage, setup, repeat)
+			result['items'] = items
+			result['unit'] = unit
+			result[unit + '_per_second'] = (items / result['best_seconds']
+											if result['best_seconds'] else None)
+			results[name] = result
+
+	return {'parameters': {'exons': exons,
+							'transcripts': transcripts,
+							'builds': builds,
+							'sequence_length': sequence_length,
+							'repeat': repeat},
+			'xml_bytes': len(xml_file),
+			'stages': results}
+
+
+def run_startup_benchmark(repeat=10, work_directory=None):
+	"""Times new Python processes that start the interpreter, import
+	lrgparser, and run lrgparser.py on a small local XML file.
+
+	Args:
+		repeat (int): Number of runs of each command
+		work_directory (str): Directory for the XML and BED files, or None
+								for a temporary directory
+	Returns:
+		record (dict): Best and mean seconds of each command
+	"""
+
+	package_directory = os.path.dirname(os.path.abspath(__file__))
+	with tempfile.TemporaryDirectory(dir=work_directory) as directory:
+		xml_path = os.path.join(directory, "synthetic.xml")
+		with open(xml_path, 'wb') as f:
+			f.write(generate_lrg_xml(exons=20, transcripts=1, builds=1))
+		commands = {
+			'interpreter': [sys.executable, "-c", "pass"],
+			'import_lrgparser': [sys.executable, "-c", "import lrgparser"],
+			'file_run': [sys.executable,
+						os.path.join(package_directory, "lrgparser.py"),
+						"-f", xml_path, "-r", "GRCh37", "-t", "NM_900000.1",
+						"-o", os.path.join(directory, "synthetic.tsv")],
+		}
+
+		results = {}
+		for name, command in commands.items():
+			timings = []
+			for _ in range(repeat):
+				start = time.perf_counter()
+				subprocess.run(command, cwd=package_directory, check=True,
+								stdout=subprocess.DEVNULL)
+				timings.append(time.perf_counter() - start)
+			results[name] = {'best_seconds': min(timings),
+							'mean_seconds': sum(timings) / len(timings)}
+
+	return {'parameters': {'repeat': repeat}, 'startup': results}
+
+
+def run_backend_benchmark(xml_files, repeat=5):
+	"""Times the streaming loader with each installed XML backend, and
+	checks that every backend gives the same pruned root.
+
+	Args:
+		xml_files (dict): Name -> LRG XML file contents (bytes)
+		repeat (int): Number of timed runs of each backend on each file
+	Returns:
+		record (dict): For each file, its size, whether the backends agree,
+						and the best and mean seconds of each backend
+	"""
+
+	results = {}
+	for name, xml_file in xml_files.items():
+		result = {'xml_bytes': len(xml_file), 'backends': {}}
+		pruned = []
+		for backend in xmlbackend.available_backends():
+			def parse(argument, backend=backend):
+				xmlbackend.parse_pruned(io.BytesIO(xml_file),
+										lrgparser.LRG_KEPT_ELEMENTS, backend)
+			timing = measure(parse, None, repeat)
+			timing['bytes_per_second'] = (len(xml_file) /
+											timing['best_seconds'])
+			result['backends'][backend] = timing
+			pruned.append(ET.tostring(xmlbackend.parse_pruned(
+							io.BytesIO(xml_file), lrgparser.LRG_KEPT_ELEMENTS,
+							backend)))
+		result['identical'] = all(root == pruned[0] for root in pruned)
+		results[name] = result
+	return {'parameters': {'repeat': repeat}, 'xml_backends': results}
+
+
+def arg_collection(arguments):
+	"""Collects the benchmark arguments. Each scaling argument takes one or
+	more values, and every combination of them is benchmarked.
+
+	Args:
+		arguments (list): List of unprocessed arguments
+	Returns:
+		args (argparse.Namespace): The parsed arguments
+	"""
+
+	parser = argparse.ArgumentParser(
+				description="Benchmarks each stage of BED generation on " +
+							"synthetic LRG XML files")
+	parser.add_argument('--exons', type=int, nargs='+', default=[40],
+						help="Exons in each transcript e.g --exons 10 1000")
+	parser.add_argument('--transcripts', type=int, nargs='+', default=[3],
+						help="Transcripts in each LRG")
+	parser.add_argument('--builds', type=int, nargs='+', default=[2],
+						help="Genome builds each LRG is mapped to")
+	parser.add_argument('--sequence-length', type=int, nargs='+',
+						default=[30000], dest='sequence_length',
+						help="Length of the LRG genomic sequence")
+	parser.add_argument('--repeat', type=int, default=5,
+						help="Timed runs of each stage (default 5)")
+	parser.add_argument('--xml-backends', action='store_true',
+						dest='xml_backends',
+						help="Compares the installed XML parsers on " +
+								"LRG_155 and synthetic files of each size " +
+								"instead of timing the stages")
+	parser.add_argument('--startup', action='store_true',
+						help="Times the start-up of short lrgparser.py runs " +
+								"instead of the stages")
+	parser.add_argument('-o', '--output', type=str,
+						help="Writes the JSON results to this file")
+	return parser.parse_args(arguments)
+
+
+def main(args):
+	"""Benchmarks every combination of the scaling arguments and reports the
+	results as JSON.
+
+	Args:
+		args (argparse.Namespace): The parsed arguments
+	Returns:
+		report (dict): Environment details and a record per configuration
+	"""
+
+	records = []
+	if args.startup:
+		records.append(run_startup_benchmark(args.repeat))
+	elif args.xml_backends:
+		xml_files = {}
+		lrg_155 = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+								"testfiles", "LRG_155.xml")
+		if os.path.exists(lrg_155):
+			with open(lrg_155, 'rb') as f:
+				xml_files['LRG_155'] = f.read()
+		for exons, transcripts, builds, sequence_length in itertools.product(
+						args.exons, args.transcripts, args.builds,
+						args.sequence_length):
+			xml_files["synthetic_" + "_".join(str(value) for value in
+						(exons, transcripts, builds, sequence_length))] = \
+				generate_lrg_xml(exons, transcripts, builds, sequence_length)
+		records.append(run_backend_benchmark(xml_files, args.repeat))
+	else:
+		for exons, transcripts, builds, sequence_length in itertools.product(
+						args.exons, args.transcripts, args.builds,
+						args.sequence_length):
+			records.append(run_benchmark(exons, transcripts, builds,
+										sequence_length, args.repeat))
+	report = {'python': platform.python_version(),
+			'numpy': functions.load_numpy() != None,
+			'results': records}
+
+	if args.output != None:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2)
+	else:
+		json.dump(report, sys.stdout, indent=2)
+		print("")
+	return report
+
+
+if __name__ == '__main__':
+	main(arg_collection(sys.argv[1:]))
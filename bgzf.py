@@ -0,0 +1,351 @@
+"""
+This module contains functions for writing BED files as block compressed
+gzip (BGZF) with a tabix index, and for reading regions back from them.
+
+A BGZF file is a series of gzip members of at most 64 KiB each, so it can be
+read by any gzip reader, while a position in it can be given as a virtual
+offset: the file offset of a block shifted left 16 bits, plus the offset
+within the decompressed block. The tabix index (.tbi) maps each chromosome
+to the virtual offsets of its rows using the binning scheme and 16 kb linear
+index of the SAM/tabix specifications, so the index written here can also be
+used by tabix and htslib.
+"""
+
+
+import gzip
+import struct
+import zlib
+
+
+# Bytes of BED text compressed into each block, leaving room for the block
+# header and for data that does not compress
+BGZF_BLOCK_SIZE = 0xff00
+
+# Empty block marking the end of a BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b00"
+							"03000000000000000000")
+
+_BLOCK_HEADER = struct.Struct('<4BI2BH2BHH')
+_BLOCK_TRAILER = struct.Struct('<II')
+
+# Tabix settings of the BED preset: 0-based coordinates, columns 1 to 3 and
+# lines starting with '#' skipped
+TBX_UCSC = 0x10000
+_TABIX_PRESET = struct.Struct('<7i')
+_TABIX_BED = (TBX_UCSC, 1, 2, 3, ord('#'), 0)
+
+# Size of the windows of the linear index
+_LINEAR_SHIFT = 14
+
+
+class BgzfWriter:
+	"""Writes a BGZF file, keeping track of the virtual offset of the next
+	byte written.
+
+	Attributes:
+		fileobj (file): Binary file object the blocks are written to
+	"""
+	def __init__(self, fileobj):
+		self.fileobj = fileobj
+		self._buffer = bytearray()
+		self._block_offset = 0
+
+	def tell(self):
+		"""Returns the virtual offset of the next byte written"""
+		return (self._block_offset << 16) | len(self._buffer)
+
+	def write(self, data):
+		"""Adds data, writing out each block as it fills"""
+		self._buffer.extend(data)
+		while len(self._buffer) >= BGZF_BLOCK_SIZE:
+			self._write_block(bytes(self._buffer[:BGZF_BLOCK_SIZE]))
+			del self._buffer[:BGZF_BLOCK_SIZE]
+
+	def _write_block(self, data):
+		"""Compresses and writes one block"""
+		compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+		deflated = compressor.compress(data) + compressor.flush()
+		block_size = _BLOCK_HEADER.size + len(deflated) + _BLOCK_TRAILER.size
+		self.fileobj.write(_BLOCK_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff,
+											6, ord('B'), ord('C'), 2,
+											block_size - 1))
+		self.fileobj.write(deflated)
+		self.fileobj.write(_BLOCK_TRAILER.pack(zlib.crc32(data), len(data)))
+		self._block_offset += block_size
+
+	def close(self):
+		"""Writes the last partial block and the end of file marker"""
+		if self._buffer:
+			self._write_block(bytes(self._buffer))
+			self._buffer.clear()
+		self.fileobj.write(BGZF_EOF)
+
+
+class BgzfReader:
+	"""Reads lines from a BGZF file starting at virtual offsets.
+
+	Attributes:
+		fileobj (file): Binary file object of the BGZF file
+	"""
+	def __init__(self, fileobj):
+		self.fileobj = fileobj
+		self._block_offset = 0
+		self._next_block_offset = 0
+		self._data = b''
+		self._position = 0
+
+	def _load_block(self, block_offset):
+		"""Reads and decompresses the block starting at a file offset.
+
+		Returns:
+			False if there is no block at the offset, otherwise True
+		"""
+		self.fileobj.seek(block_offset)
+		header = self.fileobj.read(_BLOCK_HEADER.size)
+		self._block_offset = block_offset
+		self._position = 0
+		self._data = b''
+		self._next_block_offset = block_offset
+		if not header:
+			return False
+		fields = _BLOCK_HEADER.unpack(header)
+		if fields[:4] != (0x1f, 0x8b, 8, 4) or fields[8:10] != (66, 67):
+			raise ValueError("Not a BGZF file")
+		block_size = fields[-1] + 1
+		rest = self.fileobj.read(block_size - _BLOCK_HEADER.size)
+		self._data = zlib.decompress(rest[:-_BLOCK_TRAILER.size], -15)
+		self._next_block_offset = block_offset + block_size
+		return True
+
+	def seek(self, virtual_offset):
+		"""Moves to a virtual offset"""
+		self._load_block(virtual_offset >> 16)
+		self._position = virtual_offset & 0xffff
+
+	def tell(self):
+		"""Returns the virtual offset of the next byte read"""
+		if self._data and self._position == len(self._data):
+			return self._next_block_offset << 16
+		return (self._block_offset << 16) | self._position
+
+	def readline(self):
+		"""Returns the next line, read across blocks, or b'' at the end"""
+		parts = []
+		while True:
+			if self._position == len(self._data):
+				if not self._load_block(self._next_block_offset):
+					break
+				continue
+			newline = self._data.find(b'\n', self._position)
+			if newline == -1:
+				parts.append(self._data[self._position:])
+				self._position = len(self._data)
+				continue
+			parts.append(self._data[self._position:newline + 1])
+			self._position = newline + 1
+			break
+		return b''.join(parts)
+
+
+def reg2bin(start, end):
+	"""Returns the smallest bin holding a 0-based, end-exclusive interval"""
+	end -= 1
+	for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+		if start >> shift == end >> shift:
+			return offset + (start >> shift)
+	return 0
+
+
+def reg2bins(start, end):
+	"""Returns every bin that may hold intervals overlapping a region"""
+	end -= 1
+	bins = [0]
+	for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+		bins.extend(range(offset + (start >> shift),
+						offset + (end >> shift) + 1))
+	return bins
+
+
+def chromosome_key(chromosome):
+	"""Returns a chromosome name without its 'chr' prefix, so that e.g chr14
+	and 14 are matched. Also used by the IntervalIndex in intervals.
+	"""
+	if chromosome[:3].lower() == 'chr':
+		return chromosome[3:]
+	return chromosome
+
+
+def write_indexed_bed(filetowrite, bedheader, bedcontents):
+	"""Writes BED rows sorted by chromosome and start as BGZF, and their
+	tabix index to the same filename with '.tbi' added. The header is
+	written as a '#' comment line, which tabix skips.
+
+	Args:
+		filetowrite (str): The filename to write to, normally ending .gz
+		bedheader (list): The header to write. List of strings
+		bedcontents (list): Nested list of rows [chromosome, start, end, label]
+	Raises:
+		OSError: If the files could not be written
+	"""
+
+	names = []
+	references = {}
+	with open(filetowrite, 'wb') as bed_file:
+		writer = BgzfWriter(bed_file)
+		writer.write(("#" + "\t".join(bedheader) + "\n").encode('utf-8'))
+		for row in sorted(bedcontents, key=lambda row: row[:3]):
+			chromosome, start, end = row[0], row[1], row[2]
+			if chromosome not in references:
+				names.append(chromosome)
+				references[chromosome] = ({}, [])
+			bins, linear = references[chromosome]
+			row_start = writer.tell()
+			writer.write(("\t".join(str(value) for value in row) + "\n")
+						.encode('utf-8'))
+			row_end = writer.tell()
+
+			# Rows written one after another in the same bin share a chunk
+			chunks = bins.setdefault(reg2bin(start, max(end, start + 1)), [])
+			if chunks and chunks[-1][1] == row_start:
+				chunks[-1][1] = row_end
+			else:
+				chunks.append([row_start, row_end])
+			last_window = (max(end, start + 1) - 1) >> _LINEAR_SHIFT
+			if len(linear) <= last_window:
+				linear.extend([None] * (last_window + 1 - len(linear)))
+			for window in range(start >> _LINEAR_SHIFT, last_window + 1):
+				if linear[window] is None:
+					linear[window] = row_start
+		writer.close()
+
+	with open(filetowrite + ".tbi", 'wb') as index_file:
+		writer = BgzfWriter(index_file)
+		encoded_names = b''.join(name.encode('utf-8') + b'\0'
+								for name in names)
+		writer.write(b'TBI\x01' + struct.pack('<i', len(names)))
+		writer.write(_TABIX_PRESET.pack(*_TABIX_BED, len(encoded_names)))
+		writer.write(encoded_names)
+		for name in names:
+			bins, linear = references[name]
+			writer.write(struct.pack('<i', len(bins)))
+			for bin_number in sorted(bins):
+				chunks = bins[bin_number]
+				writer.write(struct.pack('<Ii', bin_number, len(chunks)))
+				for chunk_start, chunk_end in chunks:
+					writer.write(struct.pack('<QQ', chunk_start, chunk_end))
+			# Windows without a row of their own take the offset of the
+			# window before them
+			previous = 0
+			offsets = []
+			for offset in linear:
+				if offset is None:
+					offset = previous
+				offsets.append(offset)
+				previous = offset
+			writer.write(struct.pack('<i', len(offsets)))
+			writer.write(struct.pack('<' + str(len(offsets)) + 'Q', *offsets))
+		writer.close()
+
+
+def read_tabix_index(index_filename):
+	"""Reads a tabix index.
+
+	Args:
+		index_filename (str): Path to the .tbi file
+	Returns:
+		references (dict): Chromosome -> (bins, linear) where bins maps a bin
+							to a list of (start, end) virtual offsets and
+							linear is the list of window offsets
+	Raises:
+		ValueError: If the file is not a tabix index
+	"""
+
+	# A BGZF file is also a valid multi-member gzip file
+	try:
+		with gzip.open(index_filename, 'rb') as index_file:
+			data = index_file.read()
+	except (gzip.BadGzipFile, EOFError, zlib.error):
+		raise ValueError("Not a tabix index: " + index_filename)
+	if data[:4] != b'TBI\x01':
+		raise ValueError("Not a tabix index: " + index_filename)
+	try:
+		reference_count, = struct.unpack_from('<i', data, 4)
+		preset = _TABIX_PRESET.unpack_from(data, 8)
+		position = 8 + _TABIX_PRESET.size
+		names = data[position:position + preset[-1]].split(b'\0')
+		position += preset[-1]
+		references = {}
+		for reference in range(reference_count):
+			bins = {}
+			bin_count, = struct.unpack_from('<i', data, position)
+			position += 4
+			for _ in range(bin_count):
+				bin_number, chunk_count = struct.unpack_from('<Ii', data,
+															position)
+				position += 8
+				chunks = struct.unpack_from('<' + str(chunk_count * 2) + 'Q',
+											data, position)
+				position += chunk_count * 16
+				bins[bin_number] = list(zip(chunks[0::2], chunks[1::2]))
+			offset_count, = struct.unpack_from('<i', data, position)
+			position += 4
+			linear = struct.unpack_from('<' + str(offset_count) + 'Q', data,
+										position)
+			position += offset_count * 8
+			references[names[reference].decode('utf-8')] = (bins, linear)
+	except (struct.error, IndexError):
+		raise ValueError("Truncated tabix index: " + index_filename)
+	return references
+
+
+def query_bed(bed_filename, chromosome, start, end):
+	"""Returns the rows of an indexed BGZF BED file overlapping a region.
+	Only the blocks that the index gives for the region are decompressed.
+
+	Args:
+		bed_filename (str): Path to the BGZF BED file, indexed as .tbi
+		chromosome (str): Chromosome, with or without a 'chr' prefix
+		start (int): 0-based start of the region
+		end (int): End of the region, exclusive
+	Returns:
+		rows (list): Nested list of rows [chromosome, start, end, label]
+	Raises:
+		ValueError: If the file or its index is not valid
+	"""
+
+	references = read_tabix_index(bed_filename + ".tbi")
+	for name in references:
+		if chromosome_key(name) == chromosome_key(chromosome):
+			break
+	else:
+		return []
+	bins, linear = references[name]
+
+	# Chunks ending before the first row of the region's window are skipped
+	window = start >> _LINEAR_SHIFT
+	minimum_offset = linear[window] if window < len(linear) else \
+		(linear[-1] if linear else 0)
+	chunks = sorted(chunk for bin_number in reg2bins(start, end)
+					for chunk in bins.get(bin_number, ())
+					if chunk[1] > minimum_offset)
+	merged_chunks = []
+	for chunk_start, chunk_end in chunks:
+		if merged_chunks and chunk_start <= merged_chunks[-1][1]:
+			merged_chunks[-1][1] = max(merged_chunks[-1][1], chunk_end)
+		else:
+			merged_chunks.append([chunk_start, chunk_end])
+
+	rows = []
+	with open(bed_filename, 'rb') as bed_file:
+		reader = BgzfReader(bed_file)
+		for chunk_start, chunk_end in merged_chunks:
+			reader.seek(max(chunk_start, minimum_offset))
+			while reader.tell() < chunk_end:
+				line = reader.readline()
+				if not line:
+					break
+				fields = line.decode('utf-8').rstrip('\n').split('\t')
+				row_start, row_end = int(fields[1]), int(fields[2])
+				if fields[0] == name and row_start < end and row_end > start:
+					rows.append([fields[0], row_start, row_end] + fields[3:])
+	return rows
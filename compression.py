@@ -0,0 +1,45 @@
+"""
+This module contains functions for reading LRG XML files that may be gzip,
+bz2 or xz compressed. Compressed files are decompressed as they are read,
+without a temporary file or a decompressed copy held in memory.
+"""
+
+
+import bz2
+import gzip
+import lzma
+
+
+# File extensions recognised as LRG XML files when searching a directory
+XML_EXTENSIONS = ('.xml', '.xml.gz', '.xml.bz2', '.xml.xz')
+
+# Leading bytes of each compression format and the function that opens it
+_MAGIC_NUMBERS = [(b'\x1f\x8b', gzip.open),
+				(b'BZh', bz2.open),
+				(b'\xfd7zXZ\x00', lzma.open)]
+
+
+def is_xml_file(filename):
+	"""Returns True if the filename has a plain or compressed XML extension"""
+	return filename.endswith(XML_EXTENSIONS)
+
+
+def open_xml_file(xml_file):
+	"""Opens an XML file for reading in binary mode. The compression format
+	is detected from the first bytes of the file rather than its name, and
+	compressed files are returned as a stream that decompresses on read.
+
+	Args:
+		xml_file (str): Path to a plain or compressed XML file
+	Returns:
+		xml_stream (file): Binary file object of the decompressed XML
+	Raises:
+		OSError: If the file could not be opened
+	"""
+
+	with open(xml_file, 'rb') as f:
+		magic = f.read(6)
+	for magic_number, opener in _MAGIC_NUMBERS:
+		if magic.startswith(magic_number):
+			return opener(xml_file, 'rb')
+	return open(xml_file, 'rb')
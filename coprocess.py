@@ -0,0 +1,113 @@
+"""
+This module contains the co-process mode started with --jsonl, for workflow
+managers that would otherwise start lrgparser.py once per gene. Jobs are
+read from stdin as JSON, one object per line, and one JSON result is written
+to stdout per job, in the same order. Parsed LRGs are kept in the same
+bounded cache as the HTTP service (see server.py), so an LRG used by many
+jobs is only downloaded and parsed once.
+
+A job holds lrg, gene or file, then build, transcript, and optionally flank,
+introns, merge, an output BED filename and an id that is copied to its
+result, e.g:
+	{"id": 1, "gene": "MYH7", "build": "GRCh37.p13",
+		"transcript": "NM_000257.2", "flank": 50, "output": "MYH7.bed"}
+
+A result holds the id, ok, the LRG details, either the BED rows or the
+output filename, and the seconds taken, or an error message if ok is false.
+"""
+
+
+import contextlib
+import json
+import sys
+import time
+
+import bedgen
+import server
+
+
+def run_job(lrg_cache, job):
+	"""Runs one job.
+
+	Args:
+		lrg_cache (server.LRGIndexCache): Cache of parsed LRGs
+		job (dict): The job, as described at the top of this module
+	Returns:
+		result (dict): The result of the job
+	"""
+
+	start = time.perf_counter()
+	result = {'id': job.get('id')}
+	hits = lrg_cache.hits
+	misses = lrg_cache.misses
+	try:
+		response = server.create_bed_response(lrg_cache, job,
+											allow_files=True)
+		output = job.get('output')
+		if output:
+			if output == "-":
+				raise server.RequestError(400, "The output cannot be stdout")
+			# Writes the rows with the single BED file code path
+			bedgen.write_bed_file(str(output), response['header'],
+								response['rows'])
+			response['output'] = output
+			del response['rows']
+		result['ok'] = True
+		result.update(response)
+	except server.RequestError as error:
+		result['ok'] = False
+		result['error'] = error.message
+	except SystemExit:
+		result['ok'] = False
+		result['error'] = "Could not write BED file: " + str(job.get('output'))
+	except Exception as error:
+		result['ok'] = False
+		result['error'] = "Job failed: " + repr(error)
+	# True only if the LRG index was returned from memory, so not for a job
+	# that failed before reaching the cache
+	result['cached'] = lrg_cache.hits > hits and lrg_cache.misses == misses
+	result['seconds'] = time.perf_counter() - start
+	return result
+
+
+def run_coprocess(jobs=None, results=None, cache_size=None,
+				archive_file=None):
+	"""Reads jobs until the end of the input, writing a result line for
+	each. Blank lines are skipped. Messages that would otherwise be printed
+	to stdout are sent to stderr, so stdout only holds results.
+
+	Args:
+		jobs (file): Text stream of JSON jobs, one per line. Default stdin
+		results (file): Text stream the results are written to. Default
+						stdout
+		cache_size (int): Number of parsed LRGs kept in memory
+		archive_file (str): Packed archive read before downloading, or None
+	Returns:
+		True if every job succeeded
+	"""
+
+	jobs = jobs or sys.stdin
+	results = results or sys.stdout
+	lrg_cache = server.LRGIndexCache(cache_size or server.DEFAULT_CACHE_SIZE,
+									archive_file)
+	all_succeeded = True
+	with contextlib.redirect_stdout(sys.stderr):
+		for line in jobs:
+			if not line.strip():
+				continue
+			start = time.perf_counter()
+			try:
+				job = json.loads(line)
+			except ValueError:
+				job = None
+			if isinstance(job, dict):
+				result = run_job(lrg_cache, job)
+			else:
+				result = {'id': None, 'ok': False,
+						'error': "Expected a JSON object on one line",
+						'cached': False,
+						'seconds': time.perf_counter() - start}
+			all_succeeded = all_succeeded and result['ok']
+			results.write(json.dumps(result) + "\n")
+			results.flush()
+	return all_succeeded
@@ -1,65 +1,237 @@
-
-
 """
 This module contains functions for extracting and handling exon and intron
 coordinates
+
+The coordinates of a transcript are held as two integer arrays: the first
+and second coordinate of each exon or intron, in the order they are written
+to the dictionaries (start then end on the forward strand, end then start on
+the reverse strand). The mapping, intron and flank calculations work on the
+whole arrays at once, using NumPy when it is installed. The dictionary
+functions are thin wrappers around them.
 """
 
 
-import xml.etree.ElementTree as ET 
+from array import array
+from collections.abc import Mapping
+
+from lrgindex import get_lrg_index
+
+# NumPy is imported by load_numpy() the first time a transcript has enough
+# exons to use it, as importing it takes longer than mapping most transcripts
+np = None
+_numpy_imported = False
+
+
+# Below this many exons, NumPy's per-call overhead outweighs its speed, so
+# plain lists are used instead
+NUMPY_MIN_EXONS = 100
+
+
+def load_numpy():
+    """Imports NumPy on first use.
+
+    Returns:
+        np (module): The numpy module, or None if it is not installed
+    """
+    global np, _numpy_imported
+    if not _numpy_imported:
+        _numpy_imported = True
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+    return np
+
+
+def _is_numpy(values):
+    """Returns True if the coordinates are held in a NumPy array"""
+    return np is not None and isinstance(values, np.ndarray)
+
+
+def map_exons(lrg_starts, lrg_ends, other_start, other_end, strand):
+    """Maps LRG exon coordinates to genomic coordinates.
+
+    Args:
+        lrg_starts (sequence): LRG start coordinate of each exon
+        lrg_ends (sequence): LRG end coordinate of each exon
+        other_start (int): Genomic start of the LRG in the genome build
+        other_end (int): Genomic end of the LRG in the genome build
+        strand (str): '1' for the forward strand, '-1' for the reverse
+    Returns:
+        first (array): First coordinate of each mapped exon
+        second (array): Second coordinate of each mapped exon
+    """
+    # BED files use 0-based coordinate systems, so 1 is taken from the
+    # smaller coordinate of each exon. On the reverse strand this is the
+    # exon end, which is written in the 2nd column of the dictionary.
+    if strand == '1':
+        first_offset, second_offset, sign = other_start - 2, other_start - 1, 1
+    else:
+        first_offset, second_offset, sign = other_end + 1, other_end, -1
+    if len(lrg_starts) >= NUMPY_MIN_EXONS and load_numpy() is not None:
+        lrg_starts = np.asarray(lrg_starts, dtype=np.int64)
+        lrg_ends = np.asarray(lrg_ends, dtype=np.int64)
+        return (first_offset + sign * lrg_starts,
+                second_offset + sign * lrg_ends)
+    return ([first_offset + sign * start for start in lrg_starts],
+            [second_offset + sign * end for end in lrg_ends])
+
+
+def map_introns(first, second, forward):
+    """Maps introns as the gaps between adjacent mapped exons.
+
+    Args:
+        first (array): First coordinate of each mapped exon
+        second (array): Second coordinate of each mapped exon
+        forward (bool): True if the gene is on the forward strand
+    Returns:
+        first (array): First coordinate of each intron
+        second (array): Second coordinate of each intron
+    """
+    step = 1 if forward else -1
+    if _is_numpy(first):
+        return second[:-1] + step, first[1:] - step
+    return ([end + step for end in second[:-1]],
+            [start - step for start in first[1:]])
+
+
+def map_flanks(first, second, flank, forward):
+    """Widens each mapped exon by the flank size on both sides.
+
+    Args:
+        first (array): First coordinate of each mapped exon
+        second (array): Second coordinate of each mapped exon
+        flank (int): The flank size
+        forward (bool): True if the gene is on the forward strand
+    Returns:
+        first (array): First coordinate of each flanked exon
+        second (array): Second coordinate of each flanked exon
+    """
+    if not forward:
+        flank = -flank
+    if _is_numpy(first):
+        return first - flank, second + flank
+    return ([start - flank for start in first],
+            [end + flank for end in second])
+
+
+def get_exon_arrays(root, genome_choice, transcript_choice):
+    """Calculates the genomic coordinates of each exon as arrays.
+
+    Returns:
+        first (array): First coordinate of each mapped exon
+        second (array): Second coordinate of each mapped exon
+        forward (bool): True if the gene is on the forward strand
+        or None if the genome build or transcript is not in the LRG
+    """
+    lrg_index = get_lrg_index(root)
+    if (genome_choice not in lrg_index.genome_builds
+            or transcript_choice not in lrg_index.transcripts):
+        return None
+    chromosome, other_start, other_end, strand = \
+        lrg_index.genome_builds[genome_choice]
+    spans = lrg_index.transcripts[transcript_choice]
+    lrg_starts = [lrg_start for lrg_start, lrg_end in spans]
+    lrg_ends = [lrg_end for lrg_start, lrg_end in spans]
+    first, second = map_exons(lrg_starts, lrg_ends, other_start, other_end,
+                              strand)
+    return first, second, strand == '1'
+
+
+def arrays_to_coords(first, second):
+    """Converts coordinate arrays to a dictionary with exon or intron
+    numbers as keys and [first, second] lists as values,
+    i.e. {1: [23904870, 23904828]}
+    """
+    if _is_numpy(first):
+        first = first.tolist()
+        second = second.tolist()
+    return {number: [start, end] for number, (start, end)
+            in enumerate(zip(first, second), start=1)}
+
+
+class CoordinateMap(Mapping):
+    """Read-only dictionary of exon or intron coordinates, backed by two
+    compact array('q') buffers instead of a dict of two-element lists. It
+    behaves like the coordinate dictionaries, i.e. coords[1] returns
+    [23904870, 23904828] and it compares equal to the matching dict.
+    """
+    __slots__ = ('first', 'second')
+
+    def __init__(self, first=(), second=()):
+        if _is_numpy(first):
+            first = first.tolist()
+            second = second.tolist()
+        self.first = array('q', first)
+        self.second = array('q', second)
+
+    def __getitem__(self, number):
+        if type(number) is not int or not 1 <= number <= len(self.first):
+            raise KeyError(number)
+        return [self.first[number - 1], self.second[number - 1]]
+
+    def __iter__(self):
+        return iter(range(1, len(self.first) + 1))
+
+    def __len__(self):
+        return len(self.first)
+
+    def __repr__(self):
+        return "CoordinateMap(" + repr(dict(self)) + ")"
+
+    def __reduce__(self):
+        # Pickled as the two raw buffers, which is much smaller and faster
+        # than pickling a dict of lists
+        return (_coordinate_map_from_bytes,
+                (self.first.tobytes(), self.second.tobytes()))
+
+
+def _coordinate_map_from_bytes(first, second):
+    """Recreates a pickled CoordinateMap from its raw buffers"""
+    coordinate_map = CoordinateMap()
+    coordinate_map.first.frombytes(first)
+    coordinate_map.second.frombytes(second)
+    return coordinate_map
+
+
+def coords_to_map(coords):
+    """Converts a coordinate dictionary to a CoordinateMap"""
+    if isinstance(coords, CoordinateMap):
+        return coords
+    return CoordinateMap(*coords_to_arrays(coords))
+
+
+def coords_to_arrays(coords):
+    """Converts a coordinate dictionary back to arrays, in number order.
+
+    Returns:
+        first (array): First coordinate of each exon or intron
+        second (array): Second coordinate of each exon or intron
+    """
+    values = [coords[number] for number in sorted(coords)]
+    first = [value[0] for value in values]
+    second = [value[1] for value in values]
+    if len(first) >= NUMPY_MIN_EXONS and load_numpy() is not None:
+        return (np.array(first, dtype=np.int64),
+                np.array(second, dtype=np.int64))
+    return first, second
 
 
 def get_exon_coords(root, genome_choice, transcript_choice):
     """Calculates the genomic coordinates of each exon. It uses the mapping
-    information in the XML and the genome build and transcript provided by 
-    the user.
+    information in the XML and the genome build and transcript provided by
+    the user. The mappings are read from the LRGIndex of the root, so the
+    XML tree is only walked once however many builds and transcripts are
+    requested.
     """
-    mapped_coordinates = {}
-    
-    # Iterates from the root of the xml tree to identify mapping attributes.
-    for mapping in root.iter('mapping'):
-        # Checks the reference genome requested by the user and extracts the
-        # correct mapping start and end coordinates.
-        
-        if genome_choice == mapping.attrib['coord_system']:
-            for mapping_span in mapping.iter('mapping_span'):
-                mapped_start = int(mapping_span.attrib['other_start']) - 1
-                mapped_end = int(mapping_span.attrib['other_end']) + 1
-                strand = mapping_span.attrib['strand']
-
-
-        # Checks the transcript requested by the user and calculates the 
-        # genomic coordinates accordingly.
-        if transcript_choice == mapping.attrib['coord_system']:
-            count = 0
-            
-            for exon in mapping.iter('mapping_span'):
-                count += 1
-                coordinates = []
-
-                # Mapping differs depending on whether the gene is on the 
-                # forward or reverse strand
-                if strand == '1':
-                    exon_start = mapped_start + int(exon.attrib['lrg_start'])
-                    exon_end = mapped_start + int(exon.attrib['lrg_end'])
-                    # BED files use 0-based coordinate systems so (exon_start - 1) ensures that the coordinates
-                    # follow the BED specification
-                    coordinates.append(exon_start - 1)
-                    coordinates.append(exon_end)
-                elif strand == '-1':
-                    exon_start = mapped_end - int(exon.attrib['lrg_start'])
-                    exon_end = mapped_end - int(exon.attrib['lrg_end'])
-                    coordinates.append(exon_start)
-                    # BED files use 0-based coordinate systems so (exon_end - 1) ensures that the coordinates
-                    # follow the BED specification. In the reverse strand the exon_end will be printed on the
-                    # 2nd column of the BED file as it is a smaller value than the exon_start value.
-                    coordinates.append(exon_end - 1)
-                # Coordinates are stored in a dictionary with exon numbers as 
-                # keys, with start and stop coordinates as values 
-                # i.e. {'1': [23904870, 23904829]}
-                mapped_coordinates[count] = coordinates
-
-    return mapped_coordinates
+    exon_arrays = get_exon_arrays(root, genome_choice, transcript_choice)
+    if exon_arrays is None:
+        return {}
+    first, second, forward = exon_arrays
+    # Coordinates are stored in a dictionary with exon numbers as
+    # keys, with start and stop coordinates as values
+    # i.e. {'1': [23904870, 23904829]}
+    return arrays_to_coords(first, second)
 
 
 def get_intron_coords(exon_coords):
@@ -67,36 +239,18 @@ def get_intron_coords(exon_coords):
     mapped exon coordinates, and maps an intron as the gap between each exon.
     Introns coordinates do not include flanking regions.
     """
-    intron_coords = {}
-
-    for key in exon_coords.keys():
-        # Stop at the last exon as total exons = n, total introns = n-1
-        if (key+1) not in exon_coords.keys():
-            break
-        else:
-            # Check if the gene is on the foward strand
-            if (exon_coords[1][1] - exon_coords[1][0]) > 0:
-                intron_start = exon_coords[key][1] + 1 
-                intron_end = exon_coords[key+1][0] - 1
-                intron_coords[key] = [intron_start, intron_end]
-            # Check if the gene is on the reverse strand
-            elif (exon_coords[1][1] - exon_coords[1][0]) < 0:
-                intron_start = exon_coords[key][1] - 1 
-                intron_end = exon_coords[key+1][0] + 1
-                intron_coords[key] = [intron_start, intron_end]
-
-    return intron_coords
+    if 1 not in exon_coords:
+        return {}
+    # Check if the gene is on the foward strand
+    forward = (exon_coords[1][1] - exon_coords[1][0]) > 0
+    first, second = coords_to_arrays(exon_coords)
+    return arrays_to_coords(*map_introns(first, second, forward))
 
 
 def get_flanked_coords(exon_coords,flank=0):
     """Adjusts the flanking regions for each exon based on user input."""
-
-    flanked_coords = {}
-
-    for k,v in exon_coords.items():
-        if (v[1]-v[0]) > 0:
-            flanked_coords[k] = [(v[0] - flank), (v[1] + flank)]
-        elif (v[1]-v[0]) < 0:
-            flanked_coords[k] = [(v[0] + flank), (v[1] - flank)]
-
-    return flanked_coords
+    if 1 not in exon_coords:
+        return {}
+    forward = (exon_coords[1][1] - exon_coords[1][0]) > 0
+    first, second = coords_to_arrays(exon_coords)
+    return arrays_to_coords(*map_flanks(first, second, flank, forward))
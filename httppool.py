@@ -0,0 +1,163 @@
+"""
+This module contains the HTTPConnectionPool class, which keeps HTTP and
+HTTPS connections to each host open between requests so that repeated
+queries to the LRG web services do not pay for a new TCP/TLS handshake.
+"""
+
+
+import gzip
+import http.client
+import threading
+import urllib.parse
+
+import profiling
+
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+# Idle connections kept open for each host
+DEFAULT_MAX_IDLE = 8
+MAX_REDIRECTS = 5
+
+# Errors showing that a reused keep-alive connection was closed by the server
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected,
+							BrokenPipeError,
+							ConnectionResetError)
+
+
+class HTTPResponse:
+	"""A completed HTTP response.
+
+	Attributes:
+		status (int): HTTP status code
+		headers (http.client.HTTPMessage): Response headers
+		body (bytes): Response body, decompressed if it was gzip encoded
+		url (str): URL of the final response after any redirects
+	"""
+	def __init__(self, status, headers, body, url):
+		self.status = status
+		self.headers = headers
+		self.body = body
+		self.url = url
+
+
+class HTTPConnectionPool:
+	"""Pool of keep-alive connections, with one list of idle connections
+	per (scheme, host, port). Safe to use from several threads.
+
+	Attributes:
+		connect_timeout (float): Seconds allowed to open a connection
+		read_timeout (float): Seconds allowed between reads of a response
+		max_idle (int): Maximum idle connections kept for each host
+	"""
+	def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+				read_timeout=DEFAULT_READ_TIMEOUT, max_idle=DEFAULT_MAX_IDLE):
+		self.connect_timeout = connect_timeout
+		self.read_timeout = read_timeout
+		self.max_idle = max_idle
+		self.connections_opened = 0
+		self._idle = {}
+		self._lock = threading.Lock()
+
+	def _get_connection(self, key):
+		"""Returns an idle connection for the host, or opens a new one.
+
+		Returns:
+			(connection, reused): reused is True for an idle connection
+		"""
+		with self._lock:
+			idle = self._idle.get(key)
+			if idle:
+				return idle.pop(), True
+			self.connections_opened += 1
+		scheme, host, port = key
+		if scheme == 'https':
+			connection = http.client.HTTPSConnection(
+									host, port, timeout=self.connect_timeout)
+		else:
+			connection = http.client.HTTPConnection(
+									host, port, timeout=self.connect_timeout)
+		connection.connect()
+		connection.sock.settimeout(self.read_timeout)
+		return connection, False
+
+	def _release_connection(self, key, connection):
+		"""Returns a connection to the pool, or closes it if the pool for
+		the host is full
+		"""
+		with self._lock:
+			idle = self._idle.setdefault(key, [])
+			if len(idle) < self.max_idle:
+				idle.append(connection)
+				return
+		connection.close()
+
+	def close(self):
+		"""Closes every idle connection"""
+		with self._lock:
+			idle, self._idle = self._idle, {}
+		for connections in idle.values():
+			for connection in connections:
+				connection.close()
+
+	def request(self, url, headers=None):
+		"""Sends a GET request and reads the whole response. Redirects are
+		followed, and a gzip encoded body is decompressed.
+
+		Args:
+			url (str): The URL to request
+			headers (dict): Extra request headers
+		Returns:
+			response (HTTPResponse): The completed response
+		Raises:
+			OSError: If the host could not be reached or timed out
+			http.client.HTTPException: If the response was not valid HTTP
+		"""
+
+		for _ in range(MAX_REDIRECTS + 1):
+			response = self._request_once(url, headers)
+			location = response.headers.get('Location')
+			if response.status in (301, 302, 303, 307, 308) and location:
+				url = urllib.parse.urljoin(url, location)
+				continue
+			return response
+		raise http.client.HTTPException("Too many redirects: " + url)
+
+	def _request_once(self, url, headers):
+		"""Sends one GET request without following redirects"""
+		parts = urllib.parse.urlsplit(url)
+		port = parts.port or (443 if parts.scheme == 'https' else 80)
+		key = (parts.scheme, parts.hostname, port)
+		path = parts.path or '/'
+		if parts.query:
+			path += '?' + parts.query
+		request_headers = {'Accept-Encoding': 'gzip',
+							'Connection': 'keep-alive'}
+		request_headers.update(headers or {})
+
+		while True:
+			connection, reused = self._get_connection(key)
+			try:
+				connection.request('GET', path, headers=request_headers)
+				http_response = connection.getresponse()
+				body = http_response.read()
+				break
+			except _STALE_CONNECTION_ERRORS:
+				connection.close()
+				# The server closed an idle connection, so retry on a new one
+				if not reused:
+					raise
+			except BaseException:
+				connection.close()
+				raise
+
+		if http_response.will_close:
+			connection.close()
+		else:
+			self._release_connection(key, connection)
+		profiling.count('http_requests')
+		profiling.count('bytes_downloaded', len(body))
+		if http_response.getheader('Content-Encoding') == 'gzip':
+			body = gzip.decompress(body)
+		return HTTPResponse(http_response.status, http_response.headers,
+							body, url)
@@ -0,0 +1,109 @@
+"""
+This module contains functions for a persistent cache of LRGIndex objects,
+stored in their compact binary form and keyed by a hash of the LRG XML file
+contents. A cache hit skips XML parsing entirely.
+"""
+
+
+import hashlib
+import os
+
+import compression
+import lrgindex
+import xmlbackend
+
+
+DEFAULT_INDEX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".lrg_parser",
+										"index_cache")
+# Directory of the cache used by load_lrg_index(), or None to disable it
+CACHE_DIR = None
+
+# Bytes read at a time when hashing an XML file
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(xml_file):
+	"""Returns a hash of the contents of a file, read in chunks.
+
+	Args:
+		xml_file (str): Path to the file
+	Returns:
+		digest (str): Hexadecimal BLAKE2b digest
+	"""
+
+	digest = hashlib.blake2b(digest_size=20)
+	with open(xml_file, 'rb') as f:
+		for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def _parse_xml_file(xml_file):
+	"""Returns the pruned XML root of an LRG XML file, read as
+	lrgparser.get_tree_and_root_file() reads it. lrgparser is not imported
+	here, as it imports this module.
+
+	Raises:
+		SystemExit: If the XML file could not be read
+	"""
+	try:
+		with compression.open_xml_file(xml_file) as xml_stream:
+			return xmlbackend.parse_pruned(xml_stream,
+											xmlbackend.LRG_KEPT_ELEMENTS)
+	except:
+		print("Error: XML root could not be extracted from the file.")
+		print("Are you sure that it is a valid LRG XML file?")
+		raise SystemExit
+
+
+def _cache_path(cache_dir, digest):
+	"""Returns the cache file path for a hash. Files are spread over
+	subdirectories named by the first two characters of the hash.
+	"""
+	return os.path.join(cache_dir, digest[:2], digest + ".lrgi")
+
+
+def load_lrg_index(xml_file, cache_dir=None):
+	"""Returns the LRGIndex of an LRG XML file, using the cache if one is
+	configured. On a miss, the file is parsed and its index is stored.
+
+	Args:
+		xml_file (str): Path to a plain or compressed LRG XML file
+		cache_dir (str): Cache directory, or None to use CACHE_DIR
+	Returns:
+		lrg_index (LRGIndex): Index of the LRG annotation
+	Raises:
+		SystemExit: If the XML file could not be read
+	"""
+
+	if cache_dir is None:
+		cache_dir = CACHE_DIR
+	if cache_dir is None:
+		root = _parse_xml_file(xml_file)
+		return lrgindex.get_lrg_index(root)
+
+	try:
+		cache_path = _cache_path(cache_dir, file_hash(xml_file))
+	except OSError:
+		print("Error: XML root could not be extracted from the file.")
+		print("Are you sure that it is a valid LRG XML file?")
+		raise SystemExit
+	try:
+		with open(cache_path, 'rb') as f:
+			return lrgindex.LRGIndex.from_bytes(f.read())
+	except (OSError, ValueError):
+		pass
+
+	root = _parse_xml_file(xml_file)
+	lrg_index = lrgindex.get_lrg_index(root)
+	try:
+		os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+		# Written under a temporary name and renamed, so a reader never sees
+		# a partly written file
+		temporary_path = cache_path + "." + str(os.getpid()) + ".tmp"
+		with open(temporary_path, 'wb') as f:
+			f.write(lrg_index.to_bytes())
+		os.replace(temporary_path, cache_path)
+	except OSError:
+		print("    Could not write to the index cache: " + cache_dir)
+	return lrg_index
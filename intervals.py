@@ -0,0 +1,330 @@
+"""
+This module contains the IntervalIndex class, which answers the reverse of
+BED generation: which LRG, transcript, exon or intron covers a genomic
+position or range. The mapped exons and introns of many LRGs are held, for
+each genome build and chromosome, in arrays sorted by start so that a query
+is a binary search rather than a rescan of every XML file. A built index
+is saved to disk, keyed by the path, modification time and size of the
+files it was built from, and reloaded by later queries of the same files.
+"""
+
+
+import hashlib
+import marshal
+import os
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+
+import bedgen
+import bgzf
+import lrgparser
+
+
+# Version of the saved interval index format, changed whenever it changes
+INDEX_FORMAT_VERSION = 1
+
+
+# A region such as chr14:23900000 or 14:23900000-23900500, 1-based inclusive
+_REGION_PATTERN = re.compile(r'^(?:chr)?([^:]+):([\d,]+)(?:-([\d,]+))?$',
+							re.IGNORECASE)
+
+
+def parse_region(region):
+	"""Converts a region such as chr14:23900000 or chr14:23900000-23900500
+	to the 0-based, end-exclusive coordinates used in BED files.
+
+	Args:
+		region (str): Chromosome and 1-based position or inclusive range
+	Returns:
+		chromosome (str): Chromosome without a 'chr' prefix e.g 14
+		start (int): 0-based start of the region
+		end (int): End of the region, exclusive
+	Raises:
+		ValueError: If the region is not in the expected format
+	"""
+
+	match = _REGION_PATTERN.match(region.strip())
+	if match is None:
+		raise ValueError("Invalid region: " + region)
+	chromosome, start, end = match.groups()
+	start = int(start.replace(',', ''))
+	end = int(end.replace(',', '')) if end else start
+	if start < 1 or end < start:
+		raise ValueError("Invalid region: " + region)
+	return chromosome, start - 1, end
+
+
+class IntervalIndex:
+	"""Index of mapped exon and intron intervals for many LRGs.
+
+	Intervals are added to a pending list and sorted into arrays the first
+	time their genome build and chromosome is queried. Alongside the sorted
+	starts and ends, the running maximum of the ends is kept, so the first
+	interval that can reach a position is also found by binary search.
+	"""
+	def __init__(self):
+		self._pending = {}
+		self._tables = {}
+
+	def add(self, genome_build, chromosome, start, end, record):
+		"""Adds one interval.
+
+		Args:
+			genome_build (str): Genome build e.g GRCh37.p13
+			chromosome (str): Chromosome, with or without a 'chr' prefix
+			start (int): 0-based start
+			end (int): End, exclusive
+			record (tuple): (lrg_id, hgnc_name, transcript, label)
+		"""
+		key = (genome_build, bgzf.chromosome_key(chromosome))
+		intervals = self._pending.get(key)
+		if intervals is None:
+			# A table loaded by from_bytes() has no pending list yet
+			starts, ends, max_ends, records = self._tables.get(
+											key, ((), (), (), ()))
+			intervals = self._pending[key] = list(zip(starts, ends, records))
+		intervals.append((start, end, record))
+		self._tables.pop(key, None)
+
+	def add_lrg(self, root, genome_builds=None):
+		"""Adds the exons and introns of every transcript of an LRG.
+
+		Args:
+			root (xml.etree.ElementTree or LRGIndex): XML root or LRG index
+			genome_builds (list): Genome builds to add, or None for all
+		"""
+		lrg_index = lrgparser.get_lrg_index(root)
+		for genome_choice in lrgparser.get_genome_builds(lrg_index):
+			if genome_builds and genome_choice not in genome_builds:
+				continue
+			for transcript_choice in lrgparser.get_transcript_ids(lrg_index):
+				lrg_object = lrgparser.lrg_object_creator(lrg_index,
+														genome_choice,
+														transcript_choice,
+														0)
+				for chromosome, start, end, label in \
+						bedgen.create_bed_contents(lrg_object, True):
+					self.add(genome_choice, chromosome, start, end,
+							(lrg_index.lrg_id, lrg_index.hgnc_name,
+							transcript_choice, label))
+
+	@property
+	def genome_builds(self):
+		"""Sorted list of the genome builds in the index"""
+		return sorted({genome_build for genome_build, chromosome
+						in list(self._pending) + list(self._tables)})
+
+	def _table(self, key):
+		"""Returns the sorted arrays for a genome build and chromosome"""
+		table = self._tables.get(key)
+		if table is None:
+			intervals = sorted(self._pending.get(key, ()),
+								key=lambda interval: interval[:2])
+			starts = array('q', [interval[0] for interval in intervals])
+			ends = array('q', [interval[1] for interval in intervals])
+			max_ends = array('q')
+			max_end = None
+			for end in ends:
+				if max_end is None or end > max_end:
+					max_end = end
+				max_ends.append(max_end)
+			records = [interval[2] for interval in intervals]
+			table = (starts, ends, max_ends, records)
+			self._tables[key] = table
+		return table
+
+	def to_bytes(self):
+		"""Returns the index in the binary form read by from_bytes(). Every
+		table is sorted first, so a loaded index needs no sorting.
+		"""
+		tables = {}
+		for key in list(self._pending) + list(self._tables):
+			starts, ends, max_ends, records = self._table(key)
+			tables[key] = (starts.tobytes(), ends.tobytes(),
+							max_ends.tobytes(), records)
+		return marshal.dumps((INDEX_FORMAT_VERSION, tables))
+
+	@classmethod
+	def from_bytes(cls, data):
+		"""Returns an IntervalIndex from the bytes written by to_bytes()
+
+		Raises:
+			ValueError: If the data is not a saved index of this version
+		"""
+		try:
+			version, tables = marshal.loads(data)
+		except (EOFError, TypeError, ValueError):
+			raise ValueError("Not a saved interval index")
+		if version != INDEX_FORMAT_VERSION:
+			raise ValueError("Unsupported interval index version")
+		interval_index = cls()
+		for key, (starts, ends, max_ends, records) in tables.items():
+			interval_index._tables[key] = (array('q', starts),
+											array('q', ends),
+											array('q', max_ends),
+											records)
+		return interval_index
+
+	def query(self, genome_build, chromosome, start, end=None):
+		"""Returns the intervals that overlap a position or range.
+
+		Args:
+			genome_build (str): Genome build e.g GRCh37.p13
+			chromosome (str): Chromosome, with or without a 'chr' prefix
+			start (int): 0-based start of the region
+			end (int): End of the region, exclusive. Defaults to start + 1
+		Returns:
+			hits (list): (start, end, record) of each overlapping interval,
+							ordered by start
+		"""
+		if end is None:
+			end = start + 1
+		key = (genome_build, bgzf.chromosome_key(chromosome))
+		starts, ends, max_ends, records = self._table(key)
+		# Intervals starting before the end of the region, of which only
+		# those from the first with a running maximum end past the start of
+		# the region can overlap it
+		last = bisect_left(starts, end)
+		first = bisect_right(max_ends, start, 0, last)
+		return [(starts[i], ends[i], records[i]) for i in range(first, last)
+				if ends[i] > start]
+
+
+def _parse_region_or_exit(region):
+	"""Returns parse_region(region), exiting with a message if invalid"""
+	try:
+		return parse_region(region)
+	except ValueError:
+		print("    Invalid region, expected e.g chr14:23900000 or " +
+				"chr14:23900000-23900500: " + region)
+		raise SystemExit
+
+
+def _saved_index_path(cache_dir, source_files, genome_builds):
+	"""Returns the path an interval index is saved under and the key it is
+	saved with: the path, modification time and size of each source file.
+	"""
+	source_key = []
+	for source_file in source_files:
+		source_file = os.path.abspath(source_file)
+		try:
+			stat = os.stat(source_file)
+			source_key.append((source_file, stat.st_mtime_ns, stat.st_size))
+		except OSError:
+			source_key.append((source_file, None, None))
+	# The key names the file, so that other sets of files are saved apart
+	name = repr(([source_file for source_file, mtime, size in source_key],
+				sorted(genome_builds or [])))
+	digest = hashlib.blake2b(name.encode('utf-8'), digest_size=20).hexdigest()
+	return os.path.join(cache_dir, digest + ".lrgq"), repr(source_key)
+
+
+def load_interval_index(roots, genome_builds=None, source_files=None,
+						cache_dir=None):
+	"""Returns the IntervalIndex of LRG roots. When the files the roots are
+	read from and a cache directory are given, an index saved for the same
+	unchanged files is loaded instead, and a newly built index is saved.
+
+	Args:
+		roots (iterable): XML roots or LRG indexes, only read if the index
+							is built
+		genome_builds (list): Genome builds to add, or None for all
+		source_files (list): Paths of the files the roots are read from
+		cache_dir (str): Directory the index is saved in, or None
+	Returns:
+		interval_index (IntervalIndex): Index of the exons and introns
+	"""
+
+	saved_index_path = None
+	if source_files != None and cache_dir != None:
+		saved_index_path, source_key = _saved_index_path(cache_dir,
+														source_files,
+														genome_builds)
+		try:
+			with open(saved_index_path, 'rb') as f:
+				saved_key, data = marshal.load(f)
+			if saved_key == source_key:
+				return IntervalIndex.from_bytes(data)
+		except (OSError, EOFError, TypeError, ValueError):
+			pass
+
+	interval_index = IntervalIndex()
+	for root in roots:
+		interval_index.add_lrg(root, genome_builds)
+
+	if saved_index_path != None:
+		try:
+			os.makedirs(cache_dir, exist_ok=True)
+			# Written under a temporary name and renamed, so a reader never
+			# sees a partly written file
+			temporary_path = saved_index_path + "." + str(os.getpid()) + ".tmp"
+			with open(temporary_path, 'wb') as f:
+				marshal.dump((source_key, interval_index.to_bytes()), f)
+			os.replace(temporary_path, saved_index_path)
+		except OSError:
+			print("    Could not write to the index cache: " + cache_dir)
+	return interval_index
+
+
+def run_query(region, roots, genome_builds=None, source_files=None,
+			cache_dir=None):
+	"""Prints the LRG exons and introns covering a region, one tab separated
+	line per interval: chromosome, start, end, genome build, LRG ID, gene,
+	transcript, label. The IntervalIndex of the roots is loaded or built
+	with load_interval_index().
+
+	Args:
+		region (str): Region such as chr14:23900000 or chr14:1000-2000
+		roots (iterable): XML roots or LRG indexes to search
+		genome_builds (list): Genome builds to search, or None for all
+		source_files (list): Paths of the files the roots are read from
+		cache_dir (str): Directory the index is saved in, or None
+	Returns:
+		rows (list): The printed rows
+	Raises:
+		SystemExit: If the region is not valid
+	"""
+
+	chromosome, start, end = _parse_region_or_exit(region)
+
+	interval_index = load_interval_index(roots, genome_builds, source_files,
+										cache_dir)
+
+	rows = []
+	for genome_build in interval_index.genome_builds:
+		for hit_start, hit_end, record in interval_index.query(
+								genome_build, chromosome, start, end):
+			rows.append(["chr" + chromosome, hit_start, hit_end,
+						genome_build] + list(record))
+	if not rows:
+		print("    No LRG exon or intron covers " + region)
+	for row in rows:
+		print("\t".join(str(value) for value in row))
+	return rows
+
+
+def run_bed_query(region, bed_filename):
+	"""Prints the rows of a block gzip compressed, tabix indexed BED file
+	overlapping a region. Only the blocks holding the region are read.
+
+	Args:
+		region (str): Region such as chr14:23900000 or chr14:1000-2000
+		bed_filename (str): Path to the BED file, indexed as .tbi
+	Returns:
+		rows (list): The printed rows
+	Raises:
+		SystemExit: If the region, BED file or index is not valid
+	"""
+
+	chromosome, start, end = _parse_region_or_exit(region)
+	try:
+		rows = bgzf.query_bed(bed_filename, chromosome, start, end)
+	except (OSError, ValueError):
+		print("    Could not read the indexed BED file: " + bed_filename)
+		raise SystemExit
+	if not rows:
+		print("    No BED row covers " + region)
+	for row in rows:
+		print("\t".join(str(value) for value in row))
+	return rows
@@ -0,0 +1,239 @@
+"""
+This module contains the LRGCache class, an on-disk cache of downloaded LRG
+XML files. Files are stored gzip compressed and keyed by LRG ID. Entries
+expire after a time to live, and the least recently used entries are
+evicted when the cache grows beyond its size cap.
+"""
+
+
+import contextlib
+import gzip
+import json
+import os
+import re
+import threading
+import time
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".lrg_parser",
+								"cache")
+# 256 MiB holds a compressed copy of the whole LRG corpus several times over
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# Entries older than a week are checked against the server before use
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+INDEX_FILENAME = "index.json"
+# Held while the index is read and written, so processes do not overwrite
+# each other's entries
+LOCK_FILENAME = "index.lock"
+
+_lrg_id_pattern = re.compile(r"^LRG_\d+$")
+
+_modification_date_pattern = re.compile(
+					rb"<modification_date>\s*([^<\s]+)\s*</modification_date>")
+
+
+def get_modification_date(xml_file):
+	"""Returns the most recent modification_date found in an LRG XML file,
+	without parsing the whole file.
+
+	Args:
+		xml_file (bytes): Contents of an LRG XML file
+	Returns:
+		modification_date (str): Date e.g 2018-11-21, or None if not found
+	"""
+
+	dates = _modification_date_pattern.findall(xml_file)
+	if not dates:
+		return None
+	return max(dates).decode()
+
+
+def normalise_lrg_id(lrg_id):
+	"""Returns an LRG ID in upper case, e.g lrg_384 -> LRG_384, or None if
+	it is not an LRG ID, so it cannot name a file outside the cache.
+
+	Args:
+		lrg_id (str): LRG ID e.g LRG_384
+	Returns:
+		lrg_id (str): The normalised LRG ID, or None
+	"""
+
+	lrg_id = str(lrg_id).strip().upper()
+	if not _lrg_id_pattern.match(lrg_id):
+		return None
+	return lrg_id
+
+
+class LRGCache:
+	"""On-disk cache of LRG XML files. The cache may be shared by several
+	processes, e.g directory workers, the server and the command line, so
+	the index is read again from disk, under a lock file, before every
+	change and written back before the lock is released.
+
+	Attributes:
+		directory (str): Directory holding the cached files and index
+		max_size (int): Maximum total size in bytes of the compressed files
+		ttl (int): Seconds after which an entry is no longer fresh
+	"""
+	def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE,
+				ttl=DEFAULT_TTL):
+		self.directory = directory
+		self.max_size = max_size
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		# The index as last read from disk
+		self._index = None
+
+	def _path(self, lrg_id):
+		return os.path.join(self.directory, lrg_id + ".xml.gz")
+
+	@contextlib.contextmanager
+	def _locked_index(self, save=True):
+		"""Holds the cache lock while the index is read from disk and,
+		unless save is False, written back when the block ends. The lock is
+		taken both between threads and, where fcntl is available, between
+		processes.
+
+		Yields:
+			index (dict): LRG ID -> entry, read from disk
+		"""
+		with self._lock:
+			os.makedirs(self.directory, exist_ok=True)
+			with open(os.path.join(self.directory, LOCK_FILENAME), "a") as lock:
+				if fcntl != None:
+					fcntl.flock(lock, fcntl.LOCK_EX)
+				try:
+					self._index = self._load_index()
+					yield self._index
+					if save:
+						self._save_index()
+				finally:
+					if fcntl != None:
+						fcntl.flock(lock, fcntl.LOCK_UN)
+
+	def _load_index(self):
+		"""Reads the index of cached entries from disk"""
+		try:
+			with open(os.path.join(self.directory, INDEX_FILENAME)) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+	def _save_index(self):
+		"""Writes the index to disk. A temporary file is renamed over the old
+		index so that a reader never sees a partly written file.
+		"""
+		index_path = os.path.join(self.directory, INDEX_FILENAME)
+		temporary_path = index_path + "." + str(os.getpid()) + ".tmp"
+		with open(temporary_path, "w") as f:
+			json.dump(self._index, f)
+		os.replace(temporary_path, index_path)
+
+	def get(self, lrg_id, allow_stale=False):
+		"""Returns a cached LRG XML file.
+
+		Args:
+			lrg_id (str): LRG ID e.g LRG_384
+			allow_stale (bool): Return entries that are older than the TTL
+		Returns:
+			xml_file (bytes): Contents of the XML file, or None if the entry
+								is missing, or stale and allow_stale is False
+		"""
+
+		lrg_id = normalise_lrg_id(lrg_id)
+		if lrg_id is None or not os.path.isdir(self.directory):
+			return None
+		with self._locked_index() as index:
+			entry = index.get(lrg_id)
+			if entry is None:
+				return None
+			if not allow_stale and time.time() - entry['stored'] > self.ttl:
+				return None
+			try:
+				with open(self._path(lrg_id), "rb") as f:
+					xml_file = gzip.decompress(f.read())
+			except OSError:
+				del index[lrg_id]
+				return None
+			entry['accessed'] = time.time()
+		return xml_file
+
+	def modification_date(self, lrg_id):
+		"""Returns the modification_date of a cached entry, or None"""
+		lrg_id = normalise_lrg_id(lrg_id)
+		if lrg_id is None or not os.path.isdir(self.directory):
+			return None
+		with self._locked_index(save=False) as index:
+			entry = index.get(lrg_id)
+		if entry is None:
+			return None
+		return entry['modification_date']
+
+	def put(self, lrg_id, xml_file):
+		"""Stores an LRG XML file, evicting least recently used entries if the
+		cache is over its size cap. Search terms that are not LRG IDs are
+		not stored.
+
+		Args:
+			lrg_id (str): LRG ID e.g LRG_384
+			xml_file (bytes): Contents of the XML file
+		"""
+
+		lrg_id = normalise_lrg_id(lrg_id)
+		if lrg_id is None:
+			return
+		compressed = gzip.compress(xml_file)
+		with self._locked_index() as index:
+			with open(self._path(lrg_id), "wb") as f:
+				f.write(compressed)
+			now = time.time()
+			index[lrg_id] = {'stored': now,
+							'accessed': now,
+							'size': len(compressed),
+							'modification_date': get_modification_date(xml_file)}
+			self._evict()
+
+	def touch(self, lrg_id):
+		"""Marks a cached entry as fresh again, used when the server reports
+		that the LRG has not been modified.
+		"""
+		lrg_id = normalise_lrg_id(lrg_id)
+		if lrg_id is None:
+			return
+		with self._locked_index() as index:
+			entry = index.get(lrg_id)
+			if entry is not None:
+				entry['stored'] = entry['accessed'] = time.time()
+
+	def _evict(self):
+		"""Removes the least recently used entries until the total size is
+		within the cap, and any cached files missing from the index. The lock
+		must already be held.
+		"""
+		total_size = sum(entry['size'] for entry in self._index.values())
+		by_last_use = sorted(self._index.items(),
+							key=lambda item: item[1]['accessed'])
+		for lrg_id, entry in by_last_use:
+			if total_size <= self.max_size:
+				break
+			try:
+				os.remove(self._path(lrg_id))
+			except OSError:
+				pass
+			total_size -= entry['size']
+			del self._index[lrg_id]
+		# Files are only written with the lock held, so a file without an
+		# entry is left over from an earlier version of the cache
+		for filename in os.listdir(self.directory):
+			if (filename.endswith(".xml.gz") and
+					filename[:-len(".xml.gz")] not in self._index):
+				try:
+					os.remove(os.path.join(self.directory, filename))
+				except OSError:
+					pass
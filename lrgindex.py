@@ -0,0 +1,230 @@
+"""
+This module contains the LRGIndex class, which holds the annotation needed
+for BED generation (genome build mappings, transcript mapping spans and the
+fixed annotation IDs) after a single traversal of an LRG XML root.
+"""
+
+
+import struct
+import weakref
+from array import array
+
+import profiling
+
+
+# Header of the binary form of an LRGIndex, followed by a format version
+BINARY_MAGIC = b'LRGI'
+BINARY_VERSION = 1
+
+
+# Indexes that have already been built, keyed by the XML root they came from
+_index_cache = weakref.WeakKeyDictionary()
+
+
+class LRGIndex:
+	"""Index of an LRG XML root.
+
+	Attributes:
+		lrg_id (str): LRG ID e.g LRG_384
+		hgnc_id (str): HGNC ID e.g 7577
+		hgnc_name (str): HGNC gene name from the lrg_locus tag e.g MYH7
+		seq_source (str): Sequence source e.g NG_007884.1
+		mol_type (str): Molecule type e.g dna
+		modification_date (str): Most recent annotation_set modification date
+		genome_builds (dict): Genome build -> (chromosome, start, end, strand)
+		transcripts (dict): Transcript ID -> list of (lrg_start, lrg_end)
+	"""
+	def __init__(self):
+		self.lrg_id = None
+		self.hgnc_id = None
+		self.hgnc_name = None
+		self.seq_source = None
+		self.mol_type = None
+		self.modification_date = None
+		self.genome_builds = {}
+		self.transcripts = {}
+
+	@classmethod
+	def from_root(cls, root):
+		"""Builds an LRGIndex by walking the XML root once.
+
+		Args:
+			root (xml.etree.ElementTree): ElementTree object representing the
+											root of the XML file
+		Returns:
+			lrg_index (LRGIndex): Index of the LRG annotation
+		"""
+
+		lrg_index = cls()
+		for section in root:
+			if section.tag == 'fixed_annotation':
+				lrg_index._add_fixed_annotation(section)
+			elif section.tag == 'updatable_annotation':
+				for annotation_set in section:
+					if annotation_set.tag == 'annotation_set':
+						lrg_index._add_annotation_set(annotation_set)
+		return lrg_index
+
+	def _add_fixed_annotation(self, fixed_annotation):
+		"""Reads the IDs held in the fixed_annotation tag"""
+		for field in fixed_annotation:
+			if field.tag == 'id':
+				self.lrg_id = field.text
+			elif field.tag == 'hgnc_id':
+				self.hgnc_id = field.text
+			elif field.tag == 'sequence_source':
+				self.seq_source = field.text
+			elif field.tag == 'mol_type':
+				self.mol_type = field.text
+
+	def _add_annotation_set(self, annotation_set):
+		"""Reads the mappings held in an annotation_set tag. Mappings in the
+		'lrg' set are genome builds, while mappings in the 'ncbi' and
+		'ensembl' sets are transcripts.
+		"""
+		source = annotation_set.attrib["type"]
+		for item in annotation_set:
+			if item.tag == "mapping":
+				coord_system = item.attrib["coord_system"]
+				spans = item.findall('mapping_span')
+				if source == "lrg" and spans:
+					# As in the original mapping code, the last span gives
+					# the genomic position of the LRG
+					span = spans[-1]
+					self.genome_builds[coord_system] = (
+									item.attrib["other_name"],
+									int(span.attrib['other_start']),
+									int(span.attrib['other_end']),
+									span.attrib['strand'])
+				elif source == "ncbi" or source == "ensembl":
+					self.transcripts[coord_system] = [
+									(int(span.attrib['lrg_start']),
+									int(span.attrib['lrg_end']))
+									for span in spans]
+			elif item.tag == "lrg_locus" and source == "lrg":
+				self.hgnc_name = item.text
+			elif item.tag == "modification_date":
+				if (self.modification_date is None
+						or item.text > self.modification_date):
+					self.modification_date = item.text
+
+	def to_bytes(self):
+		"""Returns the index in a compact binary form, read back with
+		LRGIndex.from_bytes(). Strings are stored with a 2-byte length and
+		coordinates as arrays of signed 64-bit integers.
+		"""
+		parts = [BINARY_MAGIC, struct.pack('<B', BINARY_VERSION)]
+		for value in (self.lrg_id, self.hgnc_id, self.hgnc_name,
+					self.seq_source, self.mol_type, self.modification_date):
+			parts.append(_pack_string(value))
+		parts.append(struct.pack('<I', len(self.genome_builds)))
+		for build, (chromosome, start, end, strand) in \
+				self.genome_builds.items():
+			parts.append(_pack_string(build))
+			parts.append(_pack_string(chromosome))
+			parts.append(struct.pack('<qq', start, end))
+			parts.append(_pack_string(strand))
+		parts.append(struct.pack('<I', len(self.transcripts)))
+		for transcript, spans in self.transcripts.items():
+			parts.append(_pack_string(transcript))
+			parts.append(struct.pack('<I', len(spans)))
+			coordinates = array('q')
+			for lrg_start, lrg_end in spans:
+				coordinates.append(lrg_start)
+				coordinates.append(lrg_end)
+			parts.append(coordinates.tobytes())
+		return b''.join(parts)
+
+	@classmethod
+	def from_bytes(cls, data):
+		"""Reads an index written by LRGIndex.to_bytes().
+
+		Args:
+			data (bytes): Binary form of an LRGIndex
+		Returns:
+			lrg_index (LRGIndex): Index of the LRG annotation
+		Raises:
+			ValueError: If the data is not a binary LRGIndex of this version
+		"""
+
+		if (data[:4] != BINARY_MAGIC or
+				struct.unpack_from('<B', data, 4)[0] != BINARY_VERSION):
+			raise ValueError("Not a binary LRG index")
+		try:
+			lrg_index = cls()
+			offset = 5
+			values = []
+			for _ in range(6):
+				value, offset = _unpack_string(data, offset)
+				values.append(value)
+			(lrg_index.lrg_id, lrg_index.hgnc_id, lrg_index.hgnc_name,
+				lrg_index.seq_source, lrg_index.mol_type,
+				lrg_index.modification_date) = values
+			build_count, = struct.unpack_from('<I', data, offset)
+			offset += 4
+			for _ in range(build_count):
+				build, offset = _unpack_string(data, offset)
+				chromosome, offset = _unpack_string(data, offset)
+				start, end = struct.unpack_from('<qq', data, offset)
+				offset += 16
+				strand, offset = _unpack_string(data, offset)
+				lrg_index.genome_builds[build] = (chromosome, start, end,
+												strand)
+			transcript_count, = struct.unpack_from('<I', data, offset)
+			offset += 4
+			for _ in range(transcript_count):
+				transcript, offset = _unpack_string(data, offset)
+				span_count, = struct.unpack_from('<I', data, offset)
+				offset += 4
+				coordinates = array('q')
+				coordinates.frombytes(data[offset:offset + span_count * 16])
+				offset += span_count * 16
+				lrg_index.transcripts[transcript] = list(
+								zip(coordinates[0::2], coordinates[1::2]))
+		except (struct.error, UnicodeDecodeError):
+			raise ValueError("Truncated binary LRG index")
+		return lrg_index
+
+
+def _pack_string(value):
+	"""Packs a string, or None, with a 2-byte length prefix"""
+	if value is None:
+		return struct.pack('<H', 0xFFFF)
+	encoded = value.encode('utf-8')
+	return struct.pack('<H', len(encoded)) + encoded
+
+
+def _unpack_string(data, offset):
+	"""Unpacks a string packed by _pack_string()
+
+	Returns:
+		(value, offset): The string or None, and the offset after it
+	"""
+	length, = struct.unpack_from('<H', data, offset)
+	offset += 2
+	if length == 0xFFFF:
+		return None, offset
+	if offset + length > len(data):
+		raise struct.error("string runs past the end of the data")
+	return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+def get_lrg_index(root):
+	"""Returns the LRGIndex for an XML root, building it on first use.
+	Passing an LRGIndex returns it unchanged, so functions can accept
+	either.
+
+	Args:
+		root (xml.etree.ElementTree or LRGIndex): XML root or LRG index
+	Returns:
+		lrg_index (LRGIndex): Index of the LRG annotation
+	"""
+
+	if isinstance(root, LRGIndex):
+		return root
+	lrg_index = _index_cache.get(root)
+	if lrg_index is None:
+		with profiling.timer('index'):
+			lrg_index = LRGIndex.from_root(root)
+		_index_cache[root] = lrg_index
+	return lrg_index
@@ -7,7 +7,9 @@ These are then imported as modules.
 """
 
 
-import argparse
+import contextlib
+import hashlib
+import io
 import os
 import sys
 import datetime
@@ -17,27 +19,70 @@ import datetime
 import bedgen 
 # functions contains the exon extraction functions.
 import functions
-# ui contains the terminal UI functions.  
-import ui 
-# webservices contains the terminal UI functions.  
-import webservices
+# ui (the terminal UI functions) and webservices (the lrg-sequence.org API,
+# which loads the HTTP client) are imported only by the routes that use
+# them, so that runs on a local file start faster.
+# lrgindex contains the single pass index of the LRG annotation.
+import lrgindex
+# compression contains the reader for compressed LRG XML files.
+import compression
+# archive contains the packed LRG XML archive reader.
+import archive
+# indexcache contains the binary cache of parsed LRG indexes.
+import indexcache
+# profiling contains the stage timers and counters reported by --profile.
+import profiling
+# xmlbackend contains the lxml and standard library XML parsers.
+import xmlbackend
 
 # XML Related Imports
 import xml.etree.ElementTree as ET
 
 
+# Elements kept by the streaming loader, listed by the tag of their parent.
+# The table is held by xmlbackend, so webservices can also parse LRG XML
+# without importing this module.
+LRG_KEPT_ELEMENTS = xmlbackend.LRG_KEPT_ELEMENTS
+
+# Report written by --profile when no path is given
+DEFAULT_PROFILE_FILE = "lrg_profile.json"
+
+
 class LRG_Object:
-	"""LRG object class containing LRG ID, HGNC ID etc"""
+	"""LRG object class containing LRG ID, HGNC ID etc. Uses __slots__ and
+	holds the exon and intron coordinates in CoordinateMaps, so that many
+	objects can be held in memory or sent between processes cheaply.
+	"""
+	__slots__ = ('lrg_id', 'hgnc_id', 'hgnc_name', 'seq_source', 'mol_type',
+				'mapped_flanked_exon_coords', 'mapped_intron_coords',
+				'chromosome', 'forward')
+
 	def __init__(self, lrg_id, hgnc_id, hgnc_name, seq_source, mol_type, 
-				mapped_flanked_exon_coords, mapped_intron_coords, chromosome):
+				mapped_flanked_exon_coords, mapped_intron_coords, chromosome,
+				forward=None):
 		self.lrg_id = lrg_id
 		self.hgnc_id = hgnc_id
 		self.hgnc_name = hgnc_name
 		self.seq_source = seq_source
 		self.mol_type = mol_type
-		self.mapped_flanked_exon_coords = mapped_flanked_exon_coords
-		self.mapped_intron_coords = mapped_intron_coords
+		self.mapped_flanked_exon_coords = functions.coords_to_map(
+												mapped_flanked_exon_coords)
+		self.mapped_intron_coords = functions.coords_to_map(
+												mapped_intron_coords)
 		self.chromosome = chromosome
+		# True if the gene is on the forward strand
+		if forward is None:
+			exon_coords = self.mapped_flanked_exon_coords
+			forward = (len(exon_coords) == 0 or
+						exon_coords.second[0] > exon_coords.first[0])
+		self.forward = forward
+
+	def __reduce__(self):
+		return (LRG_Object, (self.lrg_id, self.hgnc_id, self.hgnc_name,
+							self.seq_source, self.mol_type,
+							self.mapped_flanked_exon_coords,
+							self.mapped_intron_coords, self.chromosome,
+							self.forward))
 
 
 def main(args):
@@ -49,16 +94,170 @@ def main(args):
 		args (dict): A dictionary containing the command line arguments.
 	"""
 
+	# BED rows written to stdout with -o - must not mix with messages, so
+	# everything printed while they are streamed goes to stderr
+	if args.get('output') == "-" and bedgen.STDOUT is None:
+		bedgen.STDOUT = sys.stdout
+		try:
+			with contextlib.redirect_stdout(sys.stderr):
+				return main(args)
+		finally:
+			bedgen.STDOUT = None
+
+	# Time each stage and write a report, if asked to. The run is repeated
+	# through run_profiled() without the profiling arguments.
+	if args.get('profile') != None or args.get('cprofile') != None:
+		return profiling.run_profiled(main,
+									dict(args, profile=None, cprofile=None),
+									args.get('profile'),
+									args.get('cprofile'))
+
+	# Build the local gene name to LRG ID index and stop
+	if args.get('build_symbol_index') != None:
+		import symbolindex
+		symbolindex.build_symbol_index(args['build_symbol_index'],
+										args.get('symbol_index') or
+										symbolindex.DEFAULT_INDEX_FILE)
+		return True
+
+	# Pack a directory of LRG XML files into one archive and stop
+	if args.get('pack_archive') != None:
+		archive.pack_archive(args['pack_archive'],
+							args.get('archive') or archive.DEFAULT_ARCHIVE_FILE)
+		return True
+
+	# The flags below set module settings. They are restored when the run
+	# ends, so that a later call of main() starts from the defaults.
+	settings = (xmlbackend.BACKEND, indexcache.CACHE_DIR, bedgen.BGZIP,
+				bedgen.INCREMENTAL)
+	try:
+		return run(args)
+	finally:
+		(xmlbackend.BACKEND, indexcache.CACHE_DIR, bedgen.BGZIP,
+			bedgen.INCREMENTAL) = settings
+
+
+def run(args):
+	"""Configures the module settings from the command line arguments and
+	runs the chosen route. Called by main(), which restores the settings
+	afterwards.
+
+	Args:
+		args (dict): A dictionary containing the command line arguments.
+	"""
+
+	# Choose the XML parser, which is otherwise lxml when it is installed
+	if args.get('xml_backend') != None:
+		try:
+			xmlbackend.set_backend(args['xml_backend'])
+		except ValueError:
+			print("    XML backend not available: " + args['xml_backend'] +
+					". Available: " + ", ".join(xmlbackend.available_backends()))
+			raise SystemExit
+
+	# Configure the cache of parsed LRG indexes
+	if args.get('index_cache') != None:
+		indexcache.CACHE_DIR = args['index_cache']
+
+	# Write BED files block gzip compressed with a tabix index
+	if args.get('bgzip'):
+		bedgen.BGZIP = True
+	# Name BED files by their inputs and skip the ones already written
+	if args.get('incremental'):
+		bedgen.INCREMENTAL = True
+
+	# An output filename given with -z is also written block gzip compressed.
+	# In directory mode the output is a directory of generated filenames.
+	if (bedgen.BGZIP and args.get('output') != None and
+			args.get('directory') == None):
+		if args['output'] == "-":
+			print("    -z cannot write to stdout, as a block gzip " +
+					"compressed BED file needs its tabix index beside it")
+			raise SystemExit
+		if not args['output'].endswith(".gz"):
+			args['output'] = args['output'] + ".gz"
+
+	# Serve BED rows over HTTP, keeping parsed LRGs in memory, until stopped
+	if args.get('serve') != None:
+		configure_webservices(args)
+		import server
+		return server.serve(args.get('host') or server.DEFAULT_HOST,
+							args['serve'],
+							args.get('server_cache_size') or
+							server.DEFAULT_CACHE_SIZE,
+							args.get('archive'))
+
+	# Run JSON jobs from stdin, keeping parsed LRGs in memory, until the
+	# input ends. The exit status is 1 if any job failed.
+	if args.get('jsonl'):
+		configure_webservices(args)
+		import coprocess
+		if not coprocess.run_coprocess(
+								cache_size=args.get('server_cache_size'),
+								archive_file=args.get('archive')):
+			raise SystemExit(1)
+		return True
+
+	# Find the LRG exons and introns covering a genomic position and stop
+	if args.get('query') != None:
+		import intervals
+		if args.get('bed') != None:
+			intervals.run_bed_query(args['query'], args['bed'])
+			return True
+		genome_builds = None
+		if args['referencegenome'] != None:
+			genome_builds = [args['referencegenome']]
+		# The interval index is only saved, next to the index cache, when
+		# --index-cache is given
+		interval_cache_dir = None
+		if indexcache.CACHE_DIR != None:
+			interval_cache_dir = os.path.join(indexcache.CACHE_DIR,
+												"intervals")
+		intervals.run_query(args['query'], get_query_roots(args),
+							genome_builds, get_query_files(args),
+							interval_cache_dir)
+		return True
+
+	# A batch manifest is processed row by row without the UI
+	if args.get('batch') != None:
+		configure_webservices(args)
+		import batch
+		return batch.run_batch(args['batch'], args.get('output'),
+								args.get('concurrency'),
+								args.get('merge', False))
+
+	# Every LRG XML file in a directory is processed without the UI
+	if args.get('directory') != None:
+		import batch
+		return batch.run_directory(args['directory'],
+									args['referencegenome'],
+									args['transcript'],
+									int(args['flank'] or 0),
+									args['introns'],
+									args.get('output'),
+									args.get('workers') or 1,
+									indexcache.CACHE_DIR,
+									args.get('merge', False))
+
+	import ui
 	show_ui = ui.determine_if_show_ui(args)
 
 	# If a file is provided, check whether it is valid
 	if args['file'] != None:
-		# Obtain the root from the XML file
-		root = get_tree_and_root_file(args['file'])
+		# Obtain the root from the XML file, or its index from the index
+		# cache when one is in use
+		with profiling.timer('parse'):
+			if (indexcache.CACHE_DIR != None and
+					isinstance(args['file'], str)):
+				root = indexcache.load_lrg_index(args['file'])
+			else:
+				root = get_tree_and_root_file(args['file'])
 
 	# If no file is provided using the file flag, XML is obtained using
 	# the 'geneid' or 'lrgid' flag or asking the user with the UI.
 	else:
+		webservices = configure_webservices(args)
+
 		# Obtain a Gene ID when no LRG or Gene ID given
 		if args['geneid'] == None and args['lrgid'] == None:
 			ui.splashscreen()
@@ -67,20 +266,41 @@ def main(args):
 
 		# Obtain an LRG ID using Gene ID, only if no LRG ID has been provided
 		if 	args['geneid'] != None and args['lrgid'] == None:
-			searchresults = webservices.search_by_hgnc(args['geneid'])
+			with profiling.timer('gene_search'):
+				searchresults = webservices.search_by_hgnc(args['geneid'])
 			args['lrgid'] =  searchresults 
 
-		# At this point, the program has an LRG ID and can use this to obtain
-		# an XML from the LRG-sequence.org site
-		lrg_xml = webservices.search_by_lrg(args['lrgid'])
-		# Obtain the root from the XML string provided by the webservices
-		root = get_tree_and_root_string(lrg_xml)
+		# At this point, the program has an LRG ID. The XML is read from the
+		# local archive if one is given and holds the LRG, otherwise it is
+		# obtained from the LRG-sequence.org site
+		lrg_archive = None
+		if args.get('archive') != None:
+			lrg_archive = archive.open_archive(args['archive'])
+		if lrg_archive != None and args['lrgid'] in lrg_archive:
+			with profiling.timer('parse'):
+				root = get_tree_and_root_stream(
+										lrg_archive.open(args['lrgid']))
+		else:
+			with profiling.timer('download'):
+				lrg_xml = webservices.search_by_lrg(args['lrgid'])
+			# Obtain the root from the XML string provided by the webservices
+			with profiling.timer('parse'):
+				root = get_tree_and_root_stream(io.BytesIO(lrg_xml))
 
 	# At this point in the program, regardless of whether a file, LRG ID 
 	# or Gene ID has been provided, the program now has an XML root, from
 	# which it can obtain genome build, transcript, exon location and
 	# mapping information.
 
+	# Every genome build and transcript combination is written in one pass
+	# over the LRG index, without asking for a choice
+	if args.get('all'):
+		return write_all_combinations(root,
+									int(args['flank'] or 0),
+									args['introns'],
+									args.get('output'),
+									args.get('merge', False))
+
 	# Pick which Genome Build to use if none has been provided with a flag
 	genomebuilds = get_genome_builds(root)
 	if (args['referencegenome'] == None 
@@ -115,43 +335,242 @@ def main(args):
 	# Create an LRG_Object, which contains LRG ID, HGNC ID, mapped exon 
 	# coordinates etc. This information is extracted from the XML root by
 	# lrg_object_creator()
-	lrg_object = lrg_object_creator(root, 
-									args['referencegenome'],
-									args['transcript'],
-									args['flank'])
-
-	# BED file filename creation
-	current_datetime = datetime.datetime.utcnow()
-	current_datetime_formatted = current_datetime.strftime("%Y%m%d-%H%M%S")
-	bed_filename = "_".join([lrg_object.hgnc_name,
-							lrg_object.lrg_id,
-							args['transcript'],
-							args['referencegenome'],
-							"flank"+str(args['flank']),
-							current_datetime_formatted,
-							]) + ".tsv"
+	with profiling.timer('lrg_object_creator'):
+		lrg_object = lrg_object_creator(root, 
+										args['referencegenome'],
+										args['transcript'],
+										args['flank'])
+
+	# BED file filename creation. A filename given with the output flag is
+	# used as it is. In incremental mode the filename and header carry the
+	# LRG version instead of the time, and an existing file is kept.
+	if bedgen.INCREMENTAL:
+		current_datetime_formatted = get_lrg_version(root)
+	else:
+		current_datetime = datetime.datetime.utcnow()
+		current_datetime_formatted = current_datetime.strftime("%Y%m%d-%H%M%S")
+	if args.get('output') != None:
+		bed_filename = args['output']
+	elif bedgen.INCREMENTAL:
+		bed_filename = bedgen.create_incremental_filename(
+												lrg_object,
+												args['transcript'],
+												args['referencegenome'],
+												args['flank'],
+												args['introns'],
+												args.get('merge', False),
+												current_datetime_formatted)
+		if bedgen.is_up_to_date(bed_filename):
+			print("")
+			print("    BED file is up to date: " + bed_filename)
+			print("")
+			return True
+	else:
+		bed_filename = bedgen.create_bed_filename(lrg_object,
+												args['transcript'],
+												args['referencegenome'],
+												args['flank'],
+												current_datetime_formatted)
 
 	# BED file header creation
-	bedheader_name = "LRG_Parser_Custom_Track"
-	bedheader_desc = "_".join([lrg_object.hgnc_name,
-								lrg_object.lrg_id,
-								args['transcript'],
-								args['referencegenome'],
-								current_datetime_formatted
-								])
-	bedheader = ["track name=" + bedheader_name,
-				"description=" + bedheader_desc]
-
-	# Create the contents of the BED file.
-	bedcontents = bedgen.create_bed_contents(lrg_object, args['introns'])
-
-	# Write the BED contents to disk
-	bed_file = bedgen.write_bed_file(bed_filename, bedheader, bedcontents)
+	bedheader = bedgen.create_bed_header(lrg_object,
+										args['transcript'],
+										args['referencegenome'],
+										current_datetime_formatted)
+
+	# Create the contents of the BED file. Rows are generated as they are
+	# written rather than held in a list.
+	bedcontents = bedgen.iter_bed_rows(lrg_object, args['introns'])
+	# Sort the rows and merge the ones that overlap, if asked to
+	if args.get('merge'):
+		bedcontents = bedgen.merge_bed_contents(bedcontents)
+
+	# Write the BED contents to disk. The rows are generated as they are
+	# written, so this stage includes their creation.
+	with profiling.timer('bed_write'):
+		bed_file = bedgen.write_bed_file(bed_filename, bedheader, bedcontents)
 
 	return bed_file
 
+def configure_webservices(args):
+	"""Imports the webservices module and configures the cache of
+	downloaded LRG XML files, offline mode and the symbol index from the
+	command line arguments. Only the routes that may use the network call
+	this, so other runs do not pay for importing the HTTP client.
+
+	Args:
+		args (dict): A dictionary containing the command line arguments.
+	Returns:
+		webservices (module): The configured webservices module
+	"""
+
+	import webservices
+	if args.get('cache_dir') != None:
+		import lrgcache
+		webservices.set_cache(lrgcache.LRGCache(args['cache_dir']))
+	webservices.OFFLINE = bool(args.get('offline'))
+	if args.get('symbol_index') != None:
+		webservices.SYMBOL_INDEX_FILE = args['symbol_index']
+	return webservices
+
+
+def get_query_files(args):
+	"""Returns the files read by a region query: the LRG XML files in the
+	directory, the archive or the file given on the command line.
+
+	Args:
+		args (dict): A dictionary containing the command line arguments.
+	Returns:
+		source_files (list): Paths of the files, or None if none were given
+	"""
+
+	if args.get('directory') != None:
+		import batch
+		return batch.find_xml_files(args['directory'])
+	elif args.get('archive') != None:
+		return [args['archive']]
+	elif isinstance(args['file'], str):
+		return [args['file']]
+	return None
+
+
+def get_query_roots(args):
+	"""Yields the LRG index of each LRG searched by a region query. The
+	LRGs are read from the directory, archive or file given on the command
+	line, one at a time. An LRG that cannot be read is skipped with a
+	warning.
+
+	Args:
+		args (dict): A dictionary containing the command line arguments.
+	Returns:
+		lrg_indexes (generator): LRGIndex of each LRG
+	Raises:
+		SystemExit: If no directory, archive or file was given
+	"""
+
+	if args.get('directory') != None:
+		for xml_file in get_query_files(args):
+			try:
+				yield indexcache.load_lrg_index(xml_file)
+			except SystemExit:
+				print("    Skipping LRG XML file that could not be read: " +
+						xml_file)
+	elif args.get('archive') != None:
+		lrg_archive = archive.open_archive(args['archive'])
+		for lrg_id in sorted(lrg_archive.offsets):
+			try:
+				yield get_lrg_index(
+						get_tree_and_root_stream(lrg_archive.open(lrg_id)))
+			except Exception:
+				print("    Skipping LRG that could not be read from the " +
+						"archive: " + lrg_id)
+	elif args['file'] != None:
+		yield indexcache.load_lrg_index(args['file'])
+	else:
+		print("    A region query needs LRG XML files to search, given " +
+				"with -d, --archive or -f")
+		raise SystemExit
+
+def write_all_combinations(root, flank, introns, output=None, merge=False):
+	"""Writes a BED file for every genome build and transcript in the LRG.
+	The XML root is indexed once and every combination is calculated from
+	the index. When an output filename is given, all combinations are
+	written to that one file, with each row labelled by its genome build
+	and transcript. When merging, the combined rows of each genome build are
+	merged separately, as coordinates of different builds cannot overlap.
+
+	Args:
+		root (xml.etree.ElementTree): ElementTree object representing the
+										root of the XML file
+		flank (int): The flank size to use
+		introns (bool): Include introns True or False
+		output (str): Combined BED filename, or None for one file each
+		merge (bool): Sort and merge overlapping rows True or False
+	Returns:
+		True if the BED files were written successfully
+	"""
+
+	lrg_index = get_lrg_index(root)
+	if bedgen.INCREMENTAL:
+		current_datetime_formatted = get_lrg_version(lrg_index)
+	else:
+		current_datetime = datetime.datetime.utcnow()
+		current_datetime_formatted = current_datetime.strftime("%Y%m%d-%H%M%S")
+	combined_contents = []
+	for genome_choice in get_genome_builds(lrg_index):
+		build_contents = []
+		for transcript_choice in get_transcript_ids(lrg_index):
+			lrg_object = lrg_object_creator(lrg_index,
+											genome_choice,
+											transcript_choice,
+											flank)
+			bedcontents = bedgen.create_bed_contents(lrg_object, introns)
+			if output != None:
+				build_contents.extend(bedgen.prefix_bed_labels(
+									bedcontents,
+									genome_choice + "_" + transcript_choice))
+				continue
+			if bedgen.INCREMENTAL:
+				bed_filename = bedgen.create_incremental_filename(
+													lrg_object,
+													transcript_choice,
+													genome_choice,
+													flank,
+													introns,
+													merge,
+													current_datetime_formatted)
+				if bedgen.is_up_to_date(bed_filename):
+					continue
+			else:
+				bed_filename = bedgen.create_bed_filename(lrg_object,
+													transcript_choice,
+													genome_choice,
+													flank,
+													current_datetime_formatted)
+			if merge:
+				bedcontents = bedgen.merge_bed_contents(bedcontents)
+			bedheader = bedgen.create_bed_header(lrg_object,
+												transcript_choice,
+												genome_choice,
+												current_datetime_formatted)
+			bedgen.write_bed_file(bed_filename, bedheader, bedcontents)
+		if merge:
+			build_contents = bedgen.merge_bed_contents(build_contents)
+		combined_contents.extend(build_contents)
+
+	if output != None:
+		bedheader = ["track name=LRG_Parser_Custom_Track",
+					"description=" + "_".join([lrg_index.hgnc_name,
+												lrg_index.lrg_id,
+												"all",
+												current_datetime_formatted])]
+		return bedgen.write_bed_file(output, bedheader, combined_contents)
+	return True
+
+
+def get_lrg_version(root):
+	"""Returns a version tag of an LRG for incremental BED filenames. It is
+	the most recent modification date of the LRG annotation followed by a
+	short hash of everything in the LRG index, so it changes whenever the
+	annotation used for BED generation changes, e.g 20181121-1f0c5e2ab4d3.
+
+	Args:
+		root (xml.etree.ElementTree or LRGIndex): XML root or LRG index
+	Returns:
+		version (str): The version tag
+	"""
+
+	lrg_index = get_lrg_index(root)
+	digest = hashlib.blake2b(lrg_index.to_bytes(), digest_size=6).hexdigest()
+	if lrg_index.modification_date == None:
+		return digest
+	return lrg_index.modification_date.replace("-", "") + "-" + digest
+
+
 def get_tree_and_root_file(xml_file):
-	"""Returns the XML tree and root when provided with an XML file
+	"""Returns the XML tree and root when provided with an XML file. The
+	file is read with the streaming loader, so only the parts of the LRG
+	needed for BED generation are held in memory.
 
 	Args:
 		xml_file (str): XML file path
@@ -161,8 +580,7 @@ def get_tree_and_root_file(xml_file):
 	"""
 
 	try:
-		tree = ET.parse(xml_file)
-		root = tree.getroot()
+		root = get_tree_and_root_stream(xml_file)
 	except:
 		print("Error: XML root could not be extracted from the file.")
 		print("Are you sure that it is a valid LRG XML file?")
@@ -171,6 +589,34 @@ def get_tree_and_root_file(xml_file):
 	return root
 
 
+def get_tree_and_root_stream(xml_source):
+	"""Returns a pruned XML root when provided with an LRG XML file path or
+	file object. Every element that is not needed to create an LRG_Object
+	is discarded while the XML is parsed. This drops the genomic, cDNA and
+	protein <sequence> blocks, which make up most of an LRG XML file. Gzip,
+	bz2 and xz compressed files are decompressed as they are parsed. The
+	parser is lxml when it is installed and the standard library otherwise
+	(see xmlbackend), and both give the same root.
+
+	The pruned root keeps:
+		fixed_annotation: id, hgnc_id, sequence_source, mol_type
+		updatable_annotation/annotation_set: mapping, mapping_span,
+			lrg_locus and modification_date
+
+	Args:
+		xml_source (str or file): XML file path or file object
+	Returns:
+		root (xml.etree.ElementTree): ElementTree object representing the
+										pruned root of the XML file
+	"""
+
+	if isinstance(xml_source, str):
+		with compression.open_xml_file(xml_source) as xml_stream:
+			return get_tree_and_root_stream(xml_stream)
+
+	return xmlbackend.parse_pruned(xml_source, LRG_KEPT_ELEMENTS)
+
+
 def get_tree_and_root_string(xml_string):
 	"""Returns the XML tree and root when provided with an XML string
 
@@ -185,6 +631,21 @@ def get_tree_and_root_string(xml_string):
 	return root
 
 
+def get_lrg_index(root):
+	"""Returns the LRGIndex of the XML root. The index is built in a single
+	traversal and reused by the functions that read genome builds,
+	transcripts and mappings from the root.
+
+	Args:
+		root (xml.etree.ElementTree): ElementTree object representing the
+										root of the XML file
+	Returns:
+		lrg_index (LRGIndex): Index of the LRG annotation
+	"""
+
+	return lrgindex.get_lrg_index(root)
+
+
 def get_genome_builds(root):
 	"""Returns the different possible genome builds extracted from the LRG 
 	xml file.
@@ -197,16 +658,7 @@ def get_genome_builds(root):
 								the given XML root.
 	"""
 
-	genomebuilds = []
-	for transcript_type in root.iter('annotation_set'):
-		source = transcript_type.attrib["type"]
-		if source == "lrg":
-			# Loop through transcript tags to collect the different genome
-			# builds available
-			for transcript in transcript_type:
-				if transcript.tag == "mapping":
-					genomebuild = transcript.attrib["coord_system"]
-					genomebuilds.append(genomebuild)
+	genomebuilds = list(get_lrg_index(root).genome_builds)
 	return genomebuilds
 
 
@@ -222,16 +674,7 @@ def get_transcript_ids(root):
 								the given XML root.
 	"""
 
-	transcripts = []
-	for transcript_type in root.iter('annotation_set'):
-		source = transcript_type.attrib["type"]
-		if source == "ncbi" or source == "ensembl":
-			# Loop through transcript tags to collect the different 
-			# transcripts available
-			for transcript in transcript_type:
-				if transcript.tag == "mapping":
-					transcript_id = transcript.attrib["coord_system"]
-					transcripts.append(transcript_id)
+	transcripts = list(get_lrg_index(root).transcripts)
 	return transcripts
 
 
@@ -249,41 +692,41 @@ def lrg_object_creator(root, genome_choice, transcript_choice, flank):
 		lrgobject (): LRG_Object class object
 	"""
 
-	lrg_id = root.find('fixed_annotation/id').text
-	hgnc_id = root.find('fixed_annotation/hgnc_id').text
-	seq_source = root.find('fixed_annotation/sequence_source').text
-	mol_type = root.find('fixed_annotation/mol_type').text
-
-	# Get the chromosome number
-	for transcript_type in root.iter('annotation_set'):
-		source = transcript_type.attrib["type"]
-		if source == "lrg":
-			for transcript in transcript_type:
-				if transcript.tag == "mapping":
-					chromosome = transcript.attrib["other_name"]
-				if transcript.tag == "lrg_locus":
-					hgnc_name = transcript.text
-
-	# LRG exon coordinates mapped to the given genome build and transcript
-	mapped_exon_coords = functions.get_exon_coords(root, genome_choice,
+	lrg_index = get_lrg_index(root)
+
+	# Get the chromosome number of the chosen genome build
+	genome_build = lrg_index.genome_builds.get(genome_choice)
+	chromosome = genome_build[0] if genome_build != None else None
+
+	# LRG exon coordinates mapped to the given genome build and transcript,
+	# held as arrays of the first and second coordinate of each exon
+	with profiling.timer('exon_coords'):
+		exon_arrays = functions.get_exon_arrays(lrg_index, genome_choice,
 												transcript_choice)
-	
+	# A genome build or transcript that is not in the LRG gives an object
+	# without exons, as get_exon_coords() gives an empty dictionary
+	if exon_arrays is None:
+		exon_arrays = ([], [], None)
+	exon_first, exon_second, forward = exon_arrays
+
 	# Intron coordinates obtained using the gaps between the mapped exons
-	mapped_intron_coords = functions.get_intron_coords(mapped_exon_coords)
+	mapped_intron_coords = functions.CoordinateMap(
+				*functions.map_introns(exon_first, exon_second, forward))
 
 	# Mapped exon coordinated with flanking regions added
-	mapped_flanked_exon_coords = functions.get_flanked_coords(
-												mapped_exon_coords, flank)
+	mapped_flanked_exon_coords = functions.CoordinateMap(
+				*functions.map_flanks(exon_first, exon_second, flank, forward))
 
 	# Create an LRG Object using the LRG_Object class
-	lrg_object = LRG_Object(lrg_id, 
-							hgnc_id, 
-							hgnc_name,
-							seq_source, 
-							mol_type, 
+	lrg_object = LRG_Object(lrg_index.lrg_id, 
+							lrg_index.hgnc_id, 
+							lrg_index.hgnc_name,
+							lrg_index.seq_source, 
+							lrg_index.mol_type, 
 							mapped_flanked_exon_coords, 
 							mapped_intron_coords, 
-							chromosome) 
+							chromosome,
+							forward) 
 	return lrg_object
 
 def arg_collection(arguments):
@@ -296,6 +739,10 @@ def arg_collection(arguments):
 		arguments (dict): Dictionary of processed arguments
 	"""
 
+	# argparse is only needed on the command line, not when the module is
+	# imported by the batch workers or the server
+	import argparse
+
 	parser = argparse.ArgumentParser(description = "LRG Parser: " + 
 													"A program to extract " +
 													"exon locations from " +
@@ -342,6 +789,197 @@ def arg_collection(arguments):
 						type=int,
 						help="If present, exon coords include flanking regions e.g -fl 150")
 
+	parser.add_argument('-a', '--all',
+						action='store_true',
+						dest='all',
+						help="If present, a BED file is written for every " +
+								"genome build and transcript in the LRG e.g -a")
+
+	# Batch Arguments:
+	# A manifest of many genes, LRG IDs or files processed in one run
+	parser.add_argument('-b', '--batch',
+						help="Path to a TSV manifest with one row per BED: " +
+								"gene/LRG ID/file, genome build, transcript, " +
+								"flank, introns e.g -b panel.tsv",
+						type=str,
+						dest='batch')
+	parser.add_argument('--concurrency',
+						help="Number of genes downloaded at the same time " +
+								"in batch mode (default 8) " +
+								"e.g --concurrency 16",
+						type=int,
+						dest='concurrency')
+	parser.add_argument('-d', '--directory',
+						help="Path to a directory of LRG XML files. A BED " +
+								"file is written for every file, build and " +
+								"transcript unless -r or -t are given " +
+								"e.g -d lrg_mirror/",
+						type=str,
+						dest='directory')
+	parser.add_argument('-w', '--workers',
+						help="Number of worker processes used in directory " +
+								"mode e.g -w 8",
+						type=int,
+						default=1,
+						dest='workers')
+	parser.add_argument('-o', '--output',
+						help="Output BED filename. In batch mode, all rows " +
+								"are written to this one combined BED file. " +
+								"In directory mode, the directory BED files " +
+								"are written to. Use - to write the BED " +
+								"rows to stdout e.g -o panel.bed",
+						type=str,
+						dest='output')
+
+	# Cache Arguments:
+	# Downloaded LRG XML files are cached on disk
+	parser.add_argument('--offline',
+						action='store_true',
+						help="If present, LRG XML files are only taken from " +
+								"the local cache e.g --offline")
+	parser.add_argument('--cache-dir',
+						help="Directory of the LRG XML cache " +
+								"e.g --cache-dir ~/.lrg_parser/cache",
+						type=str,
+						dest='cache_dir')
+
+	parser.add_argument('--index-cache',
+						help="Caches the annotation parsed from LRG XML " +
+								"files, keyed by file contents, so repeat " +
+								"runs skip XML parsing. Takes an optional " +
+								"directory e.g --index-cache",
+						nargs='?',
+						const=indexcache.DEFAULT_INDEX_CACHE_DIR,
+						type=str,
+						dest='index_cache')
+
+	parser.add_argument('-m', '--merge',
+						help="If this flag is present, BED rows are sorted " +
+								"and overlapping or adjacent rows are merged " +
+								"into one, e.g Exon_3-4",
+						action='store_true',
+						dest='merge')
+
+	parser.add_argument('-z', '--bgzip',
+						help="If this flag is present, BED files are " +
+								"written block gzip compressed and sorted, " +
+								"with a tabix index, and .gz is added to an " +
+								"output filename without it. An output " +
+								"filename ending in .gz does the same",
+						action='store_true',
+						dest='bgzip')
+
+	parser.add_argument('--incremental',
+						help="If this flag is present, BED filenames are " +
+								"made from the inputs and the LRG version " +
+								"instead of the time, and BED files that " +
+								"already exist are not written again",
+						action='store_true',
+						dest='incremental')
+
+	parser.add_argument('--xml-backend',
+						help="XML parser to use. lxml is used by default " +
+								"when it is installed, and the standard " +
+								"library parser otherwise " +
+								"e.g --xml-backend etree",
+						choices=xmlbackend.BACKEND_NAMES,
+						type=str,
+						dest='xml_backend')
+
+	# Query Arguments:
+	parser.add_argument('-q', '--query',
+						help="Prints the LRG exons and introns covering a " +
+								"genomic position or range, searching the " +
+								"LRGs given with -d, --archive or -f. " +
+								"Limited to one genome build with -r " +
+								"e.g -q chr14:23900000",
+						type=str,
+						dest='query')
+
+	parser.add_argument('--bed',
+						help="Takes a block gzip compressed BED file with " +
+								"a tabix index, which -q searches instead " +
+								"of LRGs e.g --bed panel.tsv.gz",
+						type=str,
+						dest='bed')
+
+	# Archive Arguments:
+	parser.add_argument('--pack-archive',
+						help="Packs a directory of LRG XML files into one " +
+								"archive file and exits " +
+								"e.g --pack-archive ./lrg_xml",
+						type=str,
+						dest='pack_archive')
+
+	parser.add_argument('--archive',
+						help="Reads LRG XML files for -l and -g from a " +
+								"packed archive. Takes an optional path " +
+								"e.g --archive lrg_corpus.lrga",
+						nargs='?',
+						const=archive.DEFAULT_ARCHIVE_FILE,
+						type=str,
+						dest='archive')
+
+	# Symbol Index Arguments:
+	# A local index of gene names to LRG IDs avoids the search REST API
+	parser.add_argument('--build-symbol-index',
+						help="Builds the local gene name to LRG ID index " +
+								"from a directory of LRG XML files " +
+								"e.g --build-symbol-index lrg_mirror/",
+						type=str,
+						dest='build_symbol_index')
+	parser.add_argument('--symbol-index',
+						help="Path of the local gene name to LRG ID index " +
+								"e.g --symbol-index symbols.json.gz",
+						type=str,
+						dest='symbol_index')
+
+	# Server Arguments:
+	# The BED pipeline is served over HTTP with parsed LRGs kept in memory
+	parser.add_argument('--serve',
+						help="Serves BED rows as JSON over HTTP, keeping " +
+								"parsed LRGs in memory between requests. " +
+								"Takes an optional port (default 8400) " +
+								"e.g --serve 8400",
+						nargs='?',
+						const=8400,
+						type=int,
+						dest='serve')
+	parser.add_argument('--host',
+						help="Address the server listens on " +
+								"(default 127.0.0.1) e.g --host 0.0.0.0",
+						type=str,
+						dest='host')
+	parser.add_argument('--jsonl',
+						help="Reads BED jobs as JSON lines on stdin and " +
+								"writes one JSON result per line to stdout, " +
+								"keeping parsed LRGs in memory between jobs",
+						action='store_true',
+						dest='jsonl')
+	parser.add_argument('--server-cache-size',
+						help="Number of parsed LRGs kept in memory by " +
+								"--serve and --jsonl (default 256)",
+						type=int,
+						dest='server_cache_size')
+
+	# Profiling Arguments:
+	# Each stage of the run is timed and reported
+	parser.add_argument('--profile',
+						help="Writes the time of each stage and counts " +
+								"such as bytes downloaded and exons written " +
+								"to a JSON report, or to stderr with - . " +
+								"Takes an optional path " +
+								"e.g --profile profile.json",
+						nargs='?',
+						const=DEFAULT_PROFILE_FILE,
+						type=str,
+						dest='profile')
+	parser.add_argument('--cprofile',
+						help="Writes a cProfile dump of the run, read with " +
+								"the pstats module e.g --cprofile run.prof",
+						type=str,
+						dest='cprofile')
+
 	args = parser.parse_args(arguments)
 	arguments = {
 				'file': args.file,
@@ -351,6 +989,31 @@ def arg_collection(arguments):
 				'transcript': args.transcript,
 				'flank': args.flank,
 				'introns': args.introns,
+				'all': args.all,
+				'batch': args.batch,
+				'concurrency': args.concurrency,
+				'directory': args.directory,
+				'workers': args.workers,
+				'output': args.output,
+				'offline': args.offline,
+				'cache_dir': args.cache_dir,
+				'index_cache': args.index_cache,
+				'merge': args.merge,
+				'bgzip': args.bgzip,
+				'incremental': args.incremental,
+				'xml_backend': args.xml_backend,
+				'query': args.query,
+				'bed': args.bed,
+				'pack_archive': args.pack_archive,
+				'archive': args.archive,
+				'build_symbol_index': args.build_symbol_index,
+				'symbol_index': args.symbol_index,
+				'serve': args.serve,
+				'host': args.host,
+				'jsonl': args.jsonl,
+				'server_cache_size': args.server_cache_size,
+				'profile': args.profile,
+				'cprofile': args.cprofile,
 				}
 	
 	return arguments
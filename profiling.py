@@ -0,0 +1,212 @@
+"""
+This module contains the instrumentation written out by --profile: named
+timers and counters placed around the stages of lrgparser.main, such as the
+download, XML parsing, exon coordinate mapping and the BED write. While
+profiling is disabled, timer() returns a shared context manager that does
+nothing and count() returns at once, so the hooks can stay in place.
+"""
+
+
+import contextlib
+import json
+import sys
+import time
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+
+# When True, timers and counters are recorded
+ENABLED = False
+
+# Stage name -> [total seconds, number of calls]
+_timers = {}
+# Counter name -> total
+_counters = {}
+# perf_counter() value when profiling was enabled
+_started = None
+
+# Returned by timer() while profiling is disabled
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class _Timer:
+	"""Adds the time spent inside a with block to a named timer"""
+	__slots__ = ('name', 'start')
+
+	def __init__(self, name):
+		self.name = name
+		self.start = None
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		elapsed = time.perf_counter() - self.start
+		totals = _timers.get(self.name)
+		if totals is None:
+			_timers[self.name] = [elapsed, 1]
+		else:
+			totals[0] += elapsed
+			totals[1] += 1
+
+
+def timer(name):
+	"""Returns a context manager timing a stage, e.g
+	with profiling.timer('parse'): ...
+	Stages may be nested, in which case both are timed.
+
+	Args:
+		name (str): Name of the stage
+	Returns:
+		timer: Context manager adding its time to the stage
+	"""
+
+	if not ENABLED:
+		return _NULL_TIMER
+	return _Timer(name)
+
+
+def count(name, amount=1):
+	"""Adds to a named counter, such as bytes downloaded or exons emitted
+
+	Args:
+		name (str): Name of the counter
+		amount (int): Amount added to the counter
+	"""
+
+	if ENABLED:
+		_counters[name] = _counters.get(name, 0) + amount
+
+
+def enable():
+	"""Clears any recorded timers and counters and starts recording"""
+	global ENABLED, _started
+	_timers.clear()
+	_counters.clear()
+	_started = time.perf_counter()
+	ENABLED = True
+
+
+def disable():
+	"""Stops recording. The recorded timers and counters are kept"""
+	global ENABLED
+	ENABLED = False
+
+
+@contextlib.contextmanager
+def collect():
+	"""Records the timers and counters of a with block apart from the rest,
+	e.g in a worker process, so they can be returned to the parent and
+	added to its report with merge().
+
+	Yields:
+		snapshot (dict): Filled in when the block ends with stages (name ->
+							[seconds, calls]) and counters
+	"""
+
+	global _timers, _counters
+	saved = (_timers, _counters)
+	_timers, _counters = {}, {}
+	snapshot = {}
+	try:
+		yield snapshot
+	finally:
+		snapshot['stages'] = _timers
+		snapshot['counters'] = _counters
+		_timers, _counters = saved
+
+
+def merge(snapshot):
+	"""Adds the timers and counters of a snapshot from collect()"""
+	for name, (seconds, calls) in snapshot['stages'].items():
+		totals = _timers.setdefault(name, [0.0, 0])
+		totals[0] += seconds
+		totals[1] += calls
+	for name, amount in snapshot['counters'].items():
+		_counters[name] = _counters.get(name, 0) + amount
+
+
+def peak_memory():
+	"""Returns the peak resident memory of the process in bytes, or None
+	where it is not available
+	"""
+	if resource is None:
+		return None
+	maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes, macOS bytes
+	if sys.platform == 'darwin':
+		return maxrss
+	return maxrss * 1024
+
+
+def report():
+	"""Returns the recorded timers and counters.
+
+	Returns:
+		report (dict): total_seconds, stages (name -> seconds and calls),
+						counters and peak_memory_bytes
+	"""
+
+	total = None
+	if _started != None:
+		total = time.perf_counter() - _started
+	return {'total_seconds': total,
+			'stages': {name: {'seconds': seconds, 'calls': calls}
+						for name, (seconds, calls) in _timers.items()},
+			'counters': dict(_counters),
+			'peak_memory_bytes': peak_memory()}
+
+
+def write_report(report_file):
+	"""Writes the report as JSON. A filename of '-' writes to stderr, so the
+	report does not mix with BED rows written to stdout.
+
+	Args:
+		report_file (str): The filename to write to, or '-' for stderr
+	"""
+
+	if report_file == "-":
+		json.dump(report(), sys.stderr, indent=2)
+		print("", file=sys.stderr)
+		return
+	with open(report_file, 'w') as f:
+		json.dump(report(), f, indent=2)
+
+
+def run_profiled(function, args, report_file=None, cprofile_file=None):
+	"""Runs a function with the timers and counters recorded, then writes
+	the report. The report is also written if the function exits early.
+
+	Args:
+		function (function): The function to run, e.g lrgparser.main
+		args: The argument passed to the function
+		report_file (str): Path of the JSON report, '-' for stderr, or None
+		cprofile_file (str): Path of a cProfile dump, read with the pstats
+								module, or None for no dump
+	Returns:
+		The return value of the function
+	"""
+
+	profiler = None
+	if cprofile_file != None:
+		import cProfile
+		profiler = cProfile.Profile()
+	enable()
+	try:
+		if profiler != None:
+			profiler.enable()
+		try:
+			return function(args)
+		finally:
+			if profiler != None:
+				profiler.disable()
+	finally:
+		disable()
+		if profiler != None:
+			profiler.dump_stats(cprofile_file)
+		if report_file != None:
+			write_report(report_file)
@@ -0,0 +1,395 @@
+"""
+This module contains the local HTTP service started with --serve. It runs
+the same pipeline as lrgparser.main (LRG or gene, genome build, transcript,
+flank and introns to BED rows) and returns the rows as JSON. The index of
+each LRG is kept in a bounded, least recently used cache, so repeat requests
+for an LRG skip the download and XML parsing. Each request is handled on its
+own thread.
+
+Requests:
+	GET /bed?lrg=LRG_384&build=GRCh37.p13&transcript=NM_000257.2&flank=50
+	GET /bed?gene=MYH7&build=GRCh37.p13&transcript=NM_000257.2&introns=1
+	POST /bed with the same fields as a JSON object
+	GET /health
+"""
+
+
+import collections
+import datetime
+import http.server
+import io
+import json
+import os
+import threading
+import urllib.parse
+
+import archive
+import bedgen
+import indexcache
+import lrgcache
+import lrgparser
+import webservices
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8400
+# Number of parsed LRGs kept in memory
+DEFAULT_CACHE_SIZE = 256
+# Largest JSON request body accepted, in bytes
+MAX_REQUEST_SIZE = 64 * 1024
+
+
+class RequestError(Exception):
+	"""An invalid request, answered with its HTTP status and message"""
+	def __init__(self, status, message):
+		super().__init__(message)
+		self.status = status
+		self.message = message
+
+
+class LRGIndexCache:
+	"""Bounded cache of LRG indexes keyed by LRG ID, or by path for LRG
+	XML files, which discards the least recently used LRG when full. Loads
+	of different LRGs run at the same time, while concurrent requests for
+	the same LRG wait for a single load. The LRG IDs found for gene names
+	are kept alongside, in a cache of the same size, so a repeated gene
+	request skips the search.
+
+	Attributes:
+		maxsize (int): Most LRG indexes held
+		archive_file (str): Packed archive read before downloading, or None
+	"""
+	def __init__(self, maxsize=DEFAULT_CACHE_SIZE, archive_file=None):
+		self.maxsize = maxsize
+		self.archive_file = archive_file
+		self._indexes = collections.OrderedDict()
+		self._loading = {}
+		self._gene_lrg_ids = collections.OrderedDict()
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self):
+		return len(self._indexes)
+
+	def get(self, lrg_id):
+		"""Returns the LRG index of an LRG, loading it on first use.
+
+		Args:
+			lrg_id (str): LRG ID in the format 'LRG_123', in any case
+		Returns:
+			lrg_index (LRGIndex): Index of the LRG annotation
+		Raises:
+			RequestError: If the LRG ID is invalid, or the LRG could not be
+							found or read
+		"""
+
+		# Normalised, so that e.g lrg_384 and LRG_384 share one entry
+		normalised_lrg_id = lrgcache.normalise_lrg_id(lrg_id)
+		if normalised_lrg_id is None:
+			raise RequestError(400, "Not an LRG ID: " + str(lrg_id))
+		return self._get(normalised_lrg_id, self._load, normalised_lrg_id)
+
+	def search_gene(self, gene):
+		"""Returns the LRG ID of a gene name or HGNC ID, searching for it
+		on first use. Genes without an LRG are searched for again.
+
+		Args:
+			gene (str): Gene name or HGNC ID, in any case
+		Returns:
+			lrg_id (str): LRG ID e.g LRG_384
+		Raises:
+			SystemExit: If no LRG is available for the gene
+		"""
+
+		key = gene.strip().upper()
+		with self._lock:
+			lrg_id = self._gene_lrg_ids.get(key)
+			if lrg_id is not None:
+				self._gene_lrg_ids.move_to_end(key)
+				return lrg_id
+		lrg_id = webservices.search_by_hgnc(gene)
+		with self._lock:
+			self._gene_lrg_ids[key] = lrg_id
+			while len(self._gene_lrg_ids) > self.maxsize:
+				self._gene_lrg_ids.popitem(last=False)
+		return lrg_id
+
+	def get_file(self, xml_file):
+		"""Returns the LRG index of an LRG XML file, loading it on first
+		use. A file that has changed since it was loaded is loaded again.
+
+		Args:
+			xml_file (str): Path to an LRG XML file, which may be compressed
+		Returns:
+			lrg_index (LRGIndex): Index of the LRG annotation
+		Raises:
+			RequestError: If the file could not be found or read
+		"""
+
+		try:
+			xml_file = os.path.abspath(xml_file)
+			stat = os.stat(xml_file)
+		except (OSError, TypeError, ValueError):
+			raise RequestError(404, "Could not find the file: " +
+								str(xml_file))
+		return self._get((xml_file, stat.st_mtime_ns, stat.st_size),
+						self._load_file, xml_file)
+
+	def _get(self, key, load, argument):
+		"""Returns the cached index under a key, or calls load(argument)"""
+		with self._lock:
+			lrg_index = self._indexes.get(key)
+			if lrg_index is not None:
+				self._indexes.move_to_end(key)
+				self.hits += 1
+				return lrg_index
+			self.misses += 1
+			load_lock = self._loading.get(key)
+			if load_lock is None:
+				load_lock = self._loading[key] = threading.Lock()
+
+		with load_lock:
+			# Another request may have loaded the LRG while this one waited
+			with self._lock:
+				lrg_index = self._indexes.get(key)
+			if lrg_index is None:
+				try:
+					lrg_index = load(argument)
+				except BaseException:
+					with self._lock:
+						self._loading.pop(key, None)
+					raise
+				# Stored and its load lock removed together, so a request
+				# arriving in between cannot find neither and load it again
+				with self._lock:
+					self._indexes[key] = lrg_index
+					while len(self._indexes) > self.maxsize:
+						self._indexes.popitem(last=False)
+					self._loading.pop(key, None)
+		return lrg_index
+
+	def _load(self, lrg_id):
+		"""Reads an LRG from the archive or the LRG site and indexes it"""
+		try:
+			lrg_archive = None
+			if self.archive_file != None:
+				lrg_archive = archive.open_archive(self.archive_file)
+			if lrg_archive != None and lrg_id in lrg_archive:
+				root = lrgparser.get_tree_and_root_stream(
+												lrg_archive.open(lrg_id))
+			else:
+				root = lrgparser.get_tree_and_root_stream(
+								io.BytesIO(webservices.search_by_lrg(lrg_id)))
+		except SystemExit:
+			raise RequestError(404, "No LRG is available for: " + lrg_id)
+		except Exception:
+			raise RequestError(502, "Could not read the LRG: " + lrg_id)
+		return lrgparser.get_lrg_index(root)
+
+	def _load_file(self, xml_file):
+		"""Reads and indexes an LRG XML file, through the index cache when
+		one is in use"""
+		try:
+			if indexcache.CACHE_DIR != None:
+				return indexcache.load_lrg_index(xml_file)
+			return lrgparser.get_lrg_index(
+							lrgparser.get_tree_and_root_stream(xml_file))
+		except (SystemExit, Exception):
+			raise RequestError(400, "Not a valid LRG XML file: " + xml_file)
+
+
+def _flag(value):
+	"""Reads a true or false request field, e.g 1, y, true"""
+	if isinstance(value, bool):
+		return value
+	return str(value).lower() in ('1', 'y', 'yes', 'true')
+
+
+def _request_lrg_id(lrg_cache, request):
+	"""Returns the LRG ID of a request, searching for its gene if needed"""
+	lrg_id = request.get('lrg')
+	if lrg_id:
+		return str(lrg_id)
+	if not request.get('gene'):
+		raise RequestError(400, "Either lrg or gene must be given")
+	try:
+		return lrg_cache.search_gene(str(request['gene']))
+	except SystemExit:
+		raise RequestError(404, "No LRG is available for: " +
+							str(request['gene']))
+	except Exception:
+		raise RequestError(502, "Could not search for: " +
+							str(request['gene']))
+
+
+def create_bed_response(lrg_cache, request, allow_files=False):
+	"""Creates the BED rows for one request.
+
+	Args:
+		lrg_cache (LRGIndexCache): Cache of parsed LRGs
+		request (dict): Fields lrg or gene, build, transcript, and optionally
+						flank, introns and merge
+		allow_files (bool): Also accept a file field, the path to a local
+							LRG XML file. Not allowed over HTTP.
+	Returns:
+		response (dict): The LRG, gene, build, transcript, flank, header and
+							rows [chromosome, start, end, label]
+	Raises:
+		RequestError: If the request is invalid or the LRG is not found
+	"""
+
+	if allow_files and request.get('file'):
+		lrg_index = lrg_cache.get_file(request['file'])
+	else:
+		lrg_index = lrg_cache.get(_request_lrg_id(lrg_cache, request))
+	lrg_id = lrg_index.lrg_id
+
+	genome_choice = request.get('build')
+	if genome_choice not in lrg_index.genome_builds:
+		raise RequestError(404, "Genome build not in " + lrg_id + ": " +
+							str(genome_choice) + ". Available: " +
+							", ".join(lrg_index.genome_builds))
+	transcript_choice = request.get('transcript')
+	if transcript_choice not in lrg_index.transcripts:
+		raise RequestError(404, "Transcript not in " + lrg_id + ": " +
+							str(transcript_choice) + ". Available: " +
+							", ".join(lrg_index.transcripts))
+	try:
+		flank = int(request.get('flank') or 0)
+	except (TypeError, ValueError):
+		raise RequestError(400, "Flank must be a whole number")
+	if flank < 0:
+		raise RequestError(400, "Flank must not be negative")
+	introns = _flag(request.get('introns', False))
+
+	lrg_object = lrgparser.lrg_object_creator(lrg_index, genome_choice,
+											transcript_choice, flank)
+	timestamp = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+	bedheader = bedgen.create_bed_header(lrg_object, transcript_choice,
+										genome_choice, timestamp)
+	bedcontents = bedgen.create_bed_contents(lrg_object, introns)
+	if _flag(request.get('merge', False)):
+		bedcontents = bedgen.merge_bed_contents(bedcontents)
+
+	return {'lrg_id': lrg_index.lrg_id,
+			'hgnc_name': lrg_index.hgnc_name,
+			'genome_build': genome_choice,
+			'transcript': transcript_choice,
+			'flank': flank,
+			'introns': introns,
+			'header': bedheader,
+			'rows': bedcontents}
+
+
+class LRGRequestHandler(http.server.BaseHTTPRequestHandler):
+	"""Answers BED requests from the LRG cache of its server"""
+	protocol_version = "HTTP/1.1"
+	# The headers and body are written separately, so without this a
+	# keep-alive client waits for a delayed ACK on every response
+	disable_nagle_algorithm = True
+
+	def do_GET(self):
+		url = urllib.parse.urlsplit(self.path)
+		if url.path == "/health":
+			lrg_cache = self.server.lrg_cache
+			self._send_json(200, {'status': 'ok',
+								'cached': len(lrg_cache),
+								'hits': lrg_cache.hits,
+								'misses': lrg_cache.misses})
+		elif url.path == "/bed":
+			request = dict(urllib.parse.parse_qsl(url.query))
+			self._answer(request)
+		else:
+			self._send_json(404, {'error': "Unknown path: " + url.path})
+
+	def do_POST(self):
+		url = urllib.parse.urlsplit(self.path)
+		if url.path != "/bed":
+			self._send_json(404, {'error': "Unknown path: " + url.path})
+			return
+		try:
+			length = int(self.headers.get('Content-Length') or 0)
+		except ValueError:
+			length = -1
+		if length < 0 or length > MAX_REQUEST_SIZE:
+			self._send_json(400, {'error': "Invalid request size"})
+			return
+		try:
+			request = json.loads(self.rfile.read(length) or b'{}')
+		except ValueError:
+			request = None
+		if not isinstance(request, dict):
+			self._send_json(400, {'error': "Expected a JSON object"})
+			return
+		self._answer(request)
+
+	def _answer(self, request):
+		"""Sends the BED response to a request, or its error"""
+		try:
+			response = create_bed_response(self.server.lrg_cache, request)
+		except RequestError as error:
+			self._send_json(error.status, {'error': error.message})
+			return
+		except Exception:
+			self._send_json(500, {'error': "Could not create the BED rows"})
+			return
+		self._send_json(200, response)
+
+	def _send_json(self, status, content):
+		body = json.dumps(content).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		# Requests are not logged, as the caller usually does
+		pass
+
+
+def create_server(host=DEFAULT_HOST, port=DEFAULT_PORT,
+				cache_size=DEFAULT_CACHE_SIZE, archive_file=None):
+	"""Creates the HTTP server without starting it.
+
+	Args:
+		host (str): Address to listen on
+		port (int): Port to listen on, or 0 for any free port
+		cache_size (int): Number of parsed LRGs kept in memory
+		archive_file (str): Packed archive read before downloading, or None
+	Returns:
+		httpd (http.server.ThreadingHTTPServer): The server, with its cache
+													as httpd.lrg_cache
+	"""
+
+	httpd = http.server.ThreadingHTTPServer((host, port), LRGRequestHandler)
+	httpd.daemon_threads = True
+	httpd.lrg_cache = LRGIndexCache(cache_size, archive_file)
+	return httpd
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT,
+		cache_size=DEFAULT_CACHE_SIZE, archive_file=None):
+	"""Runs the HTTP server until it is interrupted.
+
+	Raises:
+		SystemExit: If the server could not listen on the address
+	"""
+
+	try:
+		httpd = create_server(host, port, cache_size, archive_file)
+	except OSError:
+		print("    Could not listen on " + host + ":" + str(port))
+		raise SystemExit
+	print("")
+	print("    LRG Parser serving BED rows on http://" + host + ":" +
+			str(httpd.server_address[1]) + "/bed")
+	print("")
+	try:
+		httpd.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		httpd.server_close()
+	return True
@@ -0,0 +1,189 @@
+"""
+This module contains functions for building and searching a local index of
+HGNC gene names, gene synonyms and HGNC IDs to LRG IDs. The index is built
+from a directory of LRG XML files, so genes can be resolved to LRG IDs
+without querying the EBI search REST API.
+"""
+
+
+import gzip
+import json
+import os
+
+import compression
+import xml.etree.ElementTree as ET
+
+
+DEFAULT_INDEX_FILE = os.path.join(os.path.expanduser("~"), ".lrg_parser",
+								"symbol_index.json.gz")
+
+# Keys from the gene name and HGNC ID take priority over gene synonyms
+PRIMARY = 0
+SYNONYM = 1
+
+# Indexes that have already been loaded, keyed by path
+_loaded_indexes = {}
+
+
+def normalise(searchterm):
+	"""Returns the form of a gene name or HGNC ID used as an index key"""
+	searchterm = searchterm.strip().upper()
+	if searchterm.startswith('HGNC:'):
+		searchterm = searchterm[5:]
+	return searchterm
+
+
+def read_symbols(xml_file):
+	"""Reads the LRG ID and the names that identify its gene from an LRG XML
+	file. Every element outside a <gene> is cleared once read, and a gene
+	once its end is read, so the sequences are never all held in memory.
+	The synonyms of a gene are those inside its own <gene> element, under
+	its <symbol> or, in Ensembl genes, under a <db_xref>.
+
+	Args:
+		xml_file (str or file): LRG XML file path or file object
+	Returns:
+		lrg_id (str): LRG ID e.g LRG_384
+		keys (dict): Normalised name or HGNC ID -> PRIMARY or SYNONYM
+	"""
+
+	lrg_id = None
+	hgnc_id = None
+	locus = None
+	synonyms = {}
+	# Number of <gene> elements open, whose contents are kept until the end
+	# of the gene
+	gene_depth = 0
+	for event, element in ET.iterparse(xml_file, events=('start', 'end')):
+		if event == 'start':
+			if element.tag == 'gene':
+				gene_depth += 1
+			continue
+		if element.tag == 'id' and lrg_id is None:
+			lrg_id = element.text
+		elif element.tag == 'hgnc_id' and hgnc_id is None:
+			hgnc_id = element.text
+		elif element.tag == 'lrg_locus':
+			locus = element.text
+		elif element.tag == 'gene':
+			gene_depth -= 1
+			symbol = element.find('symbol')
+			name = symbol.attrib.get('name') if symbol is not None else None
+			if name:
+				synonyms.setdefault(name, set()).update(
+							synonym.text for synonym in element.iter('synonym')
+							if synonym.text)
+		if gene_depth == 0:
+			element.clear()
+
+	keys = {}
+	if locus:
+		# Only the synonyms of the LRG's own gene are used; other genes that
+		# overlap the LRG are not indexed
+		for synonym in synonyms.get(locus, ()):
+			keys[normalise(synonym)] = SYNONYM
+		keys[normalise(locus)] = PRIMARY
+	if hgnc_id:
+		keys[normalise(hgnc_id)] = PRIMARY
+	return lrg_id, keys
+
+
+def build_symbol_index(directory, index_file=DEFAULT_INDEX_FILE):
+	"""Builds the index from every LRG XML file in a directory, which may be
+	compressed, and writes it to disk as gzip compressed JSON. A synonym
+	that is shared by genes in different LRGs is left out, so it is
+	resolved by the web service.
+
+	Args:
+		directory (str): Path to a directory of LRG XML files
+		index_file (str): Path the index is written to
+	Returns:
+		symbols (dict): Normalised name or HGNC ID -> LRG ID
+	Raises:
+		SystemExit: If the directory could not be read or the index written
+	"""
+
+	try:
+		filenames = sorted(os.listdir(directory))
+	except OSError:
+		print("    Could not read the directory: " + str(directory))
+		raise SystemExit
+
+	symbols = {}
+	priorities = {}
+	ambiguous = set()
+	for filename in filenames:
+		if not compression.is_xml_file(filename):
+			continue
+		try:
+			with compression.open_xml_file(
+						os.path.join(directory, filename)) as xml_stream:
+				lrg_id, keys = read_symbols(xml_stream)
+		except (ET.ParseError, OSError, EOFError):
+			print("    Skipping invalid LRG XML file: " + filename)
+			continue
+		if lrg_id is None:
+			continue
+		for key, priority in keys.items():
+			if key not in symbols or priority < priorities[key]:
+				symbols[key] = lrg_id
+				priorities[key] = priority
+				ambiguous.discard(key)
+			elif priority == priorities[key] and symbols[key] != lrg_id:
+				ambiguous.add(key)
+	for key in ambiguous:
+		del symbols[key]
+
+	try:
+		os.makedirs(os.path.dirname(os.path.abspath(index_file)),
+					exist_ok=True)
+		with gzip.open(index_file, 'wt') as f:
+			json.dump(symbols, f, separators=(',', ':'), sort_keys=True)
+	except OSError:
+		print("    Could not write the symbol index: " + str(index_file))
+		raise SystemExit
+	print("")
+	print("    Symbol index of " + str(len(symbols)) +
+			" names written to " + index_file)
+	print("")
+	return symbols
+
+
+def load_symbol_index(index_file=DEFAULT_INDEX_FILE):
+	"""Loads the index from disk. The loaded index is kept in memory and only
+	read again if the file changes.
+
+	Args:
+		index_file (str): Path to the index
+	Returns:
+		symbols (dict): Normalised name or HGNC ID -> LRG ID, empty if the
+						index does not exist
+	"""
+
+	try:
+		modified = os.stat(index_file).st_mtime
+	except OSError:
+		return {}
+	loaded = _loaded_indexes.get(index_file)
+	if loaded is None or loaded[0] != modified:
+		try:
+			with gzip.open(index_file, 'rt') as f:
+				symbols = json.load(f)
+		except (OSError, ValueError):
+			symbols = {}
+		loaded = (modified, symbols)
+		_loaded_indexes[index_file] = loaded
+	return loaded[1]
+
+
+def lookup(searchterm, index_file=DEFAULT_INDEX_FILE):
+	"""Returns the LRG ID for a HGNC gene name, synonym or HGNC ID.
+
+	Args:
+		searchterm (str): HGNC gene name, synonym or HGNC ID
+		index_file (str): Path to the index
+	Returns:
+		lrg_id (str): The matching LRG ID, or None if not in the index
+	"""
+
+	return load_symbol_index(index_file).get(normalise(searchterm))
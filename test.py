@@ -1,6 +1,10 @@
 
+import contextlib
 import os
 import io
+import json
+import pickle
+import subprocess
 import sys
 import unittest
 from unittest import TestCase
@@ -11,9 +15,80 @@ import lrgparser as lrgp
 import ui as ui
 import bedgen as bg
 import functions
+import lrgindex
+import indexcache
+import batch
+import lrgcache
+import tempfile
+import threading
+import time
+import gzip
+import bz2
+import lzma
+import compression
+import archive
+import intervals
+import bgzf
+import xmlbackend
+import benchmark
+import profiling
+import server
+import coprocess
+import urllib.request
+import urllib.error
+import pstats
+import httppool
+import symbolindex
+import http.server
 import xml.etree.ElementTree as ET
 
 
+class LocalLRGServer:
+	"""A local stand-in for the LRG FTP site, serving the testfiles
+	directory over HTTP/1.1 with keep-alive and gzip encoding. It counts the
+	requests and connections it receives.
+	"""
+
+	def __init__(self, directory="testfiles", delay=0):
+		server = self
+
+		class Handler(http.server.BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+
+			def do_GET(self):
+				server.requests += 1
+				server.clients.add(self.client_address)
+				time.sleep(delay)
+				path = os.path.join(directory, os.path.basename(self.path))
+				if not os.path.isfile(path):
+					self.send_error(404)
+					return
+				with open(path, "rb") as xml_file:
+					body = xml_file.read()
+				self.send_response(200)
+				if "gzip" in self.headers.get("Accept-Encoding", ""):
+					body = gzip.compress(body)
+					self.send_header("Content-Encoding", "gzip")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, *args):
+				pass
+
+		self.requests = 0
+		self.clients = set()
+		self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.url = "http://127.0.0.1:" + str(self.httpd.server_port) + "/"
+		self.thread = threading.Thread(target=self.httpd.serve_forever,
+										daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
 class WebServicesTests(TestCase):
 	"""Tests designed to test the functions contained within the
 	webservices.py file.
@@ -38,6 +113,39 @@ class WebServicesTests(TestCase):
 		with self.assertRaises(SystemExit) as se:
 			ws.search_by_lrg("invalid_lrg")
 
+	def test_resolve_genes(self):
+		"""Checks that many LRG IDs are downloaded concurrently and parsed,
+		and that a missing LRG is reported as None
+		"""
+		server = LocalLRGServer(delay=0.3)
+		ws.set_cache(None)
+		searchterms = ["LRG_384", "LRG_155", "LRG_384_new", "LRG_999"]
+		try:
+			with patch('webservices.LRG_XML_URL', server.url):
+				start = time.time()
+				results = ws.resolve_genes(searchterms, concurrency=4)
+				elapsed = time.time() - start
+		finally:
+			server.stop()
+			ws.set_cache(ws._default_cache)
+		self.assertEqual(list(results), searchterms)
+		self.assertEqual(results["LRG_999"], None)
+		self.assertEqual(lrgp.get_genome_builds(results["LRG_155"]),
+						['GRCh37.p13', 'GRCh38.p12'])
+		self.assertLess(elapsed, 0.3 * len(searchterms))
+
+	def test_resolve_genes_malformed_search(self):
+		"""Checks that a search response that is not XML fails only its own
+		gene
+		"""
+		html = httppool.HTTPResponse(200, {}, b"<html><body>Error", "")
+		with patch('webservices.connection_pool.request',
+					return_value=html), \
+				patch('webservices.SYMBOL_INDEX_FILE', os.devnull), \
+				patch('builtins.print'):
+			results = ws.resolve_genes(["NOTAGENE", "ALSONOTAGENE"])
+		self.assertEqual(results, {"NOTAGENE": None, "ALSONOTAGENE": None})
+
 	def test_lrg_xml_file(self):
 		"""Checks that the LRG file returned by the LRG website has the 
 		correct ID 
@@ -72,6 +180,20 @@ class LRGParserTests(TestCase):
 		with self.assertRaises(SystemExit) as se:
 			lrgp.get_tree_and_root_file(str("fakefilepath"))
 
+	def test_get_tree_and_root_stream(self):
+		"""Tests that the streaming loader drops the sequence blocks but
+		keeps every mapping and the fixed annotation fields
+		"""
+		root = lrgp.get_tree_and_root_stream(str(self.xml_path_full))
+		full_root = ET.parse(str(self.xml_path_full)).getroot()
+		self.assertEqual(root.tag, "lrg")
+		self.assertEqual(len(list(root.iter('sequence'))), 0)
+		self.assertEqual(len(list(root.iter('mapping_span'))),
+						len(list(full_root.iter('mapping_span'))))
+		self.assertEqual(root.find('fixed_annotation/id').text, "LRG_384")
+		self.assertEqual(lrgp.get_transcript_ids(root),
+						lrgp.get_transcript_ids(full_root))
+
 	def test_get_tree_and_root_string(self):
 		"""Tests that a string passed to the get_tree_and_root_string
 		function returns a root object with a single root tag - "lrg"
@@ -131,6 +253,52 @@ class LRGParserTests(TestCase):
 		self.assertEqual(lrg_object.mapped_flanked_exon_coords.get(40),
 						[23882080, 23881946])
 
+	def test_lrg_object_creator_missing_transcript(self):
+		"""Tests that a transcript that is not in the LRG gives an
+		'lrg_object' without exons, as get_exon_coords gives no exons
+		"""
+		root = lrgp.get_tree_and_root_file(self.xml_path_full)
+		lrg_object = lrgp.lrg_object_creator(root, 'GRCh37.p13',
+											'NM_NOPE.1', 50)
+		self.assertEqual(lrg_object.lrg_id, 'LRG_384')
+		self.assertEqual(lrg_object.chromosome, '14')
+		self.assertEqual(dict(lrg_object.mapped_flanked_exon_coords), {})
+		self.assertEqual(dict(lrg_object.mapped_intron_coords), {})
+		self.assertEqual(bg.create_bed_contents(lrg_object, True), [])
+
+	def test_lrg_object_creator_missing_build(self):
+		"""Tests that a genome build that is not in the LRG gives an
+		'lrg_object' without a chromosome or exons, and no BED rows
+		"""
+		root = lrgp.get_tree_and_root_file(self.xml_path_full)
+		lrg_object = lrgp.lrg_object_creator(root, 'GRCh99',
+											'NM_000257.2', 50)
+		self.assertEqual(lrg_object.lrg_id, 'LRG_384')
+		self.assertEqual(lrg_object.chromosome, None)
+		self.assertEqual(dict(lrg_object.mapped_flanked_exon_coords), {})
+		self.assertEqual(bg.create_bed_contents(lrg_object, True), [])
+
+	def test_lrg_object_compact(self):
+		"""Tests that an 'lrg_object' has no __dict__, holds its coordinates
+		in arrays and can be pickled
+		"""
+		root = lrgp.get_tree_and_root_file(self.xml_path_full)
+		lrg_object = lrgp.lrg_object_creator(root, 'GRCh37.p13',
+											'NM_000257.2', 10)
+		self.assertFalse(hasattr(lrg_object, '__dict__'))
+		self.assertEqual(lrg_object.forward, False)
+		self.assertEqual(lrg_object.mapped_intron_coords,
+						functions.get_intron_coords(
+							functions.get_exon_coords(root, 'GRCh37.p13',
+														'NM_000257.2')))
+		unpickled = pickle.loads(pickle.dumps(lrg_object))
+		self.assertEqual(unpickled.lrg_id, 'LRG_384')
+		self.assertEqual(unpickled.forward, False)
+		self.assertEqual(dict(unpickled.mapped_flanked_exon_coords),
+						dict(lrg_object.mapped_flanked_exon_coords))
+		self.assertEqual(bg.create_bed_contents(unpickled, True),
+						bg.create_bed_contents(lrg_object, True))
+
 	def test_arg_collection(self):
 		"""Tests that arguments passed to the argument parsing function are
 		correctly captured
@@ -161,6 +329,64 @@ class LRGParserTests(TestCase):
 		self.assertEqual(lrgp.main(arguments_full_flank), True)
 
 
+	def test_get_lrg_version(self):
+		"""Checks that the version is the same for the same annotation and
+		differs for updated annotation
+		"""
+		root = lrgp.get_tree_and_root_file(self.xml_path_full)
+		version = lrgp.get_lrg_version(root)
+		self.assertTrue(version.startswith("20181121-"))
+		self.assertEqual(lrgp.get_lrg_version(
+						lrgp.get_tree_and_root_file(self.xml_path_full)),
+						version)
+		self.assertNotEqual(lrgp.get_lrg_version(lrgp.get_tree_and_root_file(
+							"testfiles/LRG_384_new.xml")), version)
+
+	def test_lazy_imports(self):
+		"""Checks that importing lrgparser and running it on a local file or
+		directory does not load the network, UI or NumPy modules
+		"""
+		script = ("import sys, lrgparser; " +
+					"lrgparser.main(lrgparser.arg_collection(sys.argv[1:])); " +
+					"print(' '.join(sorted(set(sys.modules) & {'webservices', " +
+					"'ui', 'numpy', 'asyncio', 'http.client', 'argparse'})))")
+		with tempfile.TemporaryDirectory() as tempdir:
+			output = subprocess.run([sys.executable, "-c", script,
+									"-f", self.xml_path_full,
+									"-r", "GRCh37.p13", "-t", "NM_000257.2",
+									"-o", os.path.join(tempdir, "LRG.bed")],
+									capture_output=True, text=True, check=True)
+			self.assertEqual(output.stdout.splitlines()[-1], "argparse ui")
+			output = subprocess.run([sys.executable, "-c", script,
+									"-d", "testfiles", "-r", "GRCh37.p13",
+									"-t", "NM_000257.2", "-o", tempdir],
+									capture_output=True, text=True, check=True)
+			self.assertEqual(output.stdout.splitlines()[-1], "argparse")
+		# webservices and indexcache parse LRG XML without importing
+		# lrgparser, which imports them
+		output = subprocess.run([sys.executable, "-c",
+								"import sys, webservices, indexcache; " +
+								"print('lrgparser' in sys.modules)"],
+								capture_output=True, text=True, check=True)
+		self.assertEqual(output.stdout.strip(), "False")
+
+	@patch('bedgen.write_bed_file', return_value=True)
+	def test_write_all_combinations(self, write_bed_file):
+		"""Tests that a BED file is written for every genome build and
+		transcript combination, or one labelled combined file
+		"""
+		root = lrgp.get_tree_and_root_file(self.xml_path_full)
+		self.assertEqual(lrgp.write_all_combinations(root, 0, False), True)
+		self.assertEqual(write_bed_file.call_count, 6)
+		lrgp.write_all_combinations(root, 0, False, "combined.bed")
+		filename, bedheader, bedcontents = write_bed_file.call_args[0]
+		self.assertEqual(filename, "combined.bed")
+		self.assertEqual(bedcontents[0],
+						['chr14', 23904828, 23904870,
+						'GRCh37.p13_NM_000257.2_Exon_1'])
+		self.assertEqual(len(set(row[3] for row in bedcontents)),
+						len(bedcontents))
+
 	@patch('ui.input', side_effect=["MYH7", "1", "1", "0", "y"])
 	@patch('bedgen.write_bed_file', return_value=True)
 	@patch('os.system', return_value="")
@@ -225,6 +451,51 @@ class BedgenTests(TestCase):
 		with self.assertRaises(SystemExit) as se:
 			bg.write_bed_file(None, bedheader, bedcontents)
 
+	def test_iter_bed_rows(self):
+		"""Tests that rows are generated in the order of the nested list,
+		and can be written to stdout
+		"""
+		root = lrgp.get_tree_and_root_file(self.xml_path_full)
+		lrg_object = lrgp.lrg_object_creator(root, "GRCh37.p13",
+											"NM_000257.2", 0)
+		self.assertEqual(list(bg.iter_bed_rows(lrg_object, True)),
+						bg.create_bed_contents(lrg_object, True))
+		with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+			bg.write_bed_file("-", ["track name=test"],
+							bg.iter_bed_rows(lrg_object, False))
+		lines = stdout.getvalue().splitlines()
+		self.assertEqual(len(lines), 1 + 40)
+		self.assertEqual(lines[1], "chr14\t23904828\t23904870\tExon_1")
+
+	def test_merge_bed_contents(self):
+		"""Tests that overlapping rows are merged into sorted rows with
+		combined labels, covering the same bases as the original rows
+		"""
+		bedcontents = [['chr14', 100, 200, "Exon_4"],
+						['chr14', 150, 300, "Exon_3"],
+						['chr14', 300, 400, "Intron_3"],
+						['chr14', 500, 600, "Exon_6"],
+						['chr1', 700, 800, "Exon_1"]]
+		self.assertEqual(bg.merge_bed_contents(bedcontents),
+						[['chr1', 700, 800, "Exon_1"],
+						['chr14', 100, 400, "Exon_3-4,Intron_3"],
+						['chr14', 500, 600, "Exon_6"]])
+
+		root = lrgp.get_tree_and_root_file(self.xml_path_full)
+		lrg_object = lrgp.lrg_object_creator(root, "GRCh37.p13",
+											"NM_000257.2", 1000)
+		bedcontents = bg.create_bed_contents(lrg_object, True)
+		merged = bg.merge_bed_contents(bedcontents)
+		covered = set()
+		for chromosome, start, end, label in bedcontents:
+			covered.update(range(start, end))
+		merged_covered = set()
+		for chromosome, start, end, label in merged:
+			merged_covered.update(range(start, end))
+		self.assertEqual(merged_covered, covered)
+		for previous, row in zip(merged, merged[1:]):
+			self.assertLess(previous[2], row[1])
+
 
 
 class FunctionsTests(TestCase):
@@ -338,8 +609,1110 @@ class FunctionsTests(TestCase):
 		self.assertEqual(len(pos_flanked_coordinates), 14)
 		self.assertEqual(pos_flanked_coordinates[1],[207925282,207925754])
 		self.assertEqual(pos_flanked_coordinates[14],[207966763,207968961])
+
+	def test_array_engine(self):
+		""" Tests that the array functions give the same coordinates as the
+		dictionary functions, including when NumPy arrays are used for
+		every transcript size.
+		"""
+		root = lrgp.get_tree_and_root_file(self.xml_path_full)
+		exon_coordinates = functions.get_exon_coords(root, 'GRCh37.p13',
+													'NM_000257.2')
+		with patch('functions.NUMPY_MIN_EXONS', 1):
+			first, second, forward = functions.get_exon_arrays(root,
+															'GRCh37.p13',
+															'NM_000257.2')
+			self.assertEqual(forward, False)
+			self.assertEqual(functions.arrays_to_coords(first, second),
+							exon_coordinates)
+			self.assertEqual(functions.arrays_to_coords(
+								*functions.map_introns(first, second, forward)),
+							functions.get_intron_coords(exon_coordinates))
+			self.assertEqual(functions.arrays_to_coords(
+								*functions.map_flanks(first, second, 50, forward)),
+							functions.get_flanked_coords(exon_coordinates, 50))
+		self.assertEqual(functions.get_exon_arrays(root, 'GRCh37.p13',
+												'invalid_transcript'), None)
 		
 
+class HTTPConnectionPoolTests(TestCase):
+	"""Tests designed to test the HTTPConnectionPool class contained within
+	the httppool.py file.
+	"""
+
+	def setUp(self):
+		self.server = LocalLRGServer()
+		self.pool = httppool.HTTPConnectionPool(connect_timeout=5,
+												read_timeout=5)
+		with open("testfiles/LRG_384.xml", "rb") as xml_file:
+			self.xml_contents = xml_file.read()
+
+	def tearDown(self):
+		self.pool.close()
+		self.server.stop()
+
+	def test_keep_alive(self):
+		"""Checks that repeated requests reuse one connection and that gzip
+		responses are decompressed
+		"""
+		for _ in range(3):
+			response = self.pool.request(self.server.url + "LRG_384.xml")
+			self.assertEqual(response.status, 200)
+			self.assertEqual(response.body, self.xml_contents)
+		self.assertEqual(self.server.requests, 3)
+		self.assertEqual(len(self.server.clients), 1)
+		self.assertEqual(self.pool.connections_opened, 1)
+
+	def test_not_found(self):
+		"""Checks that an error status is returned rather than raised"""
+		response = self.pool.request(self.server.url + "LRG_999.xml")
+		self.assertEqual(response.status, 404)
+		response = self.pool.request(self.server.url + "LRG_384.xml")
+		self.assertEqual(response.status, 200)
+
+
+class LRGCacheTests(TestCase):
+	"""Tests designed to test the LRGCache class contained within the
+	lrgcache.py file and its use by the webservices.
+	"""
+
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+		self.cache = lrgcache.LRGCache(self.tempdir.name)
+		with open("testfiles/LRG_384.xml", "rb") as xml_file:
+			self.xml_contents = xml_file.read()
+
+	def tearDown(self):
+		ws.set_cache(ws._default_cache)
+		ws.OFFLINE = False
+		self.tempdir.cleanup()
+
+	def test_put_and_get(self):
+		"""Checks that a stored file is returned unchanged and that its
+		modification_date is recorded
+		"""
+		self.cache.put("LRG_384", self.xml_contents)
+		self.assertEqual(self.cache.get("LRG_384"), self.xml_contents)
+		self.assertEqual(self.cache.modification_date("LRG_384"), "2018-11-21")
+		reopened_cache = lrgcache.LRGCache(self.tempdir.name)
+		self.assertEqual(reopened_cache.get("LRG_384"), self.xml_contents)
+
+	def test_ttl(self):
+		"""Checks that expired entries are only returned when stale entries
+		are allowed
+		"""
+		cache = lrgcache.LRGCache(self.tempdir.name, ttl=-1)
+		cache.put("LRG_384", self.xml_contents)
+		self.assertEqual(cache.get("LRG_384"), None)
+		self.assertEqual(cache.get("LRG_384", allow_stale=True),
+						self.xml_contents)
+
+	def test_lru_eviction(self):
+		"""Checks that the least recently used entry is evicted when the
+		cache grows beyond its size cap
+		"""
+		self.cache.put("LRG_1", self.xml_contents)
+		entry_size = self.cache._index["LRG_1"]['size']
+		cache = lrgcache.LRGCache(self.tempdir.name, max_size=entry_size * 2)
+		cache.put("LRG_2", self.xml_contents)
+		cache.get("LRG_1")
+		cache.put("LRG_3", self.xml_contents)
+		self.assertNotEqual(cache.get("LRG_1"), None)
+		self.assertEqual(cache.get("LRG_2"), None)
+		self.assertNotEqual(cache.get("LRG_3"), None)
+
+	def test_shared_index(self):
+		"""Checks that caches sharing a directory, as separate processes do,
+		keep each other's entries
+		"""
+		other_cache = lrgcache.LRGCache(self.tempdir.name)
+		self.assertEqual(other_cache.get("LRG_1"), None)
+		self.cache.put("LRG_1", self.xml_contents)
+		other_cache.put("LRG_2", self.xml_contents)
+		self.cache.put("LRG_3", self.xml_contents)
+		reopened_cache = lrgcache.LRGCache(self.tempdir.name)
+		for lrg_id in ["LRG_1", "LRG_2", "LRG_3"]:
+			self.assertEqual(reopened_cache.get(lrg_id), self.xml_contents)
+
+	def test_lrg_id_normalised(self):
+		"""Checks that LRG IDs are upper cased and that other search terms
+		are neither stored nor read
+		"""
+		self.cache.put("lrg_384", self.xml_contents)
+		self.assertEqual(self.cache.get("LRG_384"), self.xml_contents)
+		self.cache.put("../LRG_384", self.xml_contents)
+		self.assertEqual(self.cache.get("../LRG_384"), None)
+		self.assertEqual(sorted(os.listdir(self.tempdir.name)),
+						["LRG_384.xml.gz", "index.json", "index.lock"])
+
+	def test_search_by_lrg_cached(self):
+		"""Checks that a repeat lookup is served from the cache, and that
+		offline mode only uses the cache
+		"""
+		server = LocalLRGServer()
+		ws.set_cache(self.cache)
+		try:
+			with patch('webservices.LRG_XML_URL', server.url):
+				self.assertEqual(ws.search_by_lrg("LRG_384"), self.xml_contents)
+				self.assertEqual(ws.search_by_lrg("LRG_384"), self.xml_contents)
+		finally:
+			server.stop()
+		self.assertEqual(server.requests, 1)
+		ws.OFFLINE = True
+		self.assertEqual(ws.search_by_lrg("LRG_384"), self.xml_contents)
+		with self.assertRaises(SystemExit):
+			ws.search_by_lrg("LRG_155")
+
+
+class SymbolIndexTests(TestCase):
+	"""Tests designed to test the functions contained within the
+	symbolindex.py file.
+	"""
+
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+		self.index_file = os.path.join(self.tempdir.name, "symbols.json.gz")
+
+	def tearDown(self):
+		self.tempdir.cleanup()
+
+	def test_read_symbols(self):
+		"""Checks that the gene name, HGNC ID and synonyms of the LRG gene
+		are read, but not those of overlapping genes
+		"""
+		lrg_id, keys = symbolindex.read_symbols("testfiles/LRG_384.xml")
+		self.assertEqual(lrg_id, "LRG_384")
+		self.assertEqual(keys["MYH7"], symbolindex.PRIMARY)
+		self.assertEqual(keys["7577"], symbolindex.PRIMARY)
+		self.assertEqual(keys["CMH1"], symbolindex.SYNONYM)
+		self.assertNotIn("MIR208B", keys)
+
+	def test_read_symbols_self_closing(self):
+		"""Checks that the synonyms of a gene with a self-closing <symbol>,
+		as in Ensembl genes, are not given to the next gene
+		"""
+		xml = (b'<lrg><fixed_annotation><id>LRG_1</id></fixed_annotation>' +
+				b'<updatable_annotation><annotation_set>' +
+				b'<lrg_locus>GENEA</lrg_locus><features>' +
+				b'<gene><symbol name="GENEB" /><db_xref>' +
+				b'<synonym>BSYN</synonym></db_xref></gene>' +
+				b'<gene><symbol name="GENEA" /></gene>' +
+				b'</features></annotation_set></updatable_annotation></lrg>')
+		lrg_id, keys = symbolindex.read_symbols(io.BytesIO(xml))
+		self.assertEqual(lrg_id, "LRG_1")
+		self.assertEqual(keys, {"GENEA": symbolindex.PRIMARY})
+
+	def test_build_and_lookup(self):
+		"""Checks that an index built from the test files resolves gene
+		names, synonyms and HGNC IDs without the web service
+		"""
+		symbolindex.build_symbol_index("testfiles", self.index_file)
+		self.assertEqual(symbolindex.lookup("MYH7", self.index_file), "LRG_384")
+		self.assertEqual(symbolindex.lookup("cmh1", self.index_file), "LRG_384")
+		self.assertEqual(symbolindex.lookup("HGNC:6953", self.index_file),
+						"LRG_155")
+		self.assertEqual(symbolindex.lookup("BRCA1", self.index_file), None)
+		with patch('webservices.SYMBOL_INDEX_FILE', self.index_file):
+			self.assertEqual(ws.search_by_hgnc("MYH7"), "LRG_384")
+
+
+class CompressionTests(TestCase):
+	"""Tests designed to test the functions contained within the
+	compression.py file.
+	"""
+
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+		with open("testfiles/LRG_384.xml", "rb") as xml_file:
+			self.xml_contents = xml_file.read()
+
+	def tearDown(self):
+		self.tempdir.cleanup()
+
+	def test_open_xml_file(self):
+		"""Checks that gzip, bz2 and xz files are detected from their
+		contents and parsed like the plain XML file
+		"""
+		for suffix, compress in [(".gz", gzip.compress),
+								(".bz2", bz2.compress),
+								(".xz", lzma.compress),
+								("", bytes)]:
+			path = os.path.join(self.tempdir.name, "LRG_384.xml" + suffix)
+			with open(path, "wb") as compressed_file:
+				compressed_file.write(compress(self.xml_contents))
+			with compression.open_xml_file(path) as xml_stream:
+				self.assertEqual(xml_stream.read(), self.xml_contents)
+			root = lrgp.get_tree_and_root_file(path)
+			self.assertEqual(lrgp.get_genome_builds(root),
+							['GRCh37.p13', 'GRCh38.p12'])
+
+	def test_is_xml_file(self):
+		"""Checks that compressed XML extensions are recognised"""
+		self.assertEqual(compression.is_xml_file("LRG_1.xml.gz"), True)
+		self.assertEqual(compression.is_xml_file("LRG_1.xml.xz"), True)
+		self.assertEqual(compression.is_xml_file("LRG_1.txt"), False)
+
+
+class ArchiveTests(TestCase):
+	"""Tests designed to test the functions contained within the
+	archive.py file.
+	"""
+
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+		self.xml_directory = os.path.join(self.tempdir.name, "xml")
+		self.archive_file = os.path.join(self.tempdir.name, "corpus.lrga")
+		os.mkdir(self.xml_directory)
+		with open("testfiles/LRG_384.xml", "rb") as xml_file:
+			self.xml_contents = xml_file.read()
+		with open(os.path.join(self.xml_directory, "LRG_384.xml.gz"),
+					"wb") as compressed_file:
+			compressed_file.write(gzip.compress(self.xml_contents))
+		with open("testfiles/LRG_155.xml", "rb") as xml_file:
+			with open(os.path.join(self.xml_directory, "LRG_155.xml"),
+						"wb") as copied_file:
+				copied_file.write(xml_file.read())
+
+	def tearDown(self):
+		self.tempdir.cleanup()
+
+	def test_pack_and_read(self):
+		"""Checks that each LRG is read back from the archive unchanged,
+		and that a file that is not an archive is rejected
+		"""
+		self.assertEqual(archive.pack_archive(self.xml_directory,
+												self.archive_file), 2)
+		with archive.LRGArchive(self.archive_file) as lrg_archive:
+			self.assertEqual(sorted(lrg_archive.offsets),
+							['LRG_155', 'LRG_384'])
+			self.assertEqual(lrg_archive.read('LRG_384'), self.xml_contents)
+			root = lrgp.get_tree_and_root_stream(lrg_archive.open('LRG_155'))
+			self.assertEqual(lrgp.get_lrg_index(root).lrg_id, 'LRG_155')
+			self.assertNotIn('LRG_1', lrg_archive)
+		with self.assertRaises(ValueError):
+			archive.LRGArchive("testfiles/LRG_384.xml")
+
+	@patch('bedgen.write_bed_file', return_value=True)
+	@patch('webservices.search_by_lrg')
+	def test_main_with_archive(self, search_by_lrg, write_bed_file):
+		"""Checks that an LRG ID held in the archive is read without a
+		web service query
+		"""
+		archive.pack_archive(self.xml_directory, self.archive_file)
+		arguments = lrgp.arg_collection(["-l", "LRG_384",
+										"--archive", self.archive_file,
+										"-r", "GRCh37.p13",
+										"-t", "NM_000257.2"])
+		self.assertEqual(lrgp.main(arguments), True)
+		search_by_lrg.assert_not_called()
+		self.assertEqual(len(list(write_bed_file.call_args[0][2])), 40)
+
+
+class IntervalsTests(TestCase):
+	"""Tests designed to test the functions contained within the
+	intervals.py file.
+	"""
+
+	def setUp(self):
+		self.interval_index = intervals.IntervalIndex()
+		self.intervals = []
+		for xml_file in ["testfiles/LRG_384.xml", "testfiles/LRG_155.xml"]:
+			lrg_index = lrgp.get_lrg_index(lrgp.get_tree_and_root_file(xml_file))
+			self.interval_index.add_lrg(lrg_index)
+			for genome_choice in lrg_index.genome_builds:
+				for transcript_choice in lrg_index.transcripts:
+					lrg_object = lrgp.lrg_object_creator(lrg_index,
+														genome_choice,
+														transcript_choice, 0)
+					for row in bg.create_bed_contents(lrg_object, True):
+						self.intervals.append([genome_choice] + row)
+
+	def test_parse_region(self):
+		"""Checks that regions are converted to BED coordinates"""
+		self.assertEqual(intervals.parse_region("chr14:23900000"),
+						('14', 23899999, 23900000))
+		self.assertEqual(intervals.parse_region("14:1,000-2,000"),
+						('14', 999, 2000))
+		with self.assertRaises(ValueError):
+			intervals.parse_region("chr14:2000-1000")
+		with self.assertRaises(ValueError):
+			intervals.parse_region("MYH7")
+
+	def test_query(self):
+		"""Checks that queries return the same intervals as a scan of
+		every interval, at every interval boundary
+		"""
+		for genome_build, chromosome, start, end, label in self.intervals:
+			for query_start, query_end in [(start - 1, start), (start, start + 1),
+										(end - 1, end), (end, end + 1),
+										(start - 10, end + 10)]:
+				expected = sorted((row[2], row[3]) for row in self.intervals
+								if row[0] == genome_build and row[1] == chromosome
+								and row[2] < query_end and row[3] > query_start)
+				hits = self.interval_index.query(genome_build, chromosome,
+												query_start, query_end)
+				self.assertEqual(sorted((hit[0], hit[1]) for hit in hits),
+								expected)
+		self.assertEqual(self.interval_index.query('GRCh37.p13', 'chrX', 0),
+						[])
+
+	def test_saved_index(self):
+		"""Checks that an index is saved and reloaded for unchanged files,
+		and built again when a file changes
+		"""
+		with tempfile.TemporaryDirectory() as cache_dir:
+			source_files = []
+			for filename in ["LRG_384.xml", "LRG_155.xml"]:
+				source_files.append(os.path.join(cache_dir, filename))
+				with open("testfiles/" + filename, "rb") as xml_file, \
+						open(source_files[-1], "wb") as f:
+					f.write(xml_file.read())
+			roots = [lrgp.get_tree_and_root_file(xml_file)
+					for xml_file in source_files]
+			built = intervals.load_interval_index(roots, None, source_files,
+												cache_dir)
+			with patch('intervals.IntervalIndex.add_lrg') as add_lrg:
+				loaded = intervals.load_interval_index(roots, None,
+														source_files,
+														cache_dir)
+				add_lrg.assert_not_called()
+			self.assertEqual(loaded.genome_builds, built.genome_builds)
+			for genome_build, chromosome, start, end, label in self.intervals:
+				self.assertEqual(loaded.query(genome_build, chromosome, start),
+								built.query(genome_build, chromosome, start))
+			stat = os.stat(source_files[1])
+			os.utime(source_files[1], ns=(stat.st_atime_ns,
+											stat.st_mtime_ns + 10**9))
+			with patch('intervals.IntervalIndex.add_lrg') as add_lrg:
+				intervals.load_interval_index(roots, None, source_files,
+											cache_dir)
+				self.assertEqual(add_lrg.call_count, 2)
+
+	def test_main_query(self):
+		"""Checks that the query flag prints the covering exon, that an
+		unreadable file in a directory is skipped, and that the interval
+		index is only saved with --index-cache
+		"""
+		with tempfile.TemporaryDirectory() as tempdir, \
+				tempfile.TemporaryDirectory() as cache_dir:
+			for filename in ["LRG_384.xml", "broken.xml"]:
+				with open(os.path.join(tempdir, filename), "wb") as f:
+					if filename == "broken.xml":
+						f.write(b"<lrg><fixed_annotation>")
+					else:
+						with open("testfiles/LRG_384.xml", "rb") as xml_file:
+							f.write(xml_file.read())
+			for source in [["-f", "testfiles/LRG_384.xml"], ["-d", tempdir]]:
+				arguments = lrgp.arg_collection(["-q", "chr14:23883000",
+												"-r", "GRCh37.p13"] + source)
+				with patch('indexcache.DEFAULT_INDEX_CACHE_DIR', cache_dir), \
+						patch('builtins.print') as printed:
+					self.assertEqual(lrgp.main(arguments), True)
+				lines = [call[0][0] for call in printed.call_args_list]
+				self.assertIn("chr14\t23882967\t23883102\tGRCh37.p13\t" +
+							"LRG_384\tMYH7\tNM_000257.2\tExon_39", lines)
+			self.assertIn("    Skipping LRG XML file that could not be read: " +
+						os.path.join(tempdir, "broken.xml"), lines)
+			self.assertEqual(os.listdir(cache_dir), [])
+			arguments = lrgp.arg_collection(["-q", "chr14:23883000",
+											"-f", "testfiles/LRG_384.xml",
+											"--index-cache", cache_dir])
+			with patch('builtins.print'):
+				self.assertEqual(lrgp.main(arguments), True)
+			self.assertEqual(len(os.listdir(os.path.join(cache_dir,
+														"intervals"))), 1)
+
+
+class BgzfTests(TestCase):
+	"""Tests designed to test the functions contained within the
+	bgzf.py file.
+	"""
+
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+		self.bed_filename = os.path.join(self.tempdir.name, "panel.tsv.gz")
+		# Enough rows to fill several blocks, with some long intervals
+		self.bedcontents = []
+		for number in range(20000):
+			start = (number * 7919) % 5000000
+			length = 100000 if number % 500 == 0 else 150
+			self.bedcontents.append(["chr" + str(number % 3 + 1), start,
+									start + length, "Exon_" + str(number)])
+		bg.write_bed_file(self.bed_filename, ["track name=test"],
+						self.bedcontents)
+
+	def tearDown(self):
+		self.tempdir.cleanup()
+
+	def test_write_indexed_bed(self):
+		"""Checks that the file is sorted, readable as gzip and indexed"""
+		with gzip.open(self.bed_filename, "rt") as bed_file:
+			lines = bed_file.read().splitlines()
+		self.assertEqual(lines[0], "#track name=test")
+		rows = [line.split("\t") for line in lines[1:]]
+		self.assertEqual(len(rows), len(self.bedcontents))
+		self.assertEqual(rows, sorted(rows, key=lambda row: (row[0],
+															int(row[1]))))
+		self.assertEqual(sorted(bgzf.read_tabix_index(
+									self.bed_filename + ".tbi")),
+						['chr1', 'chr2', 'chr3'])
+
+	def test_main_bgzip_output(self):
+		"""Checks that -z writes an output filename given with -o block gzip
+		compressed, that it cannot write to stdout, and that the flags do
+		not carry over to a later run
+		"""
+		output = os.path.join(self.tempdir.name, "LRG_384.bed")
+		arguments = ["-f", "testfiles/LRG_384.xml", "-r", "GRCh37.p13",
+					"-t", "NM_000257.2", "--incremental"]
+		with patch('builtins.print'):
+			self.assertEqual(lrgp.main(lrgp.arg_collection(
+								arguments + ["-z", "-o", output])), True)
+		self.assertFalse(os.path.exists(output))
+		self.assertEqual(sorted(bgzf.read_tabix_index(output + ".gz.tbi")),
+						['chr14'])
+		self.assertEqual((bg.BGZIP, bg.INCREMENTAL), (False, False))
+		with patch('sys.stderr', io.StringIO()) as stderr:
+			with self.assertRaises(SystemExit):
+				lrgp.main(lrgp.arg_collection(arguments + ["-z", "-o", "-"]))
+		self.assertIn("-z cannot write to stdout", stderr.getvalue())
+		self.assertEqual((bg.BGZIP, bg.INCREMENTAL), (False, False))
+
+	def test_query_bed(self):
+		"""Checks that region queries return the same rows as a scan of the
+		whole file
+		"""
+		for chromosome, start, end in [("chr1", 0, 1), ("2", 1000000, 1000500),
+										("chr3", 2500000, 2600000),
+										("chr1", 4990000, 6000000),
+										("chr4", 0, 1000)]:
+			expected = sorted([row for row in self.bedcontents
+								if row[0][3:] == chromosome.replace("chr", "")
+								and row[1] < end and row[2] > start],
+								key=lambda row: row[:3])
+			self.assertEqual(bgzf.query_bed(self.bed_filename, chromosome,
+											start, end), expected)
+
+
+class LRGIndexTests(TestCase):
+	"""Tests designed to test the LRGIndex class contained within the
+	lrgindex.py file.
+	"""
+
+	def setUp(self):
+		self.this_directory_path = os.path.dirname(__file__)
+		self.xml_path_relative = "testfiles/LRG_384.xml"
+		self.xml_path_full = self.this_directory_path + self.xml_path_relative
+
+	def test_from_root(self):
+		"""Checks that the index holds the builds, transcripts and IDs
+		found in the XML file
+		"""
+		root = lrgp.get_tree_and_root_file(self.xml_path_full)
+		lrg_index = lrgindex.LRGIndex.from_root(root)
+		self.assertEqual(lrg_index.lrg_id, "LRG_384")
+		self.assertEqual(lrg_index.hgnc_name, "MYH7")
+		self.assertEqual(lrg_index.modification_date, "2018-11-21")
+		self.assertEqual(lrg_index.genome_builds['GRCh37.p13'],
+						('14', 23879947, 23909870, '-1'))
+		self.assertEqual(len(lrg_index.transcripts['NM_000257.2']), 40)
+		self.assertEqual(lrg_index.transcripts['NM_000257.2'][0],
+						(5001, 5042))
+
+	def test_get_lrg_index(self):
+		"""Checks that the index is only built once for each root"""
+		root = lrgp.get_tree_and_root_file(self.xml_path_full)
+		lrg_index = lrgindex.get_lrg_index(root)
+		self.assertIs(lrgindex.get_lrg_index(root), lrg_index)
+		self.assertIs(lrgindex.get_lrg_index(lrg_index), lrg_index)
+
+	def test_binary_round_trip(self):
+		"""Checks that the binary form reads back to an identical index,
+		and that other data is rejected
+		"""
+		root = lrgp.get_tree_and_root_file(self.xml_path_full)
+		lrg_index = lrgindex.LRGIndex.from_root(root)
+		loaded = lrgindex.LRGIndex.from_bytes(lrg_index.to_bytes())
+		self.assertEqual(vars(loaded), vars(lrg_index))
+		with self.assertRaises(ValueError):
+			lrgindex.LRGIndex.from_bytes(b'<?xml version="1.0"?>')
+		with self.assertRaises(ValueError):
+			lrgindex.LRGIndex.from_bytes(lrg_index.to_bytes()[:100])
+
+	def test_index_cache(self):
+		"""Checks that a second load of the same file is read from the
+		index cache without parsing the XML
+		"""
+		with tempfile.TemporaryDirectory() as cache_dir:
+			lrg_index = indexcache.load_lrg_index(self.xml_path_full,
+													cache_dir)
+			with patch('indexcache._parse_xml_file') as parse:
+				cached = indexcache.load_lrg_index(self.xml_path_full,
+													cache_dir)
+				parse.assert_not_called()
+			self.assertEqual(vars(cached), vars(lrg_index))
+			self.assertEqual(
+				functions.get_exon_coords(cached, 'GRCh37.p13', 'NM_000257.2'),
+				functions.get_exon_coords(lrg_index, 'GRCh37.p13', 'NM_000257.2'))
+
+
+class BatchTests(TestCase):
+	"""Tests designed to test the functions contained within the
+	batch.py file.
+	"""
+
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+		self.manifest = os.path.join(self.tempdir.name, "manifest.tsv")
+		with open(self.manifest, "w") as manifest_file:
+			manifest_file.write("#id\tbuild\ttranscript\tflank\tintrons\n")
+			manifest_file.write("testfiles/LRG_384.xml\tGRCh37.p13\t" +
+								"NM_000257.2\t0\tn\n")
+			manifest_file.write("testfiles/LRG_155.xml\tGRCh37.p13\t" +
+								"NM_002389.4\t10\ty\n")
+			manifest_file.write("testfiles/LRG_384.xml\tGRCh37.p13\t" +
+								"invalid_transcript\n")
+
+	def tearDown(self):
+		self.tempdir.cleanup()
+
+	def test_read_manifest(self):
+		"""Checks that comment lines are skipped and missing columns are
+		filled in
+		"""
+		rows = batch.read_manifest(self.manifest)
+		self.assertEqual(len(rows), 3)
+		self.assertEqual(rows[0]['transcript'], "NM_000257.2")
+		self.assertEqual(rows[2]['flank'], "")
+
+	def test_run_batch_combined(self):
+		"""Checks that valid rows are written to one combined BED file and
+		that an invalid row is reported without stopping the run
+		"""
+		output = os.path.join(self.tempdir.name, "combined.bed")
+		self.assertEqual(batch.run_batch(self.manifest, output), False)
+		with open(output) as bed_file:
+			lines = bed_file.read().splitlines()
+		self.assertEqual(len(lines), 1 + 40 + 14 + 13)
+		self.assertEqual(lines[1],
+						"chr14\t23904828\t23904870\tMYH7_NM_000257.2_Exon_1")
+
+	def test_run_batch_row_exception(self):
+		"""Checks that an unexpected error in one row, such as a network
+		error, is reported as a failed row without stopping the run
+		"""
+		get_row_root = batch.get_row_root
+		def failing_get_row_root(row_id, prefetched=None):
+			if row_id.endswith("LRG_155.xml"):
+				raise OSError("Connection reset")
+			return get_row_root(row_id, prefetched)
+		output = os.path.join(self.tempdir.name, "combined.bed")
+		summary = io.StringIO()
+		with patch('batch.get_row_root', side_effect=failing_get_row_root), \
+				patch('sys.stdout', summary):
+			self.assertEqual(batch.run_batch(self.manifest, output), False)
+		with open(output) as bed_file:
+			self.assertEqual(len(bed_file.read().splitlines()), 1 + 40)
+		self.assertIn("Connection reset", summary.getvalue())
+		self.assertIn("1 succeeded, 2 failed", summary.getvalue())
+
+	def test_print_summary_redirect(self):
+		"""Checks that the summary follows sys.stdout at call time, so that
+		redirect_stdout moves it
+		"""
+		summary = io.StringIO()
+		with contextlib.redirect_stdout(summary):
+			batch.print_summary([(1, "LRG_1", True, "OK")])
+		self.assertIn("1 succeeded, 0 failed", summary.getvalue())
+
+	def test_main_batch_stdout(self):
+		"""Checks that with -o - stdout only holds the BED file, with every
+		message sent to stderr, and that directory mode rejects -o -
+		"""
+		with open(self.manifest, "a") as manifest_file:
+			manifest_file.write("LRG_9999\tGRCh37.p13\tNM_000257.2\n")
+			manifest_file.write("NOTAGENE\tGRCh37.p13\tNM_000257.2\n")
+		arguments = lrgp.arg_collection(["-b", self.manifest, "-o", "-",
+										"--offline",
+										"--cache-dir", self.tempdir.name,
+										"--symbol-index",
+										os.path.join(self.tempdir.name,
+													"symbols.json.gz")])
+		stdout = io.StringIO()
+		stderr = io.StringIO()
+		try:
+			with patch('sys.stdout', stdout), patch('sys.stderr', stderr):
+				self.assertEqual(lrgp.main(arguments), False)
+		finally:
+			ws.set_cache(ws._default_cache)
+			ws.OFFLINE = False
+			ws.SYMBOL_INDEX_FILE = symbolindex.DEFAULT_INDEX_FILE
+		lines = stdout.getvalue().splitlines()
+		self.assertEqual(len(lines), 1 + 40 + 14 + 13)
+		self.assertTrue(lines[0].startswith("track name="))
+		self.assertTrue(all(len(line.split("\t")) == 4 for line in lines[1:]))
+		self.assertIn("No cached LRG is available offline for: LRG_9999",
+					stderr.getvalue())
+		self.assertIn("2 succeeded, 3 failed", stderr.getvalue())
+		arguments = lrgp.arg_collection(["-d", "testfiles", "-o", "-"])
+		with patch('sys.stdout', stdout), patch('sys.stderr', stderr):
+			with self.assertRaises(SystemExit):
+				lrgp.main(arguments)
+		self.assertEqual(len(stdout.getvalue().splitlines()), len(lines))
+
+	def test_run_batch_merged(self):
+		"""Checks that rows of different transcripts and genes are merged
+		in a combined BED file
+		"""
+		output = os.path.join(self.tempdir.name, "merged.bed")
+		with open(self.manifest, "a") as manifest_file:
+			manifest_file.write("testfiles/LRG_384.xml\tGRCh37.p13\t" +
+								"NM_000257.3\t0\tn\n")
+		batch.run_batch(self.manifest, output, merge=True)
+		with open(output) as bed_file:
+			lines = bed_file.read().splitlines()
+		# The flanked exons and introns of LRG_155 join into one row
+		self.assertEqual(len(lines), 1 + 1 + 40)
+		self.assertEqual(lines[1].split("\t")[3],
+						"CD46_NM_002389.4_Exon_1-14,CD46_NM_002389.4_Intron_1-13")
+		# Exon 1 of NM_000257.3 is longer, so the merged row spans both
+		self.assertEqual(lines[-1], "chr14\t23904828\t23904895\t" +
+					"MYH7_NM_000257.2_Exon_1,MYH7_NM_000257.3_Exon_1")
+
+	def test_process_xml_file(self):
+		"""Checks that a BED file is written for every transcript when none
+		is given, and that a missing transcript is reported
+		"""
+		result = batch.process_xml_file("testfiles/LRG_384.xml", "GRCh37.p13",
+										None, 0, False, self.tempdir.name,
+										"timestamp")
+		self.assertEqual(result[:3], ("testfiles/LRG_384.xml", True,
+									"3 BED files written"))
+		self.assertIn("BED file successfully written", result[3])
+		result = batch.process_xml_file("testfiles/LRG_384.xml", "GRCh37.p13",
+										"invalid_transcript", 0, False,
+										self.tempdir.name, "timestamp")
+		self.assertEqual(result[1], False)
+
+	def test_process_xml_file_failures(self):
+		"""Checks that XML that is not an LRG and unexpected errors fail
+		only the file they occur in
+		"""
+		not_lrg = os.path.join(self.tempdir.name, "catalog.xml")
+		with open(not_lrg, "w") as xml_file:
+			xml_file.write("<catalog><book id=\"1\">x</book></catalog>")
+		result = batch.process_xml_file(not_lrg, None, None, 0, False,
+										self.tempdir.name, "timestamp")
+		self.assertEqual(result[1], False)
+		self.assertIn("Not an LRG XML file", result[2])
+		with patch('bedgen.create_bed_filename',
+					side_effect=TypeError("hgnc_name is None")):
+			result = batch.process_xml_file("testfiles/LRG_384.xml", None,
+											None, 0, False,
+											self.tempdir.name, "timestamp")
+		self.assertEqual(result[1], False)
+		self.assertIn("hgnc_name is None", result[2])
+
+	def test_run_directory_duplicate_lrg(self):
+		"""Checks that a second file holding the same LRG fails rather than
+		overwrite the BED files of the first
+		"""
+		directory = os.path.join(self.tempdir.name, "lrgs")
+		os.mkdir(directory)
+		with open("testfiles/LRG_384.xml", "rb") as xml_file:
+			contents = xml_file.read()
+		with open(os.path.join(directory, "LRG_384.xml"), "wb") as f:
+			f.write(contents)
+		with gzip.open(os.path.join(directory, "LRG_384.xml.gz"), "wb") as f:
+			f.write(contents)
+		with open(os.path.join(directory, "LRG_384_new.xml"), "wb") as f:
+			f.write(contents)
+		output_directory = os.path.join(self.tempdir.name, "beds")
+		summary = io.StringIO()
+		with patch('sys.stdout', summary):
+			self.assertEqual(batch.run_directory(directory, "GRCh37.p13",
+												"NM_000257.2", 0, False,
+												output_directory), False)
+		self.assertEqual(len(os.listdir(output_directory)), 1)
+		self.assertIn("OK     1 LRG_384.xml", summary.getvalue())
+		self.assertIn("FAILED 2 LRG_384.xml.gz: Same LRG as LRG_384.xml",
+					summary.getvalue())
+		self.assertIn("FAILED 3 LRG_384_new.xml: Same LRG as LRG_384.xml",
+					summary.getvalue())
+
+	@patch('bedgen.INCREMENTAL', True)
+	def test_run_directory_incremental(self):
+		"""Checks that incremental filenames depend only on the inputs, and
+		that up to date BED files are not written again
+		"""
+		output_directory = os.path.join(self.tempdir.name, "beds")
+		batch.run_directory("testfiles", "GRCh37.p13", "NM_000257.2", 0,
+							False, output_directory)
+		filenames = sorted(os.listdir(output_directory))
+		self.assertEqual(len(filenames), 2)
+		self.assertTrue(filenames[0].startswith(
+				"MYH7_LRG_384_NM_000257.2_GRCh37.p13_flank0_exons_20181121-"))
+		with patch('bedgen.write_bed_file') as write_bed_file:
+			result = batch.process_xml_file("testfiles/LRG_384.xml",
+											"GRCh37.p13", "NM_000257.2", 0,
+											False, output_directory,
+											"timestamp")
+			write_bed_file.assert_not_called()
+		self.assertEqual(result[2], "0 BED files written, 1 up to date")
+		self.assertEqual(sorted(os.listdir(output_directory)), filenames)
+
+	def test_run_directory_workers(self):
+		"""Checks that a directory can be processed by a pool of workers"""
+		output_directory = os.path.join(self.tempdir.name, "beds")
+		self.assertEqual(batch.run_directory("testfiles", "GRCh37.p13",
+											"NM_000257.2", 0, False,
+											output_directory, workers=2),
+						False)
+		self.assertEqual(len(os.listdir(output_directory)), 1)
+
+
+class BenchmarkTests(TestCase):
+	"""Tests designed to test the functions contained within the
+	benchmark.py file.
+	"""
+
+	def test_generate_lrg_xml(self):
+		"""Checks that a synthetic LRG has the requested builds, transcripts
+		and exons, and that BED rows can be generated from it
+		"""
+		root = lrgp.get_tree_and_root_string(
+					benchmark.generate_lrg_xml(exons=25, transcripts=3,
+												builds=2).decode('utf-8'))
+		genomebuilds = lrgp.get_genome_builds(root)
+		transcripts = lrgp.get_transcript_ids(root)
+		self.assertEqual(len(genomebuilds), 2)
+		self.assertEqual(len(transcripts), 3)
+		for genome_choice in genomebuilds:
+			for transcript_choice in transcripts:
+				lrg_object = lrgp.lrg_object_creator(root, genome_choice,
+													transcript_choice, 0)
+				bedcontents = bg.create_bed_contents(lrg_object, True)
+				self.assertEqual(len(bedcontents), 49)
+				self.assertTrue(all(row[1] < row[2] for row in bedcontents))
+
+	def test_run_benchmark(self):
+		"""Checks that every stage is timed and the report is JSON"""
+		record = benchmark.run_benchmark(exons=5, transcripts=2, builds=1,
+										sequence_length=10000, repeat=1)
+		self.assertEqual(list(record['stages']), benchmark.STAGES)
+		for result in record['stages'].values():
+			self.assertGreater(result['best_seconds'], 0)
+			self.assertGreater(result['peak_memory_bytes'], 0)
+			self.assertIn(result['unit'] + '_per_second', result)
+		self.assertEqual(record['stages']['create_bed_contents']['items'], 18)
+		self.assertEqual(json.loads(json.dumps(record)), record)
+
+
+class ProfilingTests(TestCase):
+	"""Tests designed to test the functions contained within the
+	profiling.py file.
+	"""
+
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		profiling.disable()
+		self.tempdir.cleanup()
+
+	def test_disabled(self):
+		"""Checks that nothing is recorded while profiling is disabled"""
+		profiling.enable()
+		profiling.disable()
+		with profiling.timer('parse'):
+			profiling.count('exons', 10)
+		self.assertEqual(profiling.report()['stages'], {})
+		self.assertEqual(profiling.report()['counters'], {})
+
+	def test_main_profile(self):
+		"""Checks that --profile reports each stage of a run and --cprofile
+		writes a dump readable by pstats
+		"""
+		report_file = os.path.join(self.tempdir.name, "profile.json")
+		cprofile_file = os.path.join(self.tempdir.name, "run.prof")
+		arguments = lrgp.arg_collection(["-f", "testfiles/LRG_384.xml",
+										"-r", "GRCh37.p13",
+										"-t", "NM_000257.2", "-i",
+										"-o", os.path.join(self.tempdir.name,
+															"LRG_384.bed"),
+										"--profile", report_file,
+										"--cprofile", cprofile_file])
+		self.assertEqual(lrgp.main(arguments), True)
+		self.assertFalse(profiling.ENABLED)
+		with open(report_file) as f:
+			report = json.load(f)
+		for stage in ['parse', 'index', 'exon_coords', 'lrg_object_creator',
+						'bed_write']:
+			self.assertEqual(report['stages'][stage]['calls'], 1)
+		self.assertEqual(report['counters']['exons'], 40)
+		self.assertEqual(report['counters']['introns'], 39)
+		self.assertGreater(report['counters']['elements_parsed'], 0)
+		self.assertTrue(pstats.Stats(cprofile_file).total_calls > 0)
+
+	def test_directory_workers_profile(self):
+		"""Checks that the counters of worker processes are added to the
+		report, giving the same counts as a single process
+		"""
+		counters = []
+		for workers in [1, 2]:
+			output_directory = os.path.join(self.tempdir.name, str(workers))
+			profiling.enable()
+			with patch('sys.stdout', io.StringIO()):
+				batch.run_directory("testfiles", "GRCh37.p13", "NM_000257.2",
+									0, False, output_directory, workers)
+			profiling.disable()
+			counters.append(profiling.report()['counters'])
+			# LRG_384_new.xml holds the same LRG as LRG_384.xml, so fails
+			self.assertEqual(
+					profiling.report()['stages']['exon_coords']['calls'], 1)
+		self.assertEqual(counters[0]['bed_files_written'], 1)
+		self.assertEqual(counters[0], counters[1])
+
+
+class ServerTests(TestCase):
+	"""Tests designed to test the functions contained within the
+	server.py file.
+	"""
+
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+		self.archive_file = os.path.join(self.tempdir.name, "corpus.lrga")
+		archive.pack_archive("testfiles", self.archive_file)
+		self.httpd = server.create_server("127.0.0.1", 0, 8, self.archive_file)
+		self.url = "http://127.0.0.1:" + str(self.httpd.server_address[1])
+		threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+	def tearDown(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+		self.tempdir.cleanup()
+
+	def request(self, path, body=None):
+		"""Returns the status and JSON response of a request"""
+		data = None if body is None else json.dumps(body).encode('utf-8')
+		try:
+			with urllib.request.urlopen(self.url + path, data) as response:
+				return response.status, json.load(response)
+		except urllib.error.HTTPError as error:
+			return error.code, json.load(error)
+
+	@patch('webservices.search_by_lrg')
+	def test_bed_request(self, search_by_lrg):
+		"""Checks that BED rows are returned from the archive, and that the
+		parsed LRG is reused by later requests
+		"""
+		status, response = self.request("/bed?lrg=LRG_384&build=GRCh37.p13" +
+										"&transcript=NM_000257.2&flank=50")
+		self.assertEqual(status, 200)
+		self.assertEqual(len(response['rows']), 40)
+		lrg_object = lrgp.lrg_object_creator(
+						lrgp.get_tree_and_root_file("testfiles/LRG_384.xml"),
+						"GRCh37.p13", "NM_000257.2", 50)
+		self.assertEqual(response['rows'],
+						bg.create_bed_contents(lrg_object, False))
+		status, response = self.request("/bed", {'lrg': 'LRG_384',
+												'build': 'GRCh37.p13',
+												'transcript': 'NM_000257.2',
+												'introns': True})
+		self.assertEqual(status, 200)
+		self.assertEqual(len(response['rows']), 79)
+		status, health = self.request("/health")
+		self.assertEqual((health['cached'], health['misses'], health['hits']),
+						(1, 1, 1))
+		status, response = self.request("/bed?lrg=lrg_384&build=GRCh37.p13" +
+										"&transcript=NM_000257.2&flank=6000")
+		self.assertEqual(status, 200)
+		self.assertEqual(response['flank'], 6000)
+		status, health = self.request("/health")
+		self.assertEqual((health['cached'], health['misses'], health['hits']),
+						(1, 1, 2))
+		search_by_lrg.assert_not_called()
+
+	@patch('webservices.search_by_hgnc', return_value="LRG_384")
+	def test_gene_request(self, search_by_hgnc):
+		"""Checks that the LRG ID of a gene is searched for once and reused
+		by later requests for the gene in any case
+		"""
+		for gene in ["MYH7", "myh7", "MYH7"]:
+			status, response = self.request("/bed?gene=" + gene +
+											"&build=GRCh37.p13" +
+											"&transcript=NM_000257.2")
+			self.assertEqual(status, 200)
+			self.assertEqual(response['lrg_id'], "LRG_384")
+		search_by_hgnc.assert_called_once_with("MYH7")
+
+	def test_invalid_requests(self):
+		"""Checks that invalid requests are answered with an error"""
+		self.assertEqual(self.request("/bed?build=GRCh37.p13")[0], 400)
+		self.assertEqual(self.request("/bed?lrg=LRG_384&build=GRCh37.p13" +
+									"&transcript=NM_1.1")[0], 404)
+		self.assertEqual(self.request("/bed?lrg=LRG_384&build=GRCh37.p13" +
+									"&transcript=NM_000257.2&flank=x")[0],
+						400)
+		self.assertEqual(self.request("/bed?lrg=LRG_384&build=GRCh37.p13" +
+									"&transcript=NM_000257.2&flank=-1")[0],
+						400)
+		self.assertEqual(self.request("/bed?lrg=../LRG_384&build=GRCh37.p13" +
+									"&transcript=NM_000257.2")[0], 400)
+		self.assertEqual(self.request("/other")[0], 404)
+
+	def test_concurrent_requests(self):
+		"""Checks that concurrent requests for several LRGs are answered and
+		that the cache stays within its size
+		"""
+		self.httpd.lrg_cache.maxsize = 1
+		paths = ["/bed?lrg=LRG_384&build=GRCh37.p13&transcript=NM_000257.2",
+				"/bed?lrg=LRG_155&build=GRCh37.p13&transcript=NM_002389.4"]
+		results = []
+		threads = [threading.Thread(target=lambda path=path:
+						results.append(self.request(path)[0]))
+					for path in paths * 4]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(results, [200] * 8)
+		self.assertEqual(len(self.httpd.lrg_cache), 1)
+		self.assertEqual(self.httpd.lrg_cache._loading, {})
+
+	def test_single_load(self):
+		"""Checks that concurrent requests for one LRG load it only once"""
+		lrg_cache = server.LRGIndexCache(8, self.archive_file)
+		load = lrg_cache._load
+		def slow_load(lrg_id):
+			time.sleep(0.05)
+			return load(lrg_id)
+		with patch.object(lrg_cache, '_load', side_effect=slow_load) as loads:
+			threads = [threading.Thread(target=lrg_cache.get,
+										args=("LRG_384",))
+						for number in range(8)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			lrg_cache.get("lrg_384")
+		self.assertEqual(loads.call_count, 1)
+		self.assertEqual(len(lrg_cache), 1)
+
+
+class XMLBackendTests(TestCase):
+	"""Tests designed to test the functions contained within the
+	xmlbackend.py file.
+	"""
+
+	def test_backends_agree(self):
+		"""Checks that every installed backend gives the same pruned root
+		as the standard library parser for each test file
+		"""
+		for xml_file in ["testfiles/LRG_384.xml", "testfiles/LRG_155.xml",
+						"testfiles/LRG_384_new.xml"]:
+			with open(xml_file, "rb") as f:
+				xml_contents = f.read()
+			expected = ET.tostring(xmlbackend.parse_pruned(
+							io.BytesIO(xml_contents), lrgp.LRG_KEPT_ELEMENTS,
+							'etree'))
+			for backend in xmlbackend.available_backends():
+				root = xmlbackend.parse_pruned(io.BytesIO(xml_contents),
+												lrgp.LRG_KEPT_ELEMENTS, backend)
+				self.assertEqual(ET.tostring(root), expected)
+				self.assertEqual(len(list(root.iter('sequence'))), 0)
+
+	def test_set_backend(self):
+		"""Checks that the default backend is the fastest installed, and
+		that an unknown backend is rejected
+		"""
+		self.assertEqual(xmlbackend.get_backend(),
+						xmlbackend.available_backends()[0])
+		self.assertIn('etree', xmlbackend.available_backends())
+		with self.assertRaises(ValueError):
+			xmlbackend.set_backend('expat')
+		try:
+			xmlbackend.set_backend('etree')
+			root = lrgp.get_tree_and_root_file("testfiles/LRG_384.xml")
+			self.assertEqual(lrgp.get_genome_builds(root),
+							['GRCh37.p13', 'GRCh38.p12'])
+		finally:
+			xmlbackend.set_backend(None)
+
+
+class CoprocessTests(TestCase):
+	"""Tests designed to test the functions contained within the
+	coprocess.py file.
+	"""
+
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self.tempdir.cleanup()
+
+	def test_run_coprocess(self):
+		"""Checks that one result is written per job, in order, that each
+		file is parsed once, and that only results are written to stdout
+		"""
+		output = os.path.join(self.tempdir.name, "LRG_384.bed")
+		jobs = [{'id': number, 'file': "testfiles/LRG_384.xml",
+				'build': "GRCh37.p13", 'transcript': "NM_000257.2",
+				'flank': number} for number in range(20)]
+		jobs.append({'id': 'file', 'file': "testfiles/LRG_384.xml",
+					'build': "GRCh37.p13", 'transcript': "NM_000257.2",
+					'introns': True, 'output': output})
+		jobs.append({'id': 'missing', 'file': "testfiles/LRG_1.xml",
+					'build': "GRCh37.p13", 'transcript': "NM_000257.2"})
+		jobs.append({'id': 'flank', 'file': "testfiles/LRG_384.xml",
+					'build': "GRCh37.p13", 'transcript': "NM_000257.2",
+					'flank': 6000})
+		lines = "\n".join([json.dumps(job) for job in jobs] + ["", "[1]"])
+		results = io.StringIO()
+		with patch('xmlbackend.parse_pruned',
+					wraps=xmlbackend.parse_pruned) as parse:
+			self.assertEqual(coprocess.run_coprocess(io.StringIO(lines),
+													results), False)
+		self.assertEqual(parse.call_count, 1)
+
+		results = [json.loads(line) for line in
+					results.getvalue().splitlines()]
+		self.assertEqual([result['id'] for result in results],
+						list(range(20)) + ['file', 'missing', 'flank', None])
+		for result in results:
+			self.assertEqual(sorted(set(result) & {'id', 'ok', 'cached',
+													'seconds'}),
+							['cached', 'id', 'ok', 'seconds'])
+		root = lrgp.get_tree_and_root_file("testfiles/LRG_384.xml")
+		for number in (0, 19):
+			lrg_object = lrgp.lrg_object_creator(root, "GRCh37.p13",
+												"NM_000257.2", number)
+			self.assertEqual(results[number]['rows'],
+							bg.create_bed_contents(lrg_object, False))
+		self.assertTrue(all(result['cached'] for result in results[1:20]))
+		self.assertEqual(results[20]['output'], output)
+		with open(output) as bed_file:
+			self.assertEqual(len(bed_file.read().splitlines()), 80)
+		self.assertEqual([result['ok'] for result in results[20:]],
+						[True, False, True, False])
+		self.assertEqual([result['cached'] for result in results[20:]],
+						[True, False, True, False])
+		self.assertEqual(results[22]['flank'], 6000)
+
+	def test_main_exit_status(self):
+		"""Checks that --jsonl exits with status 1 when a job failed"""
+		job = {'file': "testfiles/LRG_384.xml", 'build': "GRCh37.p13",
+				'transcript': "NM_000257.2"}
+		for transcript, returncode in [("NM_000257.2", 0), ("NM_1.1", 1)]:
+			output = subprocess.run([sys.executable, "lrgparser.py",
+									"--jsonl"],
+									input=json.dumps(dict(job,
+										transcript=transcript)) + "\n",
+									capture_output=True, text=True)
+			self.assertEqual(output.returncode, returncode)
+			self.assertEqual(len(output.stdout.splitlines()), 1)
+
+
 class UITests(TestCase):
 	"""Tests designed to test the functions contained within the
 	ui.py file. User input with input() is simulated using the @patch
@@ -6,14 +6,44 @@ lrg-sequence.org
 """
 
 
-import urllib.request
-import lrgparser
+import datetime
+import http.client
+import io
+import urllib.parse
+import httppool
+import lrgcache
+import symbolindex
+import xmlbackend
+
+# XML Related Imports
+import xml.etree.ElementTree as ET
+
+
+# EBI search REST API used to find the LRG ID of a HGNC gene name
+HGNC_SEARCH_URL = "https://www.ebi.ac.uk/ebisearch/ws/rest/lrg?query=name:"
+# Location of the LRG XML files
+LRG_XML_URL = "http://ftp.ebi.ac.uk/pub/databases/lrgex/"
+# Local index of gene names to LRG IDs searched before the REST API
+SYMBOL_INDEX_FILE = symbolindex.DEFAULT_INDEX_FILE
+# When True, LRG XML files are only served from the cache
+OFFLINE = False
+
+# Number of genes resolved at the same time by resolve_genes()
+DEFAULT_CONCURRENCY = 8
+
+# Keep-alive connections shared by every request to the EBI servers
+connection_pool = httppool.HTTPConnectionPool()
+
+# Placeholder meaning the default cache has not been created yet
+_default_cache = object()
+_cache = _default_cache
 
 
 def search_by_hgnc(searchterm):
 	"""Searches the lrg-sequence database for the provided HGNC searchterm 
 	using the REST API. Returns a matching LRG ID extracted from the search
-	results XML file (Note: Not an LRG XML file)
+	results XML file (Note: Not an LRG XML file). The local symbol index is
+	searched first, and in offline mode it is the only source used.
 	
 	Args:
 		searchterm (str): HGNC name search term to query the ebi.ac.uk site
@@ -21,10 +51,21 @@ def search_by_hgnc(searchterm):
 		lrg_id (str): LRG ID that matches the HGNC gene input
 
 	"""
-	url = "https://www.ebi.ac.uk/ebisearch/ws/rest/lrg?query=name:"+searchterm
-	queryresults = urllib.request.urlopen(url)
-	xml_file = queryresults.read()
-	root = lrgparser.get_tree_and_root_string(xml_file)
+	lrg_id = symbolindex.lookup(searchterm, SYMBOL_INDEX_FILE)
+	if lrg_id != None:
+		return lrg_id
+	if OFFLINE:
+		print("No LRG is available offline in the symbol index for: " +
+				searchterm)
+		raise SystemExit
+
+	url = HGNC_SEARCH_URL + urllib.parse.quote(searchterm)
+	queryresults = connection_pool.request(url)
+	if queryresults.status != 200:
+		print("No LRG is available for: " + searchterm)
+		raise SystemExit
+	xml_file = queryresults.body
+	root = ET.fromstring(xml_file)
 	# Looks to see whether the returned XML file contains a match for the
 	# search term
 	try:
@@ -37,7 +78,10 @@ def search_by_hgnc(searchterm):
 
 def search_by_lrg(searchterm):
 	"""Searches the lrg-sequence database for the provided LRG ID searchterm 
-	using the REST API. Returns the matching LRG XML file.
+	using the REST API. Returns the matching LRG XML file. Downloaded files
+	are kept in the LRG cache; a fresh cached copy is returned without a
+	network request, and a stale copy is revalidated against its
+	modification_date. In offline mode only the cache is used.
 	
 	Args:
 		searchterm (str): LRG ID in the format 'LRG_123'
@@ -45,11 +89,137 @@ def search_by_lrg(searchterm):
 		xml_file (str): Contents of the returned XML file
 
 	"""
-	url = "http://ftp.ebi.ac.uk/pub/databases/lrgex/"+searchterm+".xml"
+	lrg_cache = get_cache()
+	if lrg_cache != None:
+		xml_file = lrg_cache.get(searchterm)
+		if xml_file != None:
+			return xml_file
+		stale_xml_file = lrg_cache.get(searchterm, allow_stale=True)
+	else:
+		stale_xml_file = None
+
+	if OFFLINE:
+		if stale_xml_file != None:
+			return stale_xml_file
+		print("No cached LRG is available offline for: " + searchterm)
+		raise SystemExit
+
+	url = LRG_XML_URL + searchterm + ".xml"
+	headers = {}
+	if stale_xml_file != None:
+		modification_date = lrg_cache.modification_date(searchterm)
+		if modification_date != None:
+			headers["If-Modified-Since"] = http_date(modification_date)
 	try:
-		queryresults = urllib.request.urlopen(url)
-		xml_file = queryresults.read()
-	except urllib.error.HTTPError:
+		queryresults = connection_pool.request(url, headers)
+	except (OSError, http.client.HTTPException):
+		if stale_xml_file != None:
+			print("Could not reach the LRG site, using the cached copy of " +
+					searchterm)
+			return stale_xml_file
+		raise
+	if queryresults.status == 304 and stale_xml_file != None:
+		# Not modified since the cached copy, so it is fresh again
+		lrg_cache.touch(searchterm)
+		return stale_xml_file
+	if queryresults.status != 200:
 		print("No LRG is available for the search term: " + searchterm)
 		raise SystemExit
+	xml_file = queryresults.body
+	if lrg_cache != None:
+		lrg_cache.put(searchterm, xml_file)
 	return(xml_file)
+
+
+def resolve_genes(searchterms, concurrency=DEFAULT_CONCURRENCY):
+	"""Resolves many HGNC gene names or LRG IDs to parsed LRG XML roots at
+	once. Up to 'concurrency' lookups and downloads run at the same time,
+	and each XML file is parsed as soon as its download completes, so the
+	total time approaches that of the slowest single lookup.
+
+	Args:
+		searchterms (list): HGNC gene names or LRG IDs in the format 'LRG_123'
+		concurrency (int): Maximum number of lookups running at once
+	Returns:
+		results (dict): Search term -> root (xml.etree.ElementTree), or None
+						if no LRG could be found or downloaded
+	"""
+	import asyncio
+	return asyncio.run(_resolve_genes(searchterms, concurrency))
+
+
+async def _resolve_genes(searchterms, concurrency):
+	"""Coroutine behind resolve_genes()"""
+	import asyncio
+	semaphore = asyncio.Semaphore(max(1, concurrency))
+	# Results are keyed in the order of the search terms, whatever order
+	# the downloads finish in
+	results = dict.fromkeys(searchterms)
+	tasks = [asyncio.ensure_future(_fetch_lrg(searchterm, semaphore))
+			for searchterm in results]
+	for task in asyncio.as_completed(tasks):
+		searchterm, xml_file = await task
+		if xml_file is None:
+			results[searchterm] = None
+			continue
+		try:
+			results[searchterm] = xmlbackend.parse_pruned(
+												io.BytesIO(xml_file),
+												xmlbackend.LRG_KEPT_ELEMENTS)
+		except Exception:
+			print("LRG XML could not be parsed for: " + searchterm)
+			results[searchterm] = None
+	return results
+
+
+async def _fetch_lrg(searchterm, semaphore):
+	"""Looks up and downloads the LRG XML file for one search term. The
+	blocking web service calls are run in worker threads.
+
+	Returns:
+		(searchterm, xml_file): xml_file is None if the lookup failed
+	"""
+	import asyncio
+	async with semaphore:
+		try:
+			if searchterm.upper().startswith('LRG_'):
+				lrg_id = searchterm
+			else:
+				lrg_id = await asyncio.to_thread(search_by_hgnc, searchterm)
+			xml_file = await asyncio.to_thread(search_by_lrg, lrg_id)
+		except (SystemExit, Exception):
+			# Nothing may leave the task: a SystemExit would stop the event
+			# loop, and any other error, e.g a search response that is not
+			# XML, would end every other lookup with it
+			xml_file = None
+	return searchterm, xml_file
+
+
+def get_cache():
+	"""Returns the LRG cache used by search_by_lrg, creating it on first use.
+	Returns None when caching has been disabled with set_cache(None).
+	"""
+	global _cache
+	if _cache is _default_cache:
+		_cache = lrgcache.LRGCache()
+	return _cache
+
+
+def set_cache(lrg_cache):
+	"""Sets the LRG cache used by search_by_lrg. None disables caching.
+
+	Args:
+		lrg_cache (LRGCache): The cache to use, or None
+	"""
+	global _cache
+	_cache = lrg_cache
+
+
+def http_date(modification_date):
+	"""Converts an LRG modification_date (e.g 2018-11-21) to the date format
+	used in HTTP headers.
+	"""
+	import email.utils
+	date = datetime.datetime.strptime(modification_date, "%Y-%m-%d")
+	return email.utils.format_datetime(
+						date.replace(tzinfo=datetime.timezone.utc), usegmt=True)
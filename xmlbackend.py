@@ -0,0 +1,173 @@
+"""
+This module contains the XML parsers behind the streaming loader in
+lrgparser. Each backend reads an LRG XML file and returns the same pruned
+xml.etree.ElementTree root, holding only the elements listed in the kept
+elements table, so the rest of the program does not depend on the parser.
+
+Backends:
+	lxml: Parses with libxml2, clearing the <sequence> blocks as they are
+		read, then copies the kept elements into an ElementTree root.
+		Used when lxml is installed.
+	etree: The standard library parser, pruning unwanted elements as they
+		are read. Always available.
+"""
+
+
+import io
+
+import profiling
+
+# XML Related Imports
+import xml.etree.ElementTree as ET
+
+
+# Elements of an LRG XML file kept by the streaming loader, listed by the tag
+# of their parent. Everything else is discarded while it is being parsed.
+LRG_KEPT_ELEMENTS = {
+	'lrg': ('fixed_annotation', 'updatable_annotation'),
+	'fixed_annotation': ('id', 'hgnc_id', 'sequence_source', 'mol_type'),
+	'updatable_annotation': ('annotation_set',),
+	'annotation_set': ('mapping', 'lrg_locus', 'modification_date'),
+	'mapping': ('mapping_span',),
+}
+
+# Backend used by parse_pruned(), or None to use the fastest one installed
+BACKEND = None
+
+# Backends in order of preference
+BACKEND_NAMES = ('lxml', 'etree')
+
+# lxml.etree once imported, or False if it is not installed
+_lxml = None
+
+
+def _import_lxml():
+	"""Imports lxml.etree on first use. Returns it, or None if it is not
+	installed
+	"""
+	global _lxml
+	if _lxml is None:
+		try:
+			from lxml import etree as lxml_etree
+			_lxml = lxml_etree
+		except ImportError:
+			_lxml = False
+	return _lxml or None
+
+
+def available_backends():
+	"""Returns the names of the backends that can be used, fastest first"""
+	return [name for name in BACKEND_NAMES
+			if name != 'lxml' or _import_lxml() is not None]
+
+
+def get_backend():
+	"""Returns the name of the backend used by parse_pruned()"""
+	if BACKEND != None:
+		return BACKEND
+	return available_backends()[0]
+
+
+def set_backend(name):
+	"""Chooses the backend used by parse_pruned().
+
+	Args:
+		name (str): 'lxml', 'etree', or None to use the fastest installed
+	Raises:
+		ValueError: If the backend is unknown or not installed
+	"""
+
+	global BACKEND
+	if name != None and name not in available_backends():
+		raise ValueError("XML backend not available: " + str(name))
+	BACKEND = name
+
+
+def parse_pruned(xml_source, kept_elements, backend=None):
+	"""Parses an XML file object, keeping only the listed elements.
+
+	Args:
+		xml_source (file): XML file object
+		kept_elements (dict): Parent tag -> tuple of the child tags kept
+								below it. The root is always kept.
+		backend (str): Backend to use, or None for get_backend()
+	Returns:
+		root (xml.etree.ElementTree): ElementTree object representing the
+										pruned root of the XML file
+	"""
+
+	# lxml only reads binary file objects
+	if ((backend or get_backend()) == 'lxml' and
+			not isinstance(xml_source, io.TextIOBase)):
+		return _parse_pruned_lxml(xml_source, kept_elements)
+	return _parse_pruned_etree(xml_source, kept_elements)
+
+
+def _parse_pruned_etree(xml_source, kept_elements):
+	"""Prunes the XML with the standard library parser. Every element that
+	is not kept is cleared as soon as it has been read.
+	"""
+	root = None
+	# Stack of (element, keep) pairs for the currently open elements
+	open_elements = []
+	elements_parsed = 0
+	for event, element in ET.iterparse(xml_source, events=('start', 'end')):
+		if event == 'start':
+			elements_parsed += 1
+			if root is None:
+				root = element
+				keep = True
+			else:
+				parent, parent_keep = open_elements[-1]
+				keep = (parent_keep and
+						element.tag in kept_elements.get(parent.tag, ()))
+			open_elements.append((element, keep))
+		else:
+			element, keep = open_elements.pop()
+			if not keep:
+				# Free the text and children of unwanted elements as soon as
+				# they have been read. The outermost unwanted element is also
+				# detached from the kept tree.
+				element.clear()
+				parent, parent_keep = open_elements[-1]
+				if parent_keep:
+					parent.remove(element)
+
+	profiling.count('elements_parsed', elements_parsed)
+	return root
+
+
+def _parse_pruned_lxml(xml_source, kept_elements):
+	"""Prunes the XML with lxml. libxml2 builds the tree, with the large
+	<sequence> blocks cleared as they end, and the kept elements are then
+	copied into an ElementTree root. lxml elements are not used directly as
+	they cannot be weakly referenced, which the LRG index cache needs.
+	"""
+	lxml_etree = _import_lxml()
+	context = lxml_etree.iterparse(xml_source, events=('end',),
+									tag='sequence', huge_tree=True,
+									resolve_entities=False)
+	for event, element in context:
+		element.clear()
+	lxml_root = context.root
+
+	if profiling.ENABLED:
+		profiling.count('elements_parsed',
+						int(lxml_root.xpath('count(//*)')))
+
+	root = ET.Element(lxml_root.tag, dict(lxml_root.attrib))
+	root.text = lxml_root.text
+	# Stack of (lxml element, ElementTree copy) pairs still to be copied
+	pending = [(lxml_root, root)]
+	while pending:
+		source, copy = pending.pop()
+		kept_tags = kept_elements.get(source.tag, ())
+		if not kept_tags:
+			continue
+		for child in source:
+			if child.tag in kept_tags:
+				child_copy = ET.SubElement(copy, child.tag, dict(child.attrib))
+				child_copy.text = child.text
+				child_copy.tail = child.tail
+				pending.append((child, child_copy))
+	return root